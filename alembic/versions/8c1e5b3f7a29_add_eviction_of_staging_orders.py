@@ -0,0 +1,41 @@
+"""Add eviction of staging orders
+
+Revision ID: 8c1e5b3f7a29
+Revises: 4a6d2f8e0c13
+Create Date: 2017-04-18 13:22:05.914377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1e5b3f7a29'
+down_revision = '4a6d2f8e0c13'
+branch_labels = None
+depends_on = None
+
+
+old_staging_status = sa.Enum('pending', 'staging_failed', 'staging_in_progress', 'staging_verifying',
+                             'staging_successful', name='stagingstatus')
+new_staging_status = sa.Enum('pending', 'staging_failed', 'staging_in_progress', 'staging_verifying',
+                             'staging_successful', 'evicted', name='stagingstatus')
+
+
+def upgrade():
+    # SQLite enforces the values of an enum with a check constraint, so the table has to be recreated
+    with op.batch_alter_table('staging_orders') as batch_op:
+        batch_op.add_column(sa.Column('last_used_at', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('evicted_at', sa.Float(), nullable=True))
+        batch_op.alter_column('status', existing_type=old_staging_status, type_=new_staging_status,
+                              existing_nullable=False)
+
+
+def downgrade():
+    # The staged files of evicted orders are gone, so they can not be successful any longer
+    op.execute("UPDATE staging_orders SET status = 'staging_failed' WHERE status = 'evicted'")
+    with op.batch_alter_table('staging_orders') as batch_op:
+        batch_op.alter_column('status', existing_type=new_staging_status, type_=old_staging_status,
+                              existing_nullable=False)
+        batch_op.drop_column('evicted_at')
+        batch_op.drop_column('last_used_at')
@@ -0,0 +1,28 @@
+"""Add priority to staging orders
+
+Revision ID: d5b8e2f4c6a1
+Revises: 8c1e5b3f7a29
+Create Date: 2017-04-25 10:41:37.208611
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5b8e2f4c6a1'
+down_revision = '8c1e5b3f7a29'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('staging_orders') as batch_op:
+        batch_op.add_column(sa.Column('priority', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('queued_at', sa.Float(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('staging_orders') as batch_op:
+        batch_op.drop_column('queued_at')
+        batch_op.drop_column('priority')
@@ -0,0 +1,25 @@
+"""Add pids to staging orders
+
+Revision ID: f2c9a4d7b3e8
+Revises: d5b8e2f4c6a1
+Create Date: 2017-05-02 09:14:52.630184
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c9a4d7b3e8'
+down_revision = 'd5b8e2f4c6a1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('staging_orders', sa.Column('pids', sa.String(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('staging_orders') as batch_op:
+        batch_op.drop_column('pids')
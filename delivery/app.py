@@ -15,17 +15,28 @@ from delivery.handlers.utility_handlers import VersionHandler
 from delivery.handlers.runfolder_handlers import RunfolderHandler
 from delivery.handlers.project_handlers import ProjectHandler, ProjectsForRunfolderHandler
 from delivery.handlers.delivery_handlers import DeliverByStageIdHandler, DeliveryStatusHandler
-from delivery.handlers.staging_handlers import StagingRunfolderHandler, StagingHandler, StageGeneralDirectoryHandler
+from delivery.handlers.staging_handlers import StagingRunfolderHandler, StagingHandler, StageGeneralDirectoryHandler, \
+    BulkStagingHandler
+from delivery.handlers.admin_handlers import BandwidthLimitsHandler
+
+from delivery.models.db_models import StagingMode
 
 from delivery.repositories.runfolder_repository import FileSystemBasedRunfolderRepository
 from delivery.repositories.staging_repository import DatabaseBasedStagingRepository
 from delivery.repositories.deliveries_repository import DatabaseBasedDeliveriesRepository
-from delivery.repositories.project_repository import GeneralProjectRepository
+from delivery.repositories.project_repository import GeneralProjectRepository, RunfolderProjectRepository
+from delivery.repositories.runfolder_catalog_repository import DatabaseBasedRunfolderCatalogRepository
+from delivery.repositories.directory_size_repository import DatabaseBasedDirectorySizeRepository
 
 from delivery.services.delivery_service import MoverDeliveryService
 from delivery.services.external_program_service import ExternalProgramService
 from delivery.services.staging_service import StagingService
-from delivery.services.file_system_service import FileSystemService
+from delivery.services.staging_eviction_service import StagingEvictionService
+from delivery.services.file_system_service import FileSystemService, FileSystemExecutor
+from delivery.services.runfolder_catalog_sync_service import RunfolderCatalogSyncService
+from delivery.services.project_size_service import ProjectSizeService
+from delivery.services.transfer_engines import RsyncTransferEngine, NativeTransferEngine
+from delivery.services.bandwidth_governor import BandwidthGovernor
 
 
 def routes(**kwargs):
@@ -47,6 +58,8 @@ def routes(**kwargs):
             name="stage_runfolder", kwargs=kwargs),
         url(r"/api/1.0/stage/project/(.+)", StageGeneralDirectoryHandler,
             name="stage_project", kwargs=kwargs),
+        url(r"/api/1.0/stage/bulk", BulkStagingHandler,
+            name="stage_bulk", kwargs=kwargs),
 
         url(r"/api/1.0/stage/(\d+)", StagingHandler, name="stage_status", kwargs=kwargs),
 
@@ -56,6 +69,9 @@ def routes(**kwargs):
         url(r"/api/1.0/deliver/status/(.+)", DeliveryStatusHandler,
             name="delivery_status", kwargs=kwargs),
 
+        url(r"/api/1.0/admin/bandwidth", BandwidthLimitsHandler,
+            name="bandwidth_limits", kwargs=kwargs),
+
     ]
 
 
@@ -76,6 +92,20 @@ def create_and_migrate_db(db_engine, alembic_path, db_connection_string):
         upgrade_db(alembic_cfg, "head")
 
 
+def _get_optional_config_value(config, key, default=None):
+    """
+    Look up a configuration value which does not have to be present in the configuration
+    :param config: a configuration instance
+    :param key: to look up
+    :param default: value to return if the key is not present in the configuration
+    :return: the configured value, or `default` if none has been configured
+    """
+    try:
+        return config[key]
+    except KeyError:
+        return default
+
+
 def compose_application(config):
     """
     Instantiates all service, repos, etc which are then used by the application.
@@ -95,7 +125,16 @@ def compose_application(config):
     runfolder_dir = config["runfolder_directory"]
     _assert_is_dir(runfolder_dir)
 
-    runfolder_repo = FileSystemBasedRunfolderRepository(runfolder_dir)
+    runfolder_index_max_staleness = _get_optional_config_value(config, "runfolder_index_max_staleness")
+    runfolder_discovery_workers = _get_optional_config_value(config, "runfolder_discovery_workers")
+    file_system_executor = FileSystemExecutor(
+        max_workers=_get_optional_config_value(config, "file_system_workers", default=4),
+        timeout=_get_optional_config_value(config, "file_system_timeout"))
+
+    runfolder_repo = FileSystemBasedRunfolderRepository(runfolder_dir,
+                                                        index_max_staleness=runfolder_index_max_staleness,
+                                                        discovery_workers=runfolder_discovery_workers,
+                                                        file_system_executor=file_system_executor)
 
     general_project_dir = config['general_project_directory']
     _assert_is_dir(general_project_dir)
@@ -112,14 +151,109 @@ def compose_application(config):
     session_factory = scoped_session(sessionmaker())
     session_factory.configure(bind=engine)
 
+    # If the runfolder catalog is enabled, runfolders and projects are listed from the database, and the
+    # catalog is synced with the file system in the background. Staging always looks runfolders up on
+    # the file system.
+    runfolder_catalog_sync_interval = _get_optional_config_value(config, "runfolder_catalog_sync_interval")
+    if runfolder_catalog_sync_interval:
+        runfolder_catalog_repo = DatabaseBasedRunfolderCatalogRepository(session_factory=session_factory,
+                                                                          file_system_executor=file_system_executor)
+        runfolder_catalog_sync_service = RunfolderCatalogSyncService(runfolder_repo=runfolder_repo,
+                                                                     catalog_repo=runfolder_catalog_repo)
+        runfolder_catalog_sync_service.start(interval=runfolder_catalog_sync_interval)
+        runfolder_listing_repo = runfolder_catalog_repo
+        project_listing_repo = runfolder_catalog_repo
+    else:
+        runfolder_listing_repo = runfolder_repo
+        project_listing_repo = RunfolderProjectRepository(runfolder_repository=runfolder_repo)
+
+    # If project size scanning is enabled, the sizes of all projects are scanned in the background and
+    # are then available to clients.
+    directory_size_repo = DatabaseBasedDirectorySizeRepository(session_factory=session_factory)
+    project_size_service = ProjectSizeService(
+        runfolder_repo=runfolder_repo,
+        general_project_repo=general_project_repo,
+        directory_size_repo=directory_size_repo,
+        scan_workers=_get_optional_config_value(config, "project_size_scan_workers", default=4),
+        file_system_executor=file_system_executor)
+    project_size_scan_interval = _get_optional_config_value(config, "project_size_scan_interval")
+    if project_size_scan_interval:
+        project_size_service.start(interval=project_size_scan_interval)
+
     staging_repo = DatabaseBasedStagingRepository(session_factory=session_factory)
 
+    zero_copy_staging_modes = [StagingMode[staging_mode]
+                               for staging_mode in _get_optional_config_value(config,
+                                                                              "zero_copy_staging_modes",
+                                                                              default=[])]
+
+    staging_md5sum_files = _get_optional_config_value(config, "staging_md5sum_files", default=False)
+
+    # The bandwidth limits can be changed while the service is running, so the governor is always there
+    bandwidth_governor = BandwidthGovernor(
+        limit=_get_optional_config_value(config, "staging_bandwidth_limit"),
+        limits_per_target=_get_optional_config_value(config, "staging_bandwidth_limits_per_target"))
+
+    staging_transfer_engine = _get_optional_config_value(config, "staging_transfer_engine", default="rsync")
+    if staging_transfer_engine == "native":
+        transfer_engine = NativeTransferEngine(
+            workers=_get_optional_config_value(config, "native_transfer_workers", default=4),
+            compute_checksums=staging_md5sum_files,
+            bandwidth_governor=bandwidth_governor)
+    elif staging_transfer_engine == "rsync":
+        transfer_engine = RsyncTransferEngine(
+            external_program_service=external_program_service,
+            workers=_get_optional_config_value(config, "rsync_workers_per_staging", default=1),
+            bandwidth_governor=bandwidth_governor)
+    else:
+        raise AssertionError("Unknown staging_transfer_engine: {}, should be rsync or native".
+                             format(staging_transfer_engine))
+
     staging_service = StagingService(external_program_service=external_program_service,
                                      runfolder_repo=runfolder_repo,
                                      project_dir_repo=general_project_repo,
                                      staging_repo=staging_repo,
                                      staging_dir=staging_dir,
-                                     session_factory=session_factory)
+                                     session_factory=session_factory,
+                                     max_concurrent_stagings=_get_optional_config_value(
+                                         config, "max_concurrent_stagings"),
+                                     max_concurrent_stagings_per_target=_get_optional_config_value(
+                                         config, "max_concurrent_stagings_per_target"),
+                                     max_concurrent_stagings_per_device=_get_optional_config_value(
+                                         config, "max_concurrent_stagings_per_device"),
+                                     zero_copy_staging_modes=zero_copy_staging_modes,
+                                     transfer_engine=transfer_engine,
+                                     progress_update_interval=_get_optional_config_value(
+                                         config, "staging_progress_update_interval", default=10),
+                                     reuse_prior_stagings=_get_optional_config_value(
+                                         config, "reuse_prior_stagings", default=False),
+                                     md5sum_files=staging_md5sum_files,
+                                     checksum_workers=_get_optional_config_value(config, "checksum_workers"),
+                                     checksum_files_in_flight=_get_optional_config_value(
+                                         config, "checksum_files_in_flight"),
+                                     verify_stagings=_get_optional_config_value(
+                                         config, "verify_stagings", default=False),
+                                     min_free_space=_get_optional_config_value(config, "staging_min_free_space"),
+                                     priority_aging_interval=_get_optional_config_value(
+                                         config, "staging_priority_aging_interval"),
+                                     preempt_lower_priority_stagings=_get_optional_config_value(
+                                         config, "preempt_lower_priority_stagings", default=False))
+
+    # If eviction is enabled, staged files which are no longer needed are removed in the background
+    staging_eviction_interval = _get_optional_config_value(config, "staging_eviction_interval")
+    if staging_eviction_interval:
+        staging_eviction_service = StagingEvictionService(
+            staging_repo=staging_repo,
+            session_factory=session_factory,
+            staging_dir=staging_dir,
+            free_space_watermark=_get_optional_config_value(config, "staging_eviction_free_space_watermark"),
+            free_space_target=_get_optional_config_value(config, "staging_eviction_free_space_target"),
+            max_age=_get_optional_config_value(config, "staging_eviction_max_age"))
+        staging_eviction_service.start(interval=staging_eviction_interval)
+
+    # Pick up any staging orders which were queued or in progress when the service was last shut down
+    staging_service.recover_interrupted_staging_orders()
+    staging_service.dispatch_pending_staging_orders()
 
     delivery_repo = DatabaseBasedDeliveriesRepository(session_factory=session_factory)
 
@@ -131,9 +265,12 @@ def compose_application(config):
                                             path_to_mover=path_to_mover)
 
     return dict(config=config,
-                runfolder_repo=runfolder_repo,
+                runfolder_repo=runfolder_listing_repo,
+                project_repo=project_listing_repo,
+                project_size_service=project_size_service,
                 external_program_service=external_program_service,
                 staging_service=staging_service,
+                bandwidth_governor=bandwidth_governor,
                 delivery_service=delivery_service)
 
 
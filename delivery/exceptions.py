@@ -33,3 +33,18 @@ class CannotParseMoverOutputException(Exception):
     Should be raised when movers output cannot be parsed for e.g. a mover delivery id.
     """
     pass
+
+
+class FileSystemTimeoutException(Exception):
+    """
+    Should be raised when a call to the file system does not finish within the allotted time, e.g. because of a hung
+    network mount.
+    """
+    pass
+
+
+class TransferCancelledException(Exception):
+    """
+    Should be raised when the transfer of a staging order is stopped because it was cancelled
+    """
+    pass
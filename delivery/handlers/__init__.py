@@ -5,5 +5,7 @@ OK = 200
 ACCEPTED = 202
 NO_CONTENT = 204
 
+BAD_REQUEST = 400
 NOT_FOUND = 404
 INTERNAL_SERVER_ERROR = 500
+SERVICE_UNAVAILABLE = 503
@@ -0,0 +1,64 @@
+import logging
+
+from delivery.handlers import *
+from delivery.handlers.utility_handlers import ArteriaDeliveryBaseHandler
+
+log = logging.getLogger(__name__)
+
+
+class BandwidthLimitsHandler(ArteriaDeliveryBaseHandler):
+    """
+    Handler for viewing and changing the bandwidth limits of the staging transfers while the service is running
+    """
+
+    def initialize(self, **kwargs):
+        self.bandwidth_governor = kwargs["bandwidth_governor"]
+        super(BandwidthLimitsHandler, self).initialize(kwargs)
+
+    def _write_limits(self):
+        limit, limits_per_target = self.bandwidth_governor.get_limits()
+        self.write_json({'limit': limit,
+                         'limits_per_target': limits_per_target,
+                         'transfers_in_progress': self.bandwidth_governor.get_number_of_transfers()})
+
+    def get(self):
+        """
+        Returns the bandwidth limits of the staging transfers, in bytes per second, in total and per staging
+        directory, where null means no limit. Return format looks like:
+        {
+           "limit": 209715200,
+           "limits_per_target": {"/data/staging": 104857600},
+           "transfers_in_progress": 3
+        }
+        """
+        self._write_limits()
+
+    def put(self):
+        """
+        Replace the bandwidth limits of the staging transfers, e.g:
+
+            import requests
+
+            url = "http://localhost:8080/api/1.0/admin/bandwidth"
+
+            payload = "{'limit': 209715200, 'limits_per_target': {'/data/staging': 104857600}}"
+            headers = {
+                'content-type': "application/json",
+            }
+
+            response = requests.request("PUT", url, data=payload, headers=headers)
+
+        A limit which is left out, or is null, is removed. The new limits apply straight away to transfers copied
+        by the native transfer engine, also those in progress. rsync processes keep the limit they were started
+        with, so with rsync the new limits apply to the transfers started from now on. The new limits are returned
+        in the same format as by GET, or status 400 if any of them is not a positive integer.
+        """
+        try:
+            request_data = self.body_as_object()
+            self.bandwidth_governor.set_limits(limit=request_data.get('limit'),
+                                               limits_per_target=request_data.get('limits_per_target'))
+        except (ValueError, TypeError, AttributeError) as e:
+            self.set_status(BAD_REQUEST, reason=str(e))
+            return
+
+        self._write_limits()
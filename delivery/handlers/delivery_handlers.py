@@ -11,7 +11,8 @@ log = logging.getLogger(__name__)
 
 class DeliverByStageIdHandler(ArteriaDeliveryBaseHandler):
     """
-    Handler for starting deliveries based on a previously staged directory/file
+    Handler for starting deliveries based on a previously staged directory/file. If no `md5sums_file` is given
+    in the request, the md5sum manifest written while staging is passed on to Mover, if there is one.
     # TODO This is still work in progress
     """
 
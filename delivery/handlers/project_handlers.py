@@ -1,6 +1,12 @@
 
+import os
+
+from tornado.gen import coroutine
+from tornado.web import HTTPError
+
 from delivery.handlers import *
 from delivery.handlers.utility_handlers import ArteriaDeliveryBaseHandler
+from delivery.exceptions import FileSystemTimeoutException
 from delivery.repositories.project_repository import RunfolderProjectRepository
 
 
@@ -11,8 +17,9 @@ class ProjectBaseHandler(ArteriaDeliveryBaseHandler):
 
     def initialize(self, **kwargs):
         self.runfolder_repo = kwargs["runfolder_repo"]
-        self.project_repo = RunfolderProjectRepository(
+        self.project_repo = kwargs.get("project_repo") or RunfolderProjectRepository(
             runfolder_repository=self.runfolder_repo)
+        self.project_size_service = kwargs.get("project_size_service")
         super(ProjectBaseHandler, self).initialize(kwargs)
 
 
@@ -21,21 +28,60 @@ class ProjectHandler(ProjectBaseHandler):
     Handler class for managing projects
     """
 
+    @coroutine
     def get(self):
         """
-        Returns all projects as json on the following format:
+        Returns all projects, ordered by runfolder and project name, as json on the following format:
         {
            "projects": [
                 {
                     "path": "/path/to/160930_ST-E00216_0111_BH37CWALXX/Projects/ABC_123",
                     "name": "ABC_123",
-                    "runfolder_path": "/path/to/160930_ST-E00216_0111_BH37CWALXX"
+                    "runfolder_path": "/path/to/160930_ST-E00216_0111_BH37CWALXX",
+                    "size": 15,
+                    "file_count": 1
                 }
             ]
         }
+
+        The projects can be paged through with `limit` and `after`, and streamed with `stream=true`, in the same
+        way as runfolders. The cursor of a project is `<runfolder name>/<project name>`, e.g:
+
+            /api/1.0/projects?limit=100&after=160930_ST-E00216_0111_BH37CWALXX/ABC_123
+
+        The size (in bytes) and file count of a project are null unless it has been scanned since it was last modified.
+
+        Specify `name_prefix` to only return the projects whose names start with it.
+
+        If the file system does not respond in time, status 503 is returned.
         """
-        projects = list(self.project_repo.get_projects())
-        self.write_list_of_models_as_json(projects, key="projects")
+        def cursor_of(project):
+            return os.path.basename(project.runfolder_path), project.name
+
+        def get_batches(after):
+            if after and len(after) != 2:
+                raise HTTPError(BAD_REQUEST, reason="after has to be on the form <runfolder name>/<project name>")
+
+            next_project_batch = self.project_repo.get_project_batches_async(
+                name_prefix=self.get_argument("name_prefix", None),
+                after=after)
+
+            @coroutine
+            def next_batch():
+                projects = yield next_project_batch()
+                if self.project_size_service:
+                    projects = yield self.project_size_service.projects_with_sizes_async(projects)
+                return projects
+
+            return next_batch
+
+        try:
+            yield self.write_pages_of_model_batches_as_json(get_batches, key="projects", cursor_of=cursor_of)
+        except FileSystemTimeoutException as e:
+            # Once part of the response has been streamed it can only be cut short
+            if self._headers_written:
+                raise
+            self.set_status(SERVICE_UNAVAILABLE, reason=str(e))
 
 
 class ProjectsForRunfolderHandler(ProjectBaseHandler):
@@ -43,6 +89,7 @@ class ProjectsForRunfolderHandler(ProjectBaseHandler):
     Manage projects for a specific runfolder
     """
 
+    @coroutine
     def get(self, runfolder_name):
         """
         Returns all projects for the specified runfolder on format:
@@ -51,14 +98,26 @@ class ProjectsForRunfolderHandler(ProjectBaseHandler):
                 {
                     "path": "/path/to/160930_ST-E00216_0111_BH37CWALXX/Projects/ABC_123",
                     "name": "ABC_123",
-                    "runfolder_path": "/path/to/160930_ST-E00216_0111_BH37CWALXX"
+                    "runfolder_path": "/path/to/160930_ST-E00216_0111_BH37CWALXX",
+                    "size": 15,
+                    "file_count": 1
                 }
             ]
         }
+
+        If the file system does not respond in time, status 503 is returned.
         """
-        runfolder = self.runfolder_repo.get_runfolder(runfolder_name)
-        if runfolder:
+        try:
+            runfolder = yield self.runfolder_repo.get_runfolder_async(runfolder_name)
+            if not runfolder:
+                self.send_error(status_code=NOT_FOUND)
+                return
+
             projects = runfolder.projects
-            self.write_list_of_models_as_json(projects, key="projects")
-        else:
-            self.send_error(status_code=NOT_FOUND)
+            if projects and self.project_size_service:
+                projects = yield self.project_size_service.projects_with_sizes_async(projects)
+        except FileSystemTimeoutException as e:
+            self.set_status(SERVICE_UNAVAILABLE, reason=str(e))
+            return
+
+        self.write_list_of_models_as_json(projects, key="projects")
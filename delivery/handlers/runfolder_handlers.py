@@ -1,5 +1,11 @@
 
+import copy
+
+from tornado.gen import coroutine
+
+from delivery.handlers import *
 from delivery.handlers.utility_handlers import ArteriaDeliveryBaseHandler
+from delivery.exceptions import FileSystemTimeoutException
 
 
 class RunfolderHandler(ArteriaDeliveryBaseHandler):
@@ -9,11 +15,28 @@ class RunfolderHandler(ArteriaDeliveryBaseHandler):
 
     def initialize(self, **kwargs):
         self.runfolder_repo = kwargs["runfolder_repo"]
+        self.project_size_service = kwargs.get("project_size_service")
         super(RunfolderHandler, self).initialize(kwargs)
 
+    @coroutine
+    def _runfolders_with_project_sizes(self, runfolders):
+        # The runfolders are copied along with their projects, since they might be shared by a runfolder index
+        projects = yield self.project_size_service.projects_with_sizes_async(
+            project for runfolder in runfolders for project in runfolder.projects or [])
+        projects = iter(projects)
+
+        runfolders_with_sizes = []
+        for runfolder in runfolders:
+            runfolder = copy.copy(runfolder)
+            if runfolder.projects:
+                runfolder.projects = [next(projects) for _ in runfolder.projects]
+            runfolders_with_sizes.append(runfolder)
+        return runfolders_with_sizes
+
+    @coroutine
     def get(self):
         """
-        Returns all runfolders as json on the following format:
+        Returns all runfolders, ordered by name, as json on the following format:
         {
             "runfolders": [
                 {
@@ -23,12 +46,52 @@ class RunfolderHandler(ArteriaDeliveryBaseHandler):
                         {
                             "path": "/tests/resources/160930_ST-E00216_0111_BH37CWALXX/Projects/ABC_123",
                             "name": "ABC_123",
-                            "runfolder_path": "/tests/resources/160930_ST-E00216_0111_BH37CWALXX"
+                            "runfolder_path": "/tests/resources/160930_ST-E00216_0111_BH37CWALXX",
+                            "size": 15,
+                            "file_count": 1
                         }
                     ]
                 }
             ]
         }
+
+        The runfolders can be paged through by specifying `limit` (the maximum number of runfolders to return)
+        and `after` (only return runfolders with names after this one). When `limit` is given the response will
+        also contain `next_after`, which is the value of `after` to use to get the next page, or null if there
+        are no more runfolders. E.g:
+
+            /api/1.0/runfolders?limit=100&after=160930_ST-E00216_0111_BH37CWALXX
+
+        The size (in bytes) and file count of a project are null unless the project has been scanned since it was
+        last modified, which only happens if the service has been configured to scan project sizes.
+
+        Specify `name_prefix` to only return the runfolders whose names start with it, e.g. `name_prefix=1609`.
+
+        Specify `stream=true` to have the runfolders sent to the client in batches as they are found, rather than
+        once all of them are known.
+
+        If the file system does not respond in time, status 503 is returned.
         """
-        runfolders = list(self.runfolder_repo.get_runfolders())
-        self.write_list_of_models_as_json(runfolders, key="runfolders")
+        def get_batches(after):
+            next_runfolder_batch = self.runfolder_repo.get_runfolder_batches_async(
+                name_prefix=self.get_argument("name_prefix", None),
+                after="/".join(after) if after else None)
+
+            @coroutine
+            def next_batch():
+                runfolders = yield next_runfolder_batch()
+                if self.project_size_service:
+                    runfolders = yield self._runfolders_with_project_sizes(runfolders)
+                return runfolders
+
+            return next_batch
+
+        try:
+            yield self.write_pages_of_model_batches_as_json(get_batches,
+                                                            key="runfolders",
+                                                            cursor_of=lambda runfolder: (runfolder.name,))
+        except FileSystemTimeoutException as e:
+            # Once part of the response has been streamed it can only be cut short
+            if self._headers_written:
+                raise
+            self.set_status(SERVICE_UNAVAILABLE, reason=str(e))
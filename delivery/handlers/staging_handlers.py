@@ -7,7 +7,7 @@ from tornado.web import asynchronous
 from arteria.web.handlers import BaseRestHandler
 
 from delivery.handlers import *
-from delivery.exceptions import ProjectNotFoundException
+from delivery.exceptions import ProjectNotFoundException, RunfolderNotFoundException, FileSystemTimeoutException
 
 
 log = logging.getLogger(__name__)
@@ -30,6 +30,15 @@ class BaseStagingHandler(BaseRestHandler):
 
         return link_results, id_results
 
+    @staticmethod
+    def _priority_from_request(request_data):
+        if not isinstance(request_data, dict):
+            raise ValueError("The request body must be a JSON object")
+        priority = request_data.get("priority", 0)
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            raise ValueError("The priority must be an integer, got: {}".format(priority))
+        return priority
+
 
 class StagingRunfolderHandler(BaseStagingHandler):
     """
@@ -64,6 +73,15 @@ class StagingRunfolderHandler(BaseStagingHandler):
         The return format looks like:
             {"staging_order_links": {"ABC_123": "http://localhost:8080/api/1.0/stage/584"}}
 
+        A priority can be given in the request body as well, e.g. `{'projects': ['ABC_123'], 'priority': 10}`.
+        Staging orders of a higher priority are staged before those of a lower one, and the default priority is 0.
+
+        A project which is already waiting to be staged, or being staged, is not staged again, instead the link to
+        that staging order is returned. If it is waiting with a lower priority, it is given the higher priority.
+
+        If the request body is not a JSON object, or the priority is not an integer, status 400 is returned. If the
+        runfolder or any of the projects can not be found, status 404 is returned, and if the file system does not
+        respond in time, status 503 is returned.
         """
 
         log.debug("Trying to stage runfolder with id: {}".format(runfolder_id))
@@ -73,20 +91,30 @@ class StagingRunfolderHandler(BaseStagingHandler):
         except ValueError:
             request_data = {}
 
+        try:
+            priority = self._priority_from_request(request_data)
+        except ValueError as e:
+            self.set_status(BAD_REQUEST, reason=str(e))
+            return
+
         try:
             projects_to_stage = request_data.get("projects", [])
 
             log.debug("Got the following projects to stage: {}".format(projects_to_stage))
 
-            staging_order_projects_and_ids = self.staging_service.stage_runfolder(runfolder_id, projects_to_stage)
+            staging_order_projects_and_ids = yield self.staging_service.stage_runfolder(runfolder_id,
+                                                                                        projects_to_stage,
+                                                                                        priority=priority)
 
             link_results, id_results = self._construct_response_from_project_and_status(staging_order_projects_and_ids)
 
             self.set_status(ACCEPTED)
             self.write_json({'staging_order_links': link_results,
                              'staging_order_ids': id_results})
-        except ProjectNotFoundException as e:
-            self.set_status(NOT_FOUND, reason=e.msg)
+        except (ProjectNotFoundException, RunfolderNotFoundException) as e:
+            self.set_status(NOT_FOUND, reason=str(e))
+        except FileSystemTimeoutException as e:
+            self.set_status(SERVICE_UNAVAILABLE, reason=str(e))
 
 
 class StageGeneralDirectoryHandler(BaseStagingHandler):
@@ -120,8 +148,21 @@ class StageGeneralDirectoryHandler(BaseStagingHandler):
         The return format looks like:
             {"staging_order_links": {"my_test_project": "http://localhost:8080/api/1.0/stage/591"}}
 
+        A priority can be given in the request body, e.g. `{'priority': 10}`, as when staging a runfolder. If it is
+        not an integer, or the request body is not a JSON object, status 400 is returned.
         """
-        stage_order_and_id = self.staging_service.stage_directory(directory_name)
+        try:
+            request_data = self.body_as_object()
+        except ValueError:
+            request_data = {}
+
+        try:
+            priority = self._priority_from_request(request_data)
+        except ValueError as e:
+            self.set_status(BAD_REQUEST, reason=str(e))
+            return
+
+        stage_order_and_id = self.staging_service.stage_directory(directory_name, priority=priority)
 
         link_results, id_results = self._construct_response_from_project_and_status(stage_order_and_id)
 
@@ -129,6 +170,106 @@ class StageGeneralDirectoryHandler(BaseStagingHandler):
         self.write_json({'staging_order_links': link_results,
                          'staging_order_ids': id_results})
 
+
+class BulkStagingHandler(BaseStagingHandler):
+    """
+    Handler class for staging projects from many runfolders, and many general projects, in one request
+    """
+
+    def initialize(self, staging_service, **kwargs):
+        self.staging_service = staging_service
+
+    def _construct_response_from_runfolders_and_projects(self, runfolder_stage_order_ids, project_stage_order_ids):
+        runfolder_links = {}
+        runfolder_ids = {}
+        for runfolder, project_and_ids in runfolder_stage_order_ids.items():
+            runfolder_links[runfolder], runfolder_ids[runfolder] = \
+                self._construct_response_from_project_and_status(project_and_ids)
+        project_links, project_ids = self._construct_response_from_project_and_status(project_stage_order_ids)
+        return {'staging_order_links': {'runfolders': runfolder_links, 'projects': project_links},
+                'staging_order_ids': {'runfolders': runfolder_ids, 'projects': project_ids}}
+
+    @staticmethod
+    def _is_list_of_strings(value):
+        return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+    def _runfolders_and_projects_from_request(self, request_data):
+        runfolders = request_data.get("runfolders", {})
+        if not isinstance(runfolders, dict) or \
+                not all(self._is_list_of_strings(projects) for projects in runfolders.values()):
+            raise ValueError("The runfolders must map runfolder names to lists of project names, got: {}".
+                             format(runfolders))
+
+        projects = request_data.get("projects", [])
+        if not self._is_list_of_strings(projects):
+            raise ValueError("The projects must be a list of project names, got: {}".format(projects))
+
+        return runfolders, projects
+
+    @coroutine
+    def post(self):
+        """
+        Attempt to stage projects from many runfolders, and/or many general projects, at once. The runfolders are
+        given with lists of the projects to stage from them, where an empty list means all projects, and the general
+        projects by name. All staging orders are created in a single transaction. E.g:
+
+            import requests
+
+            url = "http://localhost:8080/api/1.0/stage/bulk"
+
+            payload = "{'runfolders': {'160930_ST-E00216_0111_BH37CWALXX': ['ABC_123'],
+                                       '160930_ST-E00216_0112_BH37CWALXX': []},
+                        'projects': ['my_test_project'],
+                        'priority': 10}"
+            headers = {
+                'content-type': "application/json",
+            }
+
+            response = requests.request("POST", url, data=payload, headers=headers)
+
+            print(response.text)
+
+        The return format looks like:
+            {"staging_order_links": {"runfolders": {"160930_ST-E00216_0111_BH37CWALXX":
+                                                        {"ABC_123": "http://localhost:8080/api/1.0/stage/584"},
+                                                    "160930_ST-E00216_0112_BH37CWALXX":
+                                                        {"ABC_123": "http://localhost:8080/api/1.0/stage/585",
+                                                         "DEF_456": "http://localhost:8080/api/1.0/stage/586"}},
+                                     "projects": {"my_test_project": "http://localhost:8080/api/1.0/stage/587"}},
+             "staging_order_ids": {"runfolders": {"160930_ST-E00216_0111_BH37CWALXX": {"ABC_123": 584},
+                                                  "160930_ST-E00216_0112_BH37CWALXX": {"ABC_123": 585,
+                                                                                       "DEF_456": 586}},
+                                   "projects": {"my_test_project": 587}}}
+
+        As when staging a single runfolder, the priority is optional and defaults to 0, and projects which are already
+        waiting to be staged, or being staged, are not staged again. If the priority is not an integer, status 400 is
+        returned. The same goes for a body which is not a JSON object on the format above. If any of the runfolders
+        or projects can not be found, nothing is staged and status 404 is returned, and if the file system does not
+        respond in time, status 503 is returned.
+        """
+        try:
+            request_data = self.body_as_object()
+            priority = self._priority_from_request(request_data)
+            runfolders, projects = self._runfolders_and_projects_from_request(request_data)
+        except ValueError as e:
+            self.set_status(BAD_REQUEST, reason=str(e))
+            return
+
+        try:
+            runfolder_stage_order_ids, project_stage_order_ids = yield self.staging_service.stage_in_bulk(
+                runfolders_and_projects=runfolders,
+                general_projects=projects,
+                priority=priority)
+
+            self.set_status(ACCEPTED)
+            self.write_json(self._construct_response_from_runfolders_and_projects(runfolder_stage_order_ids,
+                                                                                  project_stage_order_ids))
+        except (ProjectNotFoundException, RunfolderNotFoundException) as e:
+            self.set_status(NOT_FOUND, reason=str(e))
+        except FileSystemTimeoutException as e:
+            self.set_status(SERVICE_UNAVAILABLE, reason=str(e))
+
+
 class StagingHandler(BaseRestHandler):
 
     def initialize(self, staging_service, **kwargs):
@@ -137,15 +278,62 @@ class StagingHandler(BaseRestHandler):
     def get(self, stage_id):
         """
         Returns the current status as json of the of the staging order, or 404 if the order is unknown.
-        Possible values for status are: pending, staging_in_progress, staging_successful, staging_failed
+        Possible values for status are: pending, staging_in_progress, staging_verifying, staging_successful,
+        staging_failed, and evicted if the staged files have since been removed to free up space
         Return format looks like:
         {
-           "status": "staging_successful"
+           "status": "pending",
+           "priority": 0,
+           "size": null,
+           "queue_position": 3,
+           "staging_mode": null,
+           "reused_staging_order_id": null,
+           "md5sum_file": null,
+           "verification_mismatches": [],
+           "progress": null
         }
+        The queue position is 1 for the next order to be started, and is null unless the status is pending. Orders are
+        started in order of priority, and if aging of priorities is enabled an order can move up the queue as it waits.
+        Once staged, the staging mode tells if the files were copied (copy) or linked (hardlink or reflink). If the
+        source had not changed since it was last staged, and it was staged by linking the files of that staging, the id
+        of that staging order is given as reused_staging_order_id. If md5sum manifests are written while staging, the
+        path to the manifest of the staged files is given as md5sum_file.
+
+        While the staging is in progress, its progress is given as:
+            "progress": {
+                "bytes_transferred": 1238099968,
+                "files_transferred": 5,
+                "bytes_per_second": 123803320,
+                "eta_seconds": 10,
+                "percent_done": 45.0
+            }
+        where the rate, time left and percentage are null if they are not known yet.
+
+        If the staging failed because the staged files did not match the source when it was verified, the files
+        which did not match are listed as:
+            "verification_mismatches": [
+                {"path": "ABC_123/Sample_1/file.fastq.gz",
+                 "source_md5sum": "827ccb0eea8a706c4c34a16891f84e7b",
+                 "staged_md5sum": "e10adc3949ba59abbe56e057f20f883e"}
+            ]
+        where the staged checksum is null if the staged file could not be read.
         """
         stage_order = self.staging_service.get_stage_order_by_id(stage_id)
         if stage_order:
-            self.write_json({'status': stage_order.status.name, 'size': stage_order.size})
+            progress = self.staging_service.get_progress_of_stage_order(stage_order)
+            self.write_json({'status': stage_order.status.name,
+                             'priority': stage_order.priority,
+                             'size': stage_order.size,
+                             'queue_position': self.staging_service.get_queue_position(stage_order),
+                             'staging_mode': stage_order.staging_mode.name if stage_order.staging_mode else None,
+                             'reused_staging_order_id': stage_order.reused_staging_order_id,
+                             'md5sum_file': stage_order.md5sum_file,
+                             'verification_mismatches': [
+                                 {'path': mismatch.path,
+                                  'source_md5sum': mismatch.source_md5sum,
+                                  'staged_md5sum': mismatch.staged_md5sum}
+                                 for mismatch in self.staging_service.get_verification_mismatches(stage_order)],
+                             'progress': progress.__dict__ if progress else None})
         else:
             self.set_status(NOT_FOUND, reason='No stage order with id: {} found.'.format(stage_id))
 
@@ -1,9 +1,13 @@
 
 import json
 
+from tornado.gen import coroutine
+from tornado.web import HTTPError
+
 from arteria.web.handlers import BaseRestHandler
 
 from delivery import __version__ as version
+from delivery.handlers import *
 
 
 class ArteriaDeliveryBaseHandler(BaseRestHandler):
@@ -20,6 +24,10 @@ class ArteriaDeliveryBaseHandler(BaseRestHandler):
         """
         self.config = config
 
+    @staticmethod
+    def _model_as_json(model):
+        return json.dumps(model, default=lambda x: x.__dict__)
+
     def write_list_of_models_as_json(self, model_list, key):
         if model_list:
             as_json = json.dumps({key: model_list}, default=lambda x: x.__dict__)
@@ -27,6 +35,92 @@ class ArteriaDeliveryBaseHandler(BaseRestHandler):
         else:
             self.write_json({key: list()})
 
+    def _get_page_arguments(self):
+        limit = self.get_argument("limit", default=None)
+        if limit is not None:
+            if not limit.isdigit() or int(limit) < 1:
+                raise HTTPError(BAD_REQUEST, reason="limit has to be a positive integer")
+            limit = int(limit)
+
+        after = self.get_argument("after", default=None)
+        if after is not None:
+            after = tuple(after.split("/"))
+
+        stream = self.get_argument("stream", default="false").lower() == "true"
+
+        return limit, after, stream
+
+    @coroutine
+    def write_pages_of_model_batches_as_json(self, get_batches, key, cursor_of):
+        """
+        Write models, which are produced a batch at a time, as json on the same format as
+        `write_list_of_models_as_json`, but take the following query arguments into account:
+
+         - limit: only write this many models. If there are more models to fetch the cursor to use for the next
+                  page is given as `next_after` in the response.
+         - after: only write models which come after the given cursor.
+         - stream: if `true`, each batch of models is written and flushed to the client as soon as it has been
+                   produced, rather than all of them being collected and written at once.
+
+        No more batches are asked for than are needed to fill the page. The first batch is asked for before anything
+        is written, so if that fails a status can still be set for the response.
+
+        :param get_batches: a function which is given the cursor to start after, or None to start from the first
+                            model, and returns a coroutine function returning the next batch of models as a list, or
+                            an empty list once there are no more models. The models are ordered by their cursors,
+                            across the batches.
+        :param key: the key under which the models are written
+        :param cursor_of: a function returning the cursor of a model as a tuple of strings
+        :return: None
+        """
+        limit, after, stream = self._get_page_arguments()
+        next_batch = get_batches(after)
+
+        written = []
+        last_written = None
+        nbr_written = 0
+        next_after = None
+
+        batch = yield next_batch()
+
+        if stream:
+            self.set_header("Content-Type", "application/json")
+            self.write('{{"{}": ['.format(key))
+
+        page_is_full = False
+        while batch and not page_is_full:
+            for model in batch:
+                if limit is not None and nbr_written == limit:
+                    next_after = "/".join(cursor_of(last_written))
+                    page_is_full = True
+                    break
+
+                if stream:
+                    if nbr_written:
+                        self.write(", ")
+                    self.write(self._model_as_json(model))
+                else:
+                    written.append(model)
+
+                last_written = model
+                nbr_written += 1
+
+            if not page_is_full:
+                if stream:
+                    yield self.flush()
+                batch = yield next_batch()
+
+        if stream:
+            self.write("]")
+            if limit is not None:
+                self.write(', "next_after": {}'.format(json.dumps(next_after)))
+            self.write("}")
+        else:
+            response = {key: written}
+            if limit is not None:
+                response["next_after"] = next_after
+            self.write_json(json.dumps(response, default=lambda x: x.__dict__))
+
 
 class VersionHandler(ArteriaDeliveryBaseHandler):
 
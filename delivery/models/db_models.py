@@ -2,7 +2,7 @@
 import os
 import enum as base_enum
 
-from sqlalchemy import Column, Integer, BigInteger, String, Enum
+from sqlalchemy import Column, Integer, BigInteger, String, Enum, Float, Index
 from sqlalchemy.ext.declarative import declarative_base
 
 """
@@ -21,9 +21,29 @@ class StagingStatus(base_enum.Enum):
     pending = 'pending'
 
     staging_in_progress = 'staging_in_progress'
+    # The source has been copied, and the staged files are being checked against it
+    staging_verifying = 'staging_verifying'
     staging_successful = 'staging_successful'
     staging_failed = 'staging_failed'
 
+    # The staged files have been removed to free up space
+    evicted = 'evicted'
+
+
+class StagingMode(base_enum.Enum):
+    """
+    Enumerate the ways in which a directory or file can be staged
+    """
+
+    # The data is copied
+    copy = 'copy'
+
+    # The staged files are hardlinks to the original files, which means that they share all data and metadata
+    hardlink = 'hardlink'
+
+    # The staged files are copy-on-write clones of the original files
+    reflink = 'reflink'
+
 
 class StagingOrder(SQLAlchemyBase):
     """
@@ -53,9 +73,63 @@ class StagingOrder(SQLAlchemyBase):
     # which did do it if the status is no longer in progress.
     pid = Column(Integer)
 
+    # The pids of all processes carrying out the staging, separated by spaces, if it is copied by more than one.
+    # The first of them is the same as `pid`.
+    pids = Column(String)
+
+    # How the staging was carried out, once it has been
+    staging_mode = Column(Enum(StagingMode))
+
+    # The number of bytes and files which have been staged so far. These are updated now and then while the
+    # staging is in progress.
+    bytes_transferred = Column(BigInteger)
+    files_transferred = Column(Integer)
+
+    # A fingerprint of the names, sizes and modification times of the files in the source, as they were when it
+    # was staged. It is only set once the staging has been successful, and is used to find stagings of a source
+    # which has not changed since, so that their staged files can be reused.
+    source_fingerprint = Column(String)
+
+    # The id of the earlier staging order whose staged files were linked, if this order was staged by reusing them
+    reused_staging_order_id = Column(Integer)
+
+    # Path to a manifest, in the format of `md5sum`, of the md5 checksums of the staged files, if one was produced
+    # while staging. It is passed on to Mover when the staged files are delivered.
+    md5sum_file = Column(String)
+
+    # The time (in seconds since the epoch) at which the staged files were last staged, reused or delivered, and at
+    # which they were evicted, if they have been
+    last_used_at = Column(Float)
+    evicted_at = Column(Float)
+
+    # Pending orders with a higher priority are staged before those with a lower one, regardless of when they were
+    # queued. The time (in seconds since the epoch) at which the order was queued is used to raise the priority of
+    # orders which have waited for long, see `StagingService`.
+    priority = Column(Integer, nullable=False, default=0, server_default='0')
+    queued_at = Column(Float)
+
+    __table_args__ = (Index('ix_staging_orders_source_source_fingerprint', 'source', 'source_fingerprint'),)
+
     def get_staging_path(self):
         return os.path.join(self.staging_target, os.path.basename(os.path.abspath(self.source)))
 
+    def get_pids(self):
+        """
+        :return: the pids of the processes carrying out the staging, as a list
+        """
+        if self.pids:
+            return [int(pid) for pid in self.pids.split()]
+        return [self.pid] if self.pid else []
+
+    def set_pids(self, pids):
+        """
+        Store the pids of the processes carrying out the staging
+        :param pids: a list of pids, or None
+        :return: None
+        """
+        self.pid = pids[0] if pids else None
+        self.pids = ' '.join(str(pid) for pid in pids) if pids and len(pids) > 1 else None
+
     def __repr__(self):
         return "Staging order: {id: %s, source: %s, status: %s, pid: %s }" % (str(self.id),
                                                                               self.source,
@@ -63,6 +137,29 @@ class StagingOrder(SQLAlchemyBase):
                                                                               self.pid)
 
 
+class StagingVerificationMismatch(SQLAlchemyBase):
+    """
+    Models a staged file whose md5 checksum did not match that of the source file when the staging was verified
+    """
+
+    __tablename__ = 'staging_verification_mismatches'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    # Like for the delivery orders this is not enforced as a foreign key
+    staging_order_id = Column(Integer, nullable=False, index=True)
+
+    # Path of the file relative to the staging target, i.e. starting with the name of the source
+    path = Column(String, nullable=False)
+
+    # The checksums of the source file and the staged file, the latter is None if the staged file could not be read
+    source_md5sum = Column(String)
+    staged_md5sum = Column(String)
+
+    def __repr__(self):
+        return "Staging verification mismatch: {staging order id: %s, path: %s}" % (self.staging_order_id, self.path)
+
+
 class DeliveryStatus(base_enum.Enum):
     """
     Enumerate possible delivery statuses
@@ -114,3 +211,70 @@ class DeliveryOrder(SQLAlchemyBase):
                                                                                    self.delivery_source,
                                                                                    self.delivery_project,
                                                                                    self.delivery_status)
+
+
+class CatalogRunfolder(SQLAlchemyBase):
+    """
+    Models a runfolder in the runfolder catalog, i.e. a copy of what was found on the file system the last
+    time the catalog was synchronized with it.
+    """
+
+    __tablename__ = 'catalog_runfolders'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    name = Column(String, nullable=False, unique=True, index=True)
+    path = Column(String, nullable=False)
+
+    # The modification time of the runfolders Projects directory when its projects were
+    # catalogued, or None if there was no Projects directory
+    projects_mtime = Column(Float)
+
+    def __repr__(self):
+        return "Catalog runfolder: {name: %s, path: %s}" % (self.name, self.path)
+
+
+class CatalogProject(SQLAlchemyBase):
+    """
+    Models a project in a runfolder in the runfolder catalog
+    """
+
+    __tablename__ = 'catalog_projects'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    name = Column(String, nullable=False, index=True)
+    path = Column(String, nullable=False)
+
+    # The name and path of the runfolder which the project belongs to. Like for the delivery orders
+    # this is not enforced as a foreign key.
+    runfolder_name = Column(String, nullable=False)
+    runfolder_path = Column(String, nullable=False)
+
+    __table_args__ = (Index('ix_catalog_projects_runfolder_name_name', 'runfolder_name', 'name'),)
+
+    def __repr__(self):
+        return "Catalog project: {name: %s, path: %s}" % (self.name, self.path)
+
+
+class DirectorySize(SQLAlchemyBase):
+    """
+    Models the size of a directory (typically a project), as it was when the directory was last scanned.
+    """
+
+    __tablename__ = 'directory_sizes'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    path = Column(String, nullable=False, unique=True, index=True)
+
+    # The total size in bytes, and number, of the files in the directory
+    size = Column(BigInteger, nullable=False)
+    file_count = Column(Integer, nullable=False)
+
+    # The latest modification time of the directory and its immediate subdirectories
+    # at the time of the scan. If this has changed the directory needs to be scanned again.
+    mtime = Column(Float)
+
+    def __repr__(self):
+        return "Directory size: {path: %s, size: %s, file_count: %s}" % (self.path, self.size, self.file_count)
@@ -5,7 +5,8 @@ from delivery.models import BaseModel
 
 class BaseProject(BaseModel):
     """
-    Base class for the different project models
+    Base class for the different project models. Projects have a `size` (in bytes) and a `file_count`, which are
+    None unless they have been filled in from a `ProjectSizeService`.
     """
 
     def __eq__(self, other):
@@ -35,6 +36,8 @@ class RunfolderProject(BaseProject):
         self.name = name
         self.path = os.path.abspath(path)
         self.runfolder_path = runfolder_path
+        self.size = None
+        self.file_count = None
 
 
 class GeneralProject(BaseProject):
@@ -50,3 +53,5 @@ class GeneralProject(BaseProject):
         """
         self.name = name
         self.path = os.path.abspath(path)
+        self.size = None
+        self.file_count = None
@@ -0,0 +1,56 @@
+
+from delivery.models import BaseModel
+
+
+class StagingProgress(BaseModel):
+    """
+    Models how far along a staging in progress is
+    """
+
+    def __init__(self, bytes_transferred=0, files_transferred=0, bytes_per_second=None, eta_seconds=None,
+                 percent_done=None):
+        """
+        Instantiate a new StagingProgress
+        :param bytes_transferred: number of bytes staged so far
+        :param files_transferred: number of files staged so far
+        :param bytes_per_second: the current transfer rate, or None if not known
+        :param eta_seconds: estimated number of seconds until the staging is done, or None if not known
+        :param percent_done: estimated percentage of the staging which is done, or None if not known
+        """
+        self.bytes_transferred = bytes_transferred
+        self.files_transferred = files_transferred
+        self.bytes_per_second = bytes_per_second
+        self.eta_seconds = eta_seconds
+        self.percent_done = percent_done
+
+    @staticmethod
+    def combine(progresses, total_bytes=None):
+        """
+        Combine the progress of several transfers which are running at the same time into the progress of all of
+        them together
+        :param progresses: the progress of each transfer
+        :param total_bytes: the total number of bytes to transfer, used to estimate the percentage done. If not
+                            given, the percentage is only known if there is a single transfer.
+        :return: a new StagingProgress
+        """
+        def sum_if_known(values):
+            values = [value for value in values if value is not None]
+            return sum(values) if values else None
+
+        bytes_transferred = sum(progress.bytes_transferred for progress in progresses)
+
+        # The transfers run in parallel, so everything is done when the slowest one is done
+        etas = [progress.eta_seconds for progress in progresses if progress.eta_seconds is not None]
+
+        if total_bytes:
+            percent_done = min(100.0, 100.0 * bytes_transferred / total_bytes)
+        elif len(progresses) == 1:
+            percent_done = progresses[0].percent_done
+        else:
+            percent_done = None
+
+        return StagingProgress(bytes_transferred=bytes_transferred,
+                               files_transferred=sum(progress.files_transferred for progress in progresses),
+                               bytes_per_second=sum_if_known(progress.bytes_per_second for progress in progresses),
+                               eta_seconds=max(etas) if etas else None,
+                               percent_done=percent_done)
@@ -0,0 +1,23 @@
+
+from delivery.models import BaseModel
+
+
+class TransferResult(BaseModel):
+    """
+    Models the outcome of copying the source of a staging order with a `TransferEngine`
+    """
+
+    def __init__(self, successful, size=None, checksums=None, message=None):
+        """
+        Instantiate a new TransferResult
+        :param successful: True if everything was copied
+        :param size: the total size in bytes of the copied files
+        :param checksums: a dict of the path of each copied file, relative to the staging target (i.e. starting with
+                          the name of the source), to its md5 checksum, if the engine computed them while copying,
+                          otherwise None
+        :param message: a description of why the transfer failed
+        """
+        self.successful = successful
+        self.size = size
+        self.checksums = checksums
+        self.message = message
@@ -0,0 +1,69 @@
+
+from sqlalchemy.orm.exc import NoResultFound
+
+from delivery.models.db_models import DirectorySize
+
+
+class DatabaseBasedDirectorySizeRepository(object):
+    """
+    A repository of scanned directory sizes backed by a database.
+    """
+
+    def __init__(self, session_factory):
+        """
+        Instantiate a new DatabaseBasedDirectorySizeRepository
+        :param session_factory: factory method which can produce new sqlalchemy Session objects. Since sizes are
+                                stored from a background thread this should produce thread-local sessions, e.g. a
+                                `scoped_session`.
+        """
+        self.session_factory = session_factory
+
+    def get_directory_size(self, path):
+        """
+        Get the stored size of a directory
+        :param path: of the directory
+        :return: the matching DirectorySize, or None if the directory has not been scanned
+        """
+        session = self.session_factory()
+        try:
+            return session.query(DirectorySize).filter(DirectorySize.path == path).one()
+        except NoResultFound:
+            return None
+
+    # SQLite does not allow more than 999 parameters in a query
+    MAX_PATHS_PER_QUERY = 500
+
+    def get_directory_sizes(self, paths=None):
+        """
+        Get stored directory sizes
+        :param paths: if set, only get the sizes of these directories, otherwise get all stored sizes
+        :return: a dict of path -> DirectorySize
+        """
+        session = self.session_factory()
+        if paths is None:
+            return {directory_size.path: directory_size for directory_size in session.query(DirectorySize)}
+
+        paths = list(paths)
+        directory_sizes = {}
+        for i in range(0, len(paths), self.MAX_PATHS_PER_QUERY):
+            query = session.query(DirectorySize).\
+                filter(DirectorySize.path.in_(paths[i:i + self.MAX_PATHS_PER_QUERY]))
+            directory_sizes.update((directory_size.path, directory_size) for directory_size in query)
+        return directory_sizes
+
+    def store_directory_sizes(self, directory_sizes):
+        """
+        Store the sizes of a number of directories, replacing any previously stored sizes, and commit them to the
+        database in a single transaction
+        :param directory_sizes: a list of (path, size, file count, modification time) tuples
+        :return: None
+        """
+        session = self.session_factory()
+        try:
+            for path, size, file_count, mtime in directory_sizes:
+                session.query(DirectorySize).filter(DirectorySize.path == path).delete(synchronize_session=False)
+                session.add(DirectorySize(path=path, size=size, file_count=file_count, mtime=mtime))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
@@ -1,6 +1,8 @@
 
 import os
 
+from tornado import gen
+
 from delivery.services.file_system_service import FileSystemService
 from delivery.models.project import GeneralProject
 
@@ -14,19 +16,72 @@ class RunfolderProjectRepository(object):
         """
         Instantiate a new repository
         :param runfolder_repository: a `FileSystemBasedRunfolderRepository` or something the implements the
-        `get_runfolders` method
+        `get_runfolders`, `get_runfolders_async`, `get_runfolder_async` and `get_runfolder_batches_async` methods
         """
         self.runfolder_repository = runfolder_repository
 
-    def get_projects(self):
+    def get_projects(self, name_prefix=None):
         """
         Pick up all projects
+        :param name_prefix: if set, only pick up the projects whose names start with this
         :return: a generator of project instances
         """
-        for runfolder in self.runfolder_repository.get_runfolders():
+        return self._projects_of_runfolders(self.runfolder_repository.get_runfolders(), name_prefix)
+
+    @gen.coroutine
+    def get_projects_async(self, name_prefix=None):
+        """
+        Pick up all projects without blocking the IOLoop, see `FileSystemBasedRunfolderRepository.get_runfolders_async`
+        :param name_prefix: if set, only pick up the projects whose names start with this
+        :return: a list of project instances
+        """
+        runfolders = yield self.runfolder_repository.get_runfolders_async()
+        return list(self._projects_of_runfolders(runfolders, name_prefix))
+
+    def get_project_batches_async(self, name_prefix=None, after=None):
+        """
+        Pick up all projects, ordered by runfolder and project name, a batch at a time without blocking the IOLoop,
+        see `FileSystemBasedRunfolderRepository.get_runfolder_batches_async`
+        :param name_prefix: if set, only pick up the projects whose names start with this
+        :param after: if set, a (runfolder name, project name) tuple, and only the projects which come after it are
+                      picked up
+        :return: a coroutine function which returns the next batch of project instances as a list, or an empty list
+                 once there are no more projects
+        """
+        after_runfolder_name, after_project_name = after if after else (None, None)
+        next_runfolder_batch = self.runfolder_repository.get_runfolder_batches_async(after=after_runfolder_name)
+        # The rest of the projects of the runfolder to start after, if any, make up the first batch
+        runfolder_to_start_after = [after_runfolder_name] if after else []
+
+        @gen.coroutine
+        def next_batch_async():
+            if runfolder_to_start_after:
+                runfolder = yield self.runfolder_repository.get_runfolder_async(runfolder_to_start_after.pop())
+                # The name might not be that of a runfolder, e.g. `..`
+                if runfolder and runfolder.name == after_runfolder_name:
+                    projects = [project for project in self._projects_of_runfolders([runfolder], name_prefix)
+                                if project.name > after_project_name]
+                    if projects:
+                        return projects
+
+            # Runfolders without any matching projects do not end the projects
+            while True:
+                runfolders = yield next_runfolder_batch()
+                if not runfolders:
+                    return []
+                projects = list(self._projects_of_runfolders(runfolders, name_prefix))
+                if projects:
+                    return projects
+
+        return next_batch_async
+
+    @staticmethod
+    def _projects_of_runfolders(runfolders, name_prefix=None):
+        for runfolder in runfolders:
             if runfolder.projects:
                 for project in runfolder.projects:
-                    yield project
+                    if not name_prefix or project.name.startswith(name_prefix):
+                        yield project
 
 
 class GeneralProjectRepository(object):
@@ -54,3 +109,21 @@ class GeneralProjectRepository(object):
             abs_path = self.filesystem_service.abspath(directory)
             yield GeneralProject(name=self.filesystem_service.basename(abs_path),
                                  path=abs_path)
+
+    def get_project(self, project_name):
+        """
+        Get the project with the specified name. The project is looked up directly in the root directory, rather
+        than by listing all projects, so this takes the same time no matter how many projects there are.
+        :param project_name: to look for
+        :return: the matching GeneralProject, or None if no match
+        """
+        # Only accept plain directory names, anything else (e.g. '../foo') could resolve to a directory outside of
+        # the root directory. This also means that a name can only ever match a single directory.
+        if not project_name or os.path.basename(project_name) != project_name or project_name in (".", ".."):
+            return None
+
+        abs_path = self.filesystem_service.abspath(os.path.join(self.root_directory, project_name))
+        if not self.filesystem_service.isdir(abs_path):
+            return None
+
+        return GeneralProject(name=project_name, path=abs_path)
@@ -0,0 +1,255 @@
+
+import itertools
+import logging
+
+from sqlalchemy import and_, or_
+from tornado import gen
+
+from delivery.models.db_models import CatalogRunfolder, CatalogProject
+from delivery.models.runfolder import Runfolder
+from delivery.models.project import RunfolderProject
+from delivery.services.file_system_service import FileSystemExecutor
+
+log = logging.getLogger(__name__)
+
+
+def _starts_with(column, prefix):
+    # `_` and `%` are wildcards in LIKE expressions, and since underscores are common in
+    # runfolder and project names they need to be escaped.
+    escaped_prefix = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return column.like(escaped_prefix + "%", escape="\\")
+
+
+class DatabaseBasedRunfolderCatalogRepository(object):
+    """
+    A catalog of runfolders and their projects backed by a database. It can be used in place of a
+    `FileSystemBasedRunfolderRepository` when listing runfolders and projects, and is kept in sync with the file
+    system by the `RunfolderCatalogSyncService`.
+    """
+
+    # SQLite does not allow more than 999 parameters in a query
+    MAX_NAMES_PER_QUERY = 500
+
+    def __init__(self, session_factory, file_system_executor=None):
+        """
+        Instantiate a new DatabaseBasedRunfolderCatalogRepository
+        :param session_factory: factory method which can produce new sqlalchemy Session objects. Since the catalog is
+                                updated, and queried, from background threads this should produce thread-local
+                                sessions, e.g. a `scoped_session`.
+        :param file_system_executor: a `FileSystemExecutor` which the `*_async` methods run their queries on, so that
+                                     they do not block the IOLoop, defaults to a new `FileSystemExecutor`
+        """
+        self.session_factory = session_factory
+        self.file_system_executor = file_system_executor or FileSystemExecutor()
+
+    @staticmethod
+    def _project_columns_query(session):
+        return session.query(CatalogProject.name,
+                             CatalogProject.path,
+                             CatalogProject.runfolder_name,
+                             CatalogProject.runfolder_path)
+
+    @staticmethod
+    def _project_from_row(row):
+        return RunfolderProject(name=row.name, path=row.path, runfolder_path=row.runfolder_path)
+
+    def _get_runfolders(self, name_prefix=None, after=None, limit=None):
+        session = self.session_factory()
+
+        # Only the needed columns are queried, since materializing full ORM objects
+        # dominates the time it takes to list a large catalog.
+        runfolder_query = session.query(CatalogRunfolder.name, CatalogRunfolder.path).\
+            order_by(CatalogRunfolder.name)
+        if name_prefix:
+            runfolder_query = runfolder_query.filter(_starts_with(CatalogRunfolder.name, name_prefix))
+        if after is not None:
+            runfolder_query = runfolder_query.filter(CatalogRunfolder.name > after)
+        if limit is not None:
+            runfolder_query = runfolder_query.limit(limit)
+
+        runfolder_rows = runfolder_query.all()
+        if not runfolder_rows:
+            return []
+
+        # The runfolders are ordered by name, so the projects to get are the ones whose runfolder names
+        # fall between those of the first and the last runfolder.
+        project_query = self._project_columns_query(session).\
+            filter(CatalogProject.runfolder_name.between(runfolder_rows[0].name, runfolder_rows[-1].name)).\
+            order_by(CatalogProject.runfolder_name, CatalogProject.name)
+
+        projects_by_runfolder = {}
+        for runfolder_name, rows in itertools.groupby(project_query, key=lambda row: row.runfolder_name):
+            projects_by_runfolder[runfolder_name] = [self._project_from_row(row) for row in rows]
+
+        return [Runfolder(name=row.name, path=row.path, projects=projects_by_runfolder.get(row.name))
+                for row in runfolder_rows]
+
+    def get_runfolders(self, name_prefix=None):
+        """
+        Get all catalogued runfolders, ordered by name
+        :param name_prefix: if set, only get the runfolders whose names start with this
+        :return: a generator of runfolders
+        """
+        yield from self._get_runfolders(name_prefix)
+
+    def get_runfolder(self, runfolder):
+        """
+        Get the catalogued runfolder with the specified name
+        :param runfolder: to look for
+        :return: the matching runfolder, or None if no match
+        """
+        session = self.session_factory()
+        row = session.query(CatalogRunfolder).filter(CatalogRunfolder.name == runfolder).one_or_none()
+        if not row:
+            return None
+
+        project_rows = self._project_columns_query(session).\
+            filter(CatalogProject.runfolder_name == runfolder).\
+            order_by(CatalogProject.name).all()
+        projects = [self._project_from_row(project_row) for project_row in project_rows]
+
+        return Runfolder(name=row.name, path=row.path, projects=projects or None)
+
+    def _get_project_rows(self, name_prefix=None, after=None, limit=None):
+        session = self.session_factory()
+        query = self._project_columns_query(session).order_by(CatalogProject.runfolder_name, CatalogProject.name)
+        if name_prefix:
+            query = query.filter(_starts_with(CatalogProject.name, name_prefix))
+        if after is not None:
+            after_runfolder_name, after_name = after
+            query = query.filter(or_(CatalogProject.runfolder_name > after_runfolder_name,
+                                     and_(CatalogProject.runfolder_name == after_runfolder_name,
+                                          CatalogProject.name > after_name)))
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    def get_projects(self, name_prefix=None):
+        """
+        Get all catalogued projects, ordered by runfolder and project name
+        :param name_prefix: if set, only get the projects whose names start with this
+        :return: a generator of projects
+        """
+        for row in self._get_project_rows(name_prefix):
+            yield self._project_from_row(row)
+
+    @gen.coroutine
+    def get_runfolders_async(self, name_prefix=None):
+        """
+        Same as `get_runfolders`, but as a coroutine returning a list, which does not block the IOLoop
+        """
+        runfolders = yield self.file_system_executor.run(self._get_runfolders, name_prefix)
+        return runfolders
+
+    @gen.coroutine
+    def get_runfolder_async(self, runfolder):
+        """
+        Same as `get_runfolder`, but as a coroutine, which does not block the IOLoop
+        """
+        result = yield self.file_system_executor.run(self.get_runfolder, runfolder)
+        return result
+
+    @gen.coroutine
+    def get_projects_async(self, name_prefix=None):
+        """
+        Same as `get_projects`, but as a coroutine returning a list, which does not block the IOLoop
+        """
+        projects = yield self.file_system_executor.run(lambda: list(self.get_projects(name_prefix)))
+        return projects
+
+    def get_runfolder_batches_async(self, name_prefix=None, after=None, batch_size=100):
+        """
+        Same as `get_runfolders`, but as a coroutine function returning the next batch of runfolders each time it is
+        called, see `FileSystemBasedRunfolderRepository.get_runfolder_batches_async`. Each batch is queried for
+        when it is asked for, starting after the last runfolder of the previous batch.
+        :param name_prefix: if set, only get the runfolders whose names start with this
+        :param after: if set, only get the runfolders whose names come after this
+        :param batch_size: the number of runfolders in each batch, defaults to 100
+        :return: a coroutine function which returns the next batch of runfolders as a list, or an empty list once
+                 there are no more runfolders
+        """
+        def next_batch():
+            nonlocal after
+            batch = self._get_runfolders(name_prefix, after=after, limit=batch_size)
+            if batch:
+                after = batch[-1].name
+            return batch
+
+        @gen.coroutine
+        def next_batch_async():
+            batch = yield self.file_system_executor.run(next_batch)
+            return batch
+
+        return next_batch_async
+
+    def get_project_batches_async(self, name_prefix=None, after=None, batch_size=100):
+        """
+        Same as `get_projects`, but as a coroutine function returning the next batch of projects each time it is
+        called, see `RunfolderProjectRepository.get_project_batches_async`. Each batch is queried for when it is
+        asked for, starting after the last project of the previous batch.
+        :param name_prefix: if set, only get the projects whose names start with this
+        :param after: if set, a (runfolder name, project name) tuple, and only the projects which come after it are
+                      returned
+        :param batch_size: the number of projects in each batch, defaults to 100
+        :return: a coroutine function which returns the next batch of projects as a list, or an empty list once
+                 there are no more projects
+        """
+        def next_batch():
+            nonlocal after
+            rows = self._get_project_rows(name_prefix, after=after, limit=batch_size).all()
+            if rows:
+                after = (rows[-1].runfolder_name, rows[-1].name)
+            return [self._project_from_row(row) for row in rows]
+
+        @gen.coroutine
+        def next_batch_async():
+            batch = yield self.file_system_executor.run(next_batch)
+            return batch
+
+        return next_batch_async
+
+    def get_projects_modification_times(self):
+        """
+        Get the modification times of the Projects directories of the catalogued runfolders, as they were when
+        the runfolders were catalogued
+        :return: a dict of runfolder name -> modification time (None if the runfolder had no Projects directory)
+        """
+        session = self.session_factory()
+        return dict(session.query(CatalogRunfolder.name, CatalogRunfolder.projects_mtime))
+
+    def update_catalog(self, changed_runfolders, removed_runfolders):
+        """
+        Apply changes found on the file system to the catalog, and commit them in a single transaction
+        :param changed_runfolders: a list of (runfolder, projects modification time) tuples for the runfolders which
+                                   have been added or whose projects have changed
+        :param removed_runfolders: names of the runfolders which are no longer on the file system
+        :return: None
+        """
+        session = self.session_factory()
+        try:
+            names_to_delete = list(removed_runfolders) + [runfolder.name for runfolder, _ in changed_runfolders]
+            for i in range(0, len(names_to_delete), self.MAX_NAMES_PER_QUERY):
+                names = names_to_delete[i:i + self.MAX_NAMES_PER_QUERY]
+                session.query(CatalogProject).\
+                    filter(CatalogProject.runfolder_name.in_(names)).\
+                    delete(synchronize_session=False)
+                session.query(CatalogRunfolder).\
+                    filter(CatalogRunfolder.name.in_(names)).\
+                    delete(synchronize_session=False)
+
+            session.bulk_insert_mappings(CatalogRunfolder,
+                                         [dict(name=runfolder.name,
+                                               path=runfolder.path,
+                                               projects_mtime=projects_mtime)
+                                          for runfolder, projects_mtime in changed_runfolders])
+            session.bulk_insert_mappings(CatalogProject,
+                                         [dict(name=project.name,
+                                               path=project.path,
+                                               runfolder_name=runfolder.name,
+                                               runfolder_path=runfolder.path)
+                                          for runfolder, _ in changed_runfolders
+                                          for project in runfolder.projects or []])
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
@@ -2,27 +2,111 @@
 import logging
 import os
 import re
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado import gen
 
 from delivery.models.runfolder import Runfolder
 from delivery.models.project import RunfolderProject
-from delivery.services.file_system_service import FileSystemService
+from delivery.services.file_system_service import FileSystemService, FileSystemExecutor
 
 log = logging.getLogger(__name__)
 
 
+class RunfolderIndex(object):
+    """
+    In-memory index of the runfolders (and their projects) found under a runfolder directory. It keeps track of
+    the modification times of the directories it has listed, so that a refresh only needs to re-list the
+    directories which have actually changed.
+    """
+
+    def __init__(self, max_staleness, time_function=time.monotonic):
+        """
+        Instantiate a new RunfolderIndex
+        :param max_staleness: number of seconds the index may be served without checking the file system for changes
+        :param time_function: function returning the current time in seconds, defaults to `time.monotonic`
+        """
+        self.max_staleness = max_staleness
+        self.time_function = time_function
+        self.lock = threading.Lock()
+
+        # The modification time of the runfolder directory when it was last listed
+        self.base_mtime = None
+
+        # Runfolder name -> (runfolder, modification time of its Projects directory when it was last listed)
+        self.entries = OrderedDict()
+
+        self._last_refreshed = None
+
+    def is_stale(self):
+        """
+        Check if the index is due to be refreshed
+        :return: True if the index has never been refreshed, or was last refreshed more than `max_staleness`
+                 seconds ago, otherwise False
+        """
+        if self._last_refreshed is None:
+            return True
+        return self.time_function() - self._last_refreshed >= self.max_staleness
+
+    def mark_as_refreshed(self):
+        """
+        Note that the index has just been synchronized with the file system
+        :return: None
+        """
+        self._last_refreshed = self.time_function()
+
+    def runfolders(self):
+        """
+        Get the indexed runfolders
+        :return: a list of the indexed runfolders
+        """
+        return [runfolder for runfolder, _ in self.entries.values()]
+
+
 class FileSystemBasedRunfolderRepository(object):
     """
     Uses the file system as a source of truth for information about what runfolders are available.
     """
 
-    def __init__(self, base_path, file_system_service=FileSystemService()):
+    def __init__(self, base_path, file_system_service=FileSystemService(), index_max_staleness=None,
+                 discovery_workers=None, file_system_executor=None):
         """
         Instantiate a new FileSystemBasedRunfolderRepository
         :param base_path: the directory where runfolders are stored
         :param file_system_service: a service which can access the file system.
+        :param index_max_staleness: if set, runfolders are served from an in-memory `RunfolderIndex` which is checked
+                                    against the file system at most once every `index_max_staleness` seconds.
+                                    Defaults to None, in which case the file system is listed on every call.
+        :param discovery_workers: if set to more than one, the projects of different runfolders are listed
+                                  concurrently by a pool of this many threads. This pays off on network file systems
+                                  where each listing is a round trip. Defaults to None, i.e. listing them one by one.
+        :param file_system_executor: a `FileSystemExecutor` which the `*_async` methods run their file system calls
+                                     on. Defaults to a new `FileSystemExecutor` for this repository.
         """
         self._base_path = base_path
         self.file_system_service = file_system_service
+        if index_max_staleness is not None:
+            self._index = RunfolderIndex(max_staleness=index_max_staleness)
+        else:
+            self._index = None
+        if discovery_workers and discovery_workers > 1:
+            self._discovery_executor = ThreadPoolExecutor(max_workers=discovery_workers)
+        else:
+            self._discovery_executor = None
+        self.file_system_executor = file_system_executor or FileSystemExecutor()
+
+    def _map(self, function, iterable):
+        """
+        Apply function to each item in iterable, using the discovery workers if there are any
+        :return: an iterator of the results, in the same order as the items in iterable
+        """
+        if self._discovery_executor:
+            return self._discovery_executor.map(function, iterable)
+        return map(function, iterable)
 
     def _add_projects_to_runfolder(self, runfolder):
         """
@@ -33,8 +117,8 @@ class FileSystemBasedRunfolderRepository(object):
         """
         try:
             projects_base_dir = os.path.join(runfolder.path, "Projects")
-            project_directories = self.file_system_service.find_project_directories(
-                projects_base_dir)
+            project_directories = sorted(self.file_system_service.find_project_directories(
+                projects_base_dir))
 
             def project_from_dir(d):
                 return RunfolderProject(
@@ -51,42 +135,195 @@ class FileSystemBasedRunfolderRepository(object):
             log.warning("Did not find Project folder for: {}".format(runfolder.name))
             pass
 
-    def _get_runfolders(self):
+    @staticmethod
+    def _is_runfolder_name(name):
         # TODO Filter based on expression for runfolders...
         runfolder_expression = r"^\d+_"
+        return re.match(runfolder_expression, name) is not None
 
-        directories = self.file_system_service.find_runfolder_directories(self._base_path)
+    def _runfolder_directories(self):
+        # Runfolders are returned in order of their names, so that clients can page through them
+        directories = sorted(self.file_system_service.find_runfolder_directories(self._base_path))
         for directory in directories:
-            if re.match(runfolder_expression, os.path.basename(directory)):
+            if self._is_runfolder_name(os.path.basename(directory)):
+                yield directory
+
+    def _runfolder_from_directory(self, directory):
+        name = os.path.basename(directory)
+        path = os.path.join(self._base_path, directory)
+
+        runfolder = Runfolder(name=name, path=path, projects=None)
+        self._add_projects_to_runfolder(runfolder)
+
+        return runfolder
+
+    def _get_runfolders(self, name_prefix=None, after=None):
+        directories = self._runfolder_directories()
+        if name_prefix:
+            directories = (d for d in directories if os.path.basename(d).startswith(name_prefix))
+        if after is not None:
+            # Skipped before their projects are looked up
+            directories = (d for d in directories if os.path.basename(d) > after)
+        return self._map(self._runfolder_from_directory, directories)
+
+    def _projects_dir_mtime(self, runfolder_path):
+        try:
+            return self.file_system_service.getmtime(os.path.join(runfolder_path, "Projects"))
+        except FileNotFoundError:
+            return None
+
+    def _index_entry_for_directory(self, directory):
+        # The modification time is read before listing the directory, so that any change made while
+        # listing it will be picked up by the next refresh.
+        projects_mtime = self._projects_dir_mtime(os.path.join(self._base_path, directory))
+        return self._runfolder_from_directory(directory), projects_mtime
+
+    def _refresh_index(self):
+        """
+        Synchronize the index with the file system. The runfolder directory is only re-listed if its
+        modification time has changed, and the same goes for the Projects directory of each runfolder.
+        :return: None
+        """
+        index = self._index
+        previous_entries = index.entries
 
+        base_mtime = self.file_system_service.getmtime(self._base_path)
+        if base_mtime != index.base_mtime:
+            log.debug("Runfolder directory {} has changed, re-listing it".format(self._base_path))
+            directories = list(self._runfolder_directories())
+            new_directories = [d for d in directories if os.path.basename(d) not in previous_entries]
+            new_entries = self._map(self._index_entry_for_directory, new_directories)
+
+            index.entries = OrderedDict()
+            for directory in directories:
                 name = os.path.basename(directory)
-                path = os.path.join(self._base_path, directory)
+                if name in previous_entries:
+                    index.entries[name] = previous_entries[name]
+                else:
+                    index.entries[name] = next(new_entries)
+            index.base_mtime = base_mtime
 
-                runfolder = Runfolder(name=name, path=path, projects=None)
-                self._add_projects_to_runfolder(runfolder)
+        def refreshed_entry(name):
+            runfolder, projects_mtime = index.entries[name]
+            if self._projects_dir_mtime(runfolder.path) != projects_mtime:
+                log.debug("Projects of runfolder {} have changed, re-listing them".format(name))
+                return self._index_entry_for_directory(runfolder.path)
+            return None
 
-                yield runfolder
+        # Runfolders which were just added to the index are already up to date
+        names_to_check = [name for name in index.entries if name in previous_entries]
+        for name, entry in zip(names_to_check, self._map(refreshed_entry, names_to_check)):
+            if entry:
+                index.entries[name] = entry
 
-    def get_runfolders(self):
+        index.mark_as_refreshed()
+
+    def _get_runfolders_from_index(self):
+        with self._index.lock:
+            if self._index.is_stale():
+                self._refresh_index()
+            return self._index.runfolders()
+
+    def get_runfolders(self, name_prefix=None, after=None):
         """
-        Get all runfolders
+        Get all runfolders, ordered by name
+        :param name_prefix: if set, only get the runfolders whose names start with this
+        :param after: if set, only get the runfolders whose names come after this
         :return: a generator of known runfolders
         """
-        return self._get_runfolders()
+        if self._index:
+            runfolders = iter(self._get_runfolders_from_index())
+            if name_prefix:
+                runfolders = (runfolder for runfolder in runfolders if runfolder.name.startswith(name_prefix))
+            if after is not None:
+                runfolders = (runfolder for runfolder in runfolders if runfolder.name > after)
+            return runfolders
+        return self._get_runfolders(name_prefix, after)
+
+    def get_runfolder_names(self):
+        """
+        Get the names of all runfolders, without looking up their projects
+        :return: a list of runfolder names, ordered by name
+        """
+        return [os.path.basename(directory) for directory in self._runfolder_directories()]
+
+    def get_projects_modification_time(self, runfolder):
+        """
+        Get the modification time of the Projects directory of a runfolder. Since it changes whenever a
+        project is added to or removed from the runfolder it can be used to find out if the projects of the
+        runfolder need to be looked up again.
+        :param runfolder: name of the runfolder
+        :return: the modification time, or None if the runfolder has no Projects directory
+        """
+        return self._projects_dir_mtime(os.path.join(self._base_path, runfolder))
 
     def get_runfolder(self, runfolder):
         """
-        Get a Runfolder object matching the specified name
+        Get a Runfolder object matching the specified name. The runfolder is looked up directly in the runfolder
+        directory, so only the projects of the matching runfolder are listed.
         :param runfolder: to look for
         :return: the matching runfolder, or None if no match
-        :raises: a AssertionError if more than one runfolder was found
-                matching the given name.
-        """
-        runfolders = self.get_runfolders()
-        matching_name = list([r for r in runfolders if r.name == runfolder])
-        if len(matching_name) > 1:
-            raise AssertionError("Found more than 1 runfolder matching: ".format(r))
-        if len(matching_name) > 0 and matching_name[0]:
-            return matching_name[0]
-        else:
+        """
+        # Only accept plain directory names, anything else (e.g. '../foo') could resolve to a directory outside of
+        # the runfolder directory. This also means that a name can only ever match a single directory.
+        if not runfolder or os.path.basename(runfolder) != runfolder:
+            return None
+
+        if not self._is_runfolder_name(runfolder):
             return None
+
+        # The directory is absolute, like those listed in the runfolder directory
+        directory = os.path.abspath(os.path.join(self._base_path, runfolder))
+        if not self.file_system_service.isdir(directory):
+            return None
+
+        return self._runfolder_from_directory(directory)
+
+    @gen.coroutine
+    def get_runfolders_async(self, name_prefix=None):
+        """
+        Get all runfolders, ordered by name, without blocking the IOLoop
+        :param name_prefix: if set, only get the runfolders whose names start with this
+        :return: a list of known runfolders
+        :raises FileSystemTimeoutException: if the file system did not respond in time
+        """
+        runfolders = yield self.file_system_executor.run(lambda: list(self.get_runfolders(name_prefix)))
+        return runfolders
+
+    def get_runfolder_batches_async(self, name_prefix=None, after=None, batch_size=100):
+        """
+        Get all runfolders, ordered by name, a batch at a time without blocking the IOLoop. The runfolders are
+        looked up as the batches are asked for, so the first ones can be used before all of them are known.
+        :param name_prefix: if set, only get the runfolders whose names start with this
+        :param after: if set, only get the runfolders whose names come after this
+        :param batch_size: the number of runfolders in each batch, defaults to 100
+        :return: a coroutine function which returns the next batch of runfolders as a list, or an empty list once
+                 there are no more runfolders. It raises FileSystemTimeoutException if the file system did not
+                 respond in time.
+        """
+        def get_runfolders():
+            yield from self.get_runfolders(name_prefix, after)
+
+        # The body of a generator does not run until it is iterated over, so nothing is looked up on the IOLoop
+        runfolders = get_runfolders()
+
+        def next_batch():
+            return list(islice(runfolders, batch_size))
+
+        @gen.coroutine
+        def next_batch_async():
+            batch = yield self.file_system_executor.run(next_batch)
+            return batch
+
+        return next_batch_async
+
+    @gen.coroutine
+    def get_runfolder_async(self, runfolder):
+        """
+        Get a Runfolder object matching the specified name, without blocking the IOLoop
+        :param runfolder: to look for
+        :return: the matching runfolder, or None if no match
+        :raises FileSystemTimeoutException: if the file system did not respond in time
+        """
+        result = yield self.file_system_executor.run(self.get_runfolder, runfolder)
+        return result
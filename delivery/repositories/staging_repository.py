@@ -1,14 +1,28 @@
 
 import os
 import logging
+import time
 
+from sqlalchemy import func, or_, and_
 from sqlalchemy.orm.exc import NoResultFound
 
-from delivery.models.db_models import StagingOrder
+from delivery.models.db_models import StagingOrder, StagingStatus, StagingVerificationMismatch, DeliveryOrder, \
+    DeliveryStatus
 from delivery.services.file_system_service import FileSystemService
 
 log = logging.getLogger(__name__)
 
+# Statuses of staging orders which are being staged
+_STAGING_STATUSES_IN_PROGRESS = [StagingStatus.staging_in_progress, StagingStatus.staging_verifying]
+
+# Statuses of staging orders whose staging is done, and whose staged files can be evicted
+_STAGING_STATUSES_EVICTABLE = [StagingStatus.staging_successful, StagingStatus.staging_failed]
+
+# Statuses of delivery orders which might still read the staged files
+_DELIVERY_STATUSES_IN_PROGRESS = [DeliveryStatus.pending,
+                                  DeliveryStatus.mover_processing_delivery,
+                                  DeliveryStatus.delivery_in_progress]
+
 
 class DatabaseBasedStagingRepository(object):
     """
@@ -56,20 +70,62 @@ class DatabaseBasedStagingRepository(object):
         except NoResultFound:
             return None
 
-    def create_staging_order(self, source, status, staging_target_dir):
+    def get_reusable_staging_order(self, source, source_fingerprint, custom_session=None):
         """
-        Create a StatingOrder and commit it to the database
-        :param source: the directory or file to stage
-        :param status: the initial StatingStatus to assign to the StatingORder
-        :param staging_target_dir: the directory to which the StagingOrder should transfer the source
-        :return:
+        Get the latest successful staging order of a source, which was staged when the source had a given fingerprint
+        :param source: which was staged
+        :param source_fingerprint: the fingerprint the source should have had, see `FileSystemService.fingerprint`
+        :param custom_session: provide an other session object, see `get_staging_order_by_id`
+        :return: the matching StagingOrder, or None if there is no matching staging order
         """
+        session = custom_session or self.session
+        return session.query(StagingOrder).\
+            filter(StagingOrder.source == source).\
+            filter(StagingOrder.source_fingerprint == source_fingerprint).\
+            filter(StagingOrder.status == StagingStatus.staging_successful).\
+            order_by(StagingOrder.id.desc()).\
+            first()
 
-        order = StagingOrder(source=source, status=status)
-        self.session.add(order)
+    def get_pending_staging_orders(self):
+        """
+        Get the queue of staging orders which are waiting to be staged
+        :return: all pending staging orders as a list, in the order in which they should be staged, i.e. highest
+                 priority first, and in the order they were created within the same priority
+        """
+        return self.session.query(StagingOrder).\
+            filter(StagingOrder.status == StagingStatus.pending).\
+            order_by(StagingOrder.priority.desc(), StagingOrder.id).\
+            all()
 
-        self.session.commit()
+    def get_staging_orders_in_progress(self, lock=False, custom_session=None):
+        """
+        Get the staging orders which are marked as being staged, i.e. copied or verified
+        :param lock: if True, lock the staging orders in progress against changes from other connections until the
+                     session is committed or rolled back. On SQLite this locks the whole database for writing.
+        :param custom_session: provide an other session object, see `get_staging_order_by_id`
+        :return: all staging orders in progress as a list
+        """
+        session = custom_session or self.session
+        query = session.query(StagingOrder).filter(StagingOrder.status.in_(_STAGING_STATUSES_IN_PROGRESS))
+        if lock:
+            # SQLite ignores `FOR UPDATE`, but a write, even one which changes nothing, takes the database
+            # write lock, and on other databases it locks the rows it touches.
+            query.update({StagingOrder.status: StagingOrder.status}, synchronize_session=False)
+        return query.order_by(StagingOrder.id).all()
 
+    def get_number_of_pending_staging_orders_before(self, staging_order):
+        """
+        Count the number of pending staging orders which will be staged before a staging order
+        :param staging_order: to count the staging orders before
+        :return: the number of pending staging orders ahead of it in the queue
+        """
+        return self.session.query(StagingOrder).\
+            filter(StagingOrder.status == StagingStatus.pending).\
+            filter(or_(StagingOrder.priority > staging_order.priority,
+                       and_(StagingOrder.priority == staging_order.priority, StagingOrder.id < staging_order.id))).\
+            count()
+
+    def _staging_target(self, order, staging_target_dir):
         if self.file_system_service.isfile(order.source):
             log.debug("Order source is a file")
             source_base_name = self.file_system_service.basename(order.source)
@@ -86,8 +142,166 @@ class DatabaseBasedStagingRepository(object):
                                           source_base_name))
 
         log.debug("Set the staging target to: {}".format(staging_target))
+        return staging_target
+
+    def create_staging_order(self, source, status, staging_target_dir, priority=0):
+        """
+        Create a StatingOrder and commit it to the database
+        :param source: the directory or file to stage
+        :param status: the initial StatingStatus to assign to the StatingORder
+        :param staging_target_dir: the directory to which the StagingOrder should transfer the source
+        :param priority: of the StagingOrder, higher priorities are staged first. Defaults to 0.
+        :return:
+        """
+        try:
+            order = StagingOrder(source=source, status=status, priority=priority, queued_at=time.time())
+            self.session.add(order)
+            # Get an id for the order, which is part of its staging target
+            self.session.flush()
+            order.staging_target = self._staging_target(order, staging_target_dir)
+            self.session.commit()
+            return order
+        except Exception:
+            self.session.rollback()
+            raise
 
-        order.staging_target = staging_target
-        self.session.commit()
+    def get_or_create_staging_order(self, source, staging_target_dir, priority=0):
+        """
+        Get the staging order of a source which is pending or in progress, or if there is none, create a new pending
+        staging order for it and commit it to the database. The database is locked for writing while doing so (see
+        `get_staging_orders_in_progress`), so that several requests to stage the same source at the same time all
+        get the same staging order. This relies on SQLite locking the whole database, databases with row locks only
+        lock the existing staging orders. A pending staging order with a lower priority is given the higher priority.
+        :param source: the directory or file to stage
+        :param staging_target_dir: the directory to which a new StagingOrder should transfer the source
+        :param priority: of the StagingOrder, higher priorities are staged first. Defaults to 0.
+        :return: a tuple of the StagingOrder and True if it was created, or False if it already existed
+        """
+        return self.get_or_create_staging_orders([source], staging_target_dir, priority)[0]
+
+    def get_or_create_staging_orders(self, sources, staging_target_dir, priority=0):
+        """
+        Like `get_or_create_staging_order`, but for many sources at once. All new staging orders are inserted
+        together and committed in a single transaction, so either all or none of them are created.
+        :param sources: the directories or files to stage
+        :param staging_target_dir: the directory to which new StagingOrders should transfer the sources
+        :param priority: of the StagingOrders, higher priorities are staged first. Defaults to 0.
+        :return: a list of (StagingOrder, created) tuples, in the same order as the sources. A source which is given
+                 more than once gets the same staging order each time.
+        """
+        try:
+            existing_orders = {}
+            if sources:
+                active_orders = self.session.query(StagingOrder).\
+                    filter(StagingOrder.source.in_(set(sources))).\
+                    filter(StagingOrder.status.in_([StagingStatus.pending] + _STAGING_STATUSES_IN_PROGRESS))
+                # Take the database write lock, which on SQLite keeps other connections from creating staging
+                # orders until this transaction ends. On databases with row locks this would only lock the existing
+                # staging orders, and would not keep two connections from both creating one for the same source.
+                active_orders.update({StagingOrder.source: StagingOrder.source}, synchronize_session=False)
+                for order in active_orders.order_by(StagingOrder.id.desc()):
+                    existing_orders[order.source] = order
+
+            for order in existing_orders.values():
+                if order.status == StagingStatus.pending and order.priority < priority:
+                    log.info("Raising the priority of: {} from {} to {}".format(order, order.priority, priority))
+                    order.priority = priority
+
+            new_orders = {}
+            queued_at = time.time()
+            for source in sources:
+                if source not in existing_orders and source not in new_orders:
+                    new_orders[source] = StagingOrder(source=source, status=StagingStatus.pending,
+                                                      priority=priority, queued_at=queued_at)
+
+            if new_orders:
+                self.session.add_all(new_orders.values())
+                # Get ids for the orders, which are part of their staging targets
+                self.session.flush()
+                for order in new_orders.values():
+                    order.staging_target = self._staging_target(order, staging_target_dir)
+            self.session.commit()
+
+            return [(existing_orders[source], False) if source in existing_orders else (new_orders[source], True)
+                    for source in sources]
+        except Exception:
+            self.session.rollback()
+            raise
+
+    def add_verification_mismatches(self, staging_order_id, mismatches, custom_session=None):
+        """
+        Record the files of a staging order which did not match the source when the staging was verified. The
+        session is not committed.
+        :param staging_order_id: id of the verified staging order
+        :param mismatches: list of (path relative to the staging target, md5 of the source file, md5 of the staged
+                           file) tuples
+        :param custom_session: provide an other session object, see `get_staging_order_by_id`
+        :return: None
+        """
+        session = custom_session or self.session
+        session.add_all([StagingVerificationMismatch(staging_order_id=staging_order_id,
+                                                     path=path,
+                                                     source_md5sum=source_md5sum,
+                                                     staged_md5sum=staged_md5sum)
+                         for path, source_md5sum, staged_md5sum in mismatches])
+
+    def get_verification_mismatches(self, staging_order_id):
+        """
+        Get the files of a staging order which did not match the source when the staging was verified
+        :param staging_order_id: id of the staging order
+        :return: the StagingVerificationMismatches of the staging order as a list, ordered by path
+        """
+        return self.session.query(StagingVerificationMismatch).\
+            filter(StagingVerificationMismatch.staging_order_id == staging_order_id).\
+            order_by(StagingVerificationMismatch.path).\
+            all()
+
+    @staticmethod
+    def _is_not_being_delivered(session):
+        being_delivered = session.query(DeliveryOrder.staging_order_id).\
+            filter(DeliveryOrder.delivery_status.in_(_DELIVERY_STATUSES_IN_PROGRESS)).\
+            filter(DeliveryOrder.staging_order_id.isnot(None))
+        return ~StagingOrder.id.in_(being_delivered.subquery())
+
+    def get_evictable_staging_orders(self, custom_session=None):
+        """
+        Get the staging orders whose staged files can be evicted, i.e. those which are done staging and are not
+        being delivered by any delivery order which is pending or in progress
+        :param custom_session: provide an other session object, see `get_staging_order_by_id`
+        :return: the evictable staging orders as a list, least recently used first
+        """
+        session = custom_session or self.session
+        return session.query(StagingOrder).\
+            filter(StagingOrder.status.in_(_STAGING_STATUSES_EVICTABLE)).\
+            filter(StagingOrder.staging_target.isnot(None)).\
+            filter(self._is_not_being_delivered(session)).\
+            order_by(func.coalesce(StagingOrder.last_used_at, 0), StagingOrder.id).\
+            all()
+
+    def mark_staging_order_evicted(self, staging_order_id, custom_session=None):
+        """
+        Mark a staging order as evicted and commit it, unless it has started being delivered, or has changed status,
+        since it was found to be evictable. The database is locked for writing while checking this (see
+        `get_staging_orders_in_progress`), so that a delivery order which is created at the same time either
+        prevents the eviction or sees that the staging order has been evicted. This should be done before the
+        staged files are removed.
+        :param staging_order_id: id of the staging order to evict
+        :param custom_session: provide an other session object, see `get_staging_order_by_id`
+        :return: the evicted StagingOrder, or None if it can not be evicted any longer
+        """
+        session = custom_session or self.session
+        try:
+            evictable = session.query(StagingOrder).\
+                filter(StagingOrder.id == staging_order_id).\
+                filter(StagingOrder.status.in_(_STAGING_STATUSES_EVICTABLE))
+            evictable.update({StagingOrder.status: StagingOrder.status}, synchronize_session=False)
 
-        return order
+            staging_order = evictable.filter(self._is_not_being_delivered(session)).first()
+            if staging_order:
+                staging_order.status = StagingStatus.evicted
+                staging_order.evicted_at = time.time()
+            session.commit()
+            return staging_order
+        except Exception:
+            session.rollback()
+            raise
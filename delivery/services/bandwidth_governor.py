@@ -0,0 +1,181 @@
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class _TokenBucket(object):
+    """
+    A token bucket which fills up with `rate` tokens (bytes) per second, up to `burst` seconds worth of tokens.
+    Tokens are reserved rather than waited for, so the bucket can go into debt, and whoever reserved tokens it did
+    not have is told how long to wait before using them. That way the reservations are served in the order they
+    were made, and no one has to poll the bucket.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = rate * burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.tokens + (now - self.updated_at) * self.rate, self.rate * self.burst)
+        self.updated_at = now
+
+    def set_rate(self, rate):
+        # Tokens accumulated so far were accumulated at the old rate
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.tokens = min(self.tokens, rate * self.burst)
+
+    def reserve(self, nbr_of_tokens):
+        """
+        Take tokens from the bucket
+        :param nbr_of_tokens: to take
+        :return: the number of seconds to wait before using them
+        """
+        self._refill(time.monotonic())
+        self.tokens -= nbr_of_tokens
+        return max(-self.tokens / self.rate, 0)
+
+
+class BandwidthGovernor(object):
+    """
+    Keeps the transfers of staging orders within a bandwidth budget. There is an optional global limit, which is
+    shared by all transfers, and optional limits per target, i.e. per staging directory, which are shared by the
+    transfers into that directory. Each limit is a token bucket, and the transfers take tokens from the buckets of
+    the limits which apply to them for each chunk they copy, waiting for them if they have to, so that the bandwidth
+    is spread over the active transfers as they ask for it.
+
+    Transfers which can not be throttled chunk by chunk, like those done by rsync, can instead ask for their
+    fair share of the limits, i.e. the limits divided by the number of transfers sharing them, when they start.
+
+    The limits can be changed at any time, and apply straight away to the transfers which take tokens.
+    """
+
+    def __init__(self, limit=None, limits_per_target=None, burst=1):
+        """
+        Instantiate a new BandwidthGovernor
+        :param limit: number of bytes per second to transfer, in total. Defaults to None, which means no limit
+        :param limits_per_target: a dict of staging directory -> number of bytes per second to transfer into it.
+                                  Defaults to None, which means no limits per target
+        :param burst: number of seconds worth of bytes which may be transferred at once after being idle, defaults
+                      to 1
+        """
+        self.burst = burst
+
+        self._lock = threading.Lock()
+        self._limit = None
+        self._limits_per_target = {}
+        self._bucket = None
+        self._buckets_per_target = {}
+        # Transfer id -> target, of the transfers in progress
+        self._targets_of_transfers = {}
+
+        self.set_limits(limit, limits_per_target)
+
+    @staticmethod
+    def _validate_limit(limit):
+        if limit is None:
+            return
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit <= 0:
+            raise ValueError("A bandwidth limit must be a positive number of bytes per second, got: {}".format(limit))
+
+    def _updated_bucket(self, bucket, limit):
+        if limit is None:
+            return None
+        if bucket is None:
+            return _TokenBucket(limit, self.burst)
+        bucket.set_rate(limit)
+        return bucket
+
+    def set_limits(self, limit=None, limits_per_target=None):
+        """
+        Replace the bandwidth limits. Transfers in progress keep their place in line, but are throttled according
+        to the new limits from now on.
+        :param limit: number of bytes per second to transfer, in total, or None for no limit
+        :param limits_per_target: a dict of staging directory -> number of bytes per second to transfer into it, or
+                                  None for no limits per target
+        :return: None
+        :raises ValueError: if any of the limits is not a positive integer
+        """
+        limits_per_target = dict(limits_per_target or {})
+        self._validate_limit(limit)
+        for target_limit in limits_per_target.values():
+            self._validate_limit(target_limit)
+
+        with self._lock:
+            self._limit = limit
+            self._bucket = self._updated_bucket(self._bucket, limit)
+
+            self._limits_per_target = limits_per_target
+            self._buckets_per_target = {target: self._updated_bucket(self._buckets_per_target.get(target),
+                                                                     target_limit)
+                                        for target, target_limit in limits_per_target.items()}
+
+        log.info("Limiting the bandwidth of staging transfers to: {} bytes/s in total, and per target to: {}".
+                 format(limit, limits_per_target))
+
+    def get_limits(self):
+        """
+        Get the bandwidth limits
+        :return: a tuple of the global limit, or None, and a dict of staging directory -> limit
+        """
+        with self._lock:
+            return self._limit, dict(self._limits_per_target)
+
+    def get_number_of_transfers(self):
+        """
+        :return: the number of transfers in progress which are governed
+        """
+        with self._lock:
+            return len(self._targets_of_transfers)
+
+    def transfer_started(self, transfer_id, target):
+        """
+        Register a transfer which is governed
+        :param transfer_id: identifier of the transfer, e.g. the id of the staging order
+        :param target: the staging directory it transfers into
+        :return: None
+        """
+        with self._lock:
+            self._targets_of_transfers[transfer_id] = target
+
+    def transfer_finished(self, transfer_id):
+        """
+        Unregister a transfer, once it is done
+        :param transfer_id: identifier of the transfer
+        :return: None
+        """
+        with self._lock:
+            self._targets_of_transfers.pop(transfer_id, None)
+
+    def fair_share(self, transfer_id):
+        """
+        Get the share of the bandwidth of a transfer, given the limits and the number of transfers sharing them
+        :param transfer_id: identifier of a transfer which has been started
+        :return: the number of bytes per second the transfer may use, or None if it is not limited
+        """
+        with self._lock:
+            target = self._targets_of_transfers.get(transfer_id)
+            shares = []
+            if self._limit is not None:
+                shares.append(self._limit / max(len(self._targets_of_transfers), 1))
+            target_limit = self._limits_per_target.get(target)
+            if target_limit is not None:
+                nbr_in_target = sum(1 for other_target in self._targets_of_transfers.values()
+                                    if other_target == target)
+                shares.append(target_limit / max(nbr_in_target, 1))
+            return int(min(shares)) if shares else None
+
+    def reserve(self, transfer_id, nbr_of_bytes):
+        """
+        Take bandwidth for a chunk of a transfer
+        :param transfer_id: identifier of a transfer which has been started
+        :param nbr_of_bytes: the size of the chunk
+        :return: the number of seconds to wait before transferring the chunk
+        """
+        with self._lock:
+            buckets = [self._bucket, self._buckets_per_target.get(self._targets_of_transfers.get(transfer_id))]
+            return max([bucket.reserve(nbr_of_bytes) for bucket in buckets if bucket is not None] or [0])
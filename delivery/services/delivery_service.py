@@ -1,6 +1,8 @@
 import os.path
 import logging
 import re
+import time
+from sqlalchemy.orm import object_session
 from tornado import gen
 
 from delivery.exceptions import InvalidStatusException, CannotParseMoverOutputException
@@ -46,7 +48,7 @@ class MoverDeliveryService(object):
                    delivery_order.delivery_project]
 
             if delivery_order.md5sum_file:
-                cmd += delivery_order.md5sum_file
+                cmd.append(delivery_order.md5sum_file)
 
             execution = external_program_service.run(cmd)
             delivery_order.delivery_status = DeliveryStatus.mover_processing_delivery
@@ -75,19 +77,46 @@ class MoverDeliveryService(object):
             session.commit()
 
     @gen.coroutine
-    def deliver_by_staging_id(self, staging_id, delivery_project, md5sum_file, skip_mover=False):
+    def deliver_by_staging_id(self, staging_id, delivery_project, md5sum_file=None, skip_mover=False):
+        """
+        Deliver the files staged by a successful staging order with Mover
+        :param staging_id: id of the staging order
+        :param delivery_project: the project to deliver to
+        :param md5sum_file: md5sum file to pass on to Mover. Defaults to None, which means that the manifest
+                            written while staging is used, if there is one.
+        :param skip_mover: if True, do not actually run Mover (for testing purposes)
+        :return: the id of the new delivery order
+        """
 
         stage_order = self.staging_service.get_stage_order_by_id(staging_id)
         if not stage_order or not stage_order.status == StagingStatus.staging_successful:
             raise InvalidStatusException("Only deliver by staging_id if it has a successful status!"
                                          "Staging order was: {}".format(stage_order))
 
+        if not md5sum_file:
+            md5sum_file = stage_order.md5sum_file
+
         delivery_order = self.delivery_repo.create_delivery_order(delivery_source=stage_order.get_staging_path(),
                                                                   delivery_project=delivery_project,
                                                                   delivery_status=DeliveryStatus.pending,
                                                                   staging_order_id=staging_id,
                                                                   md5sum_file=md5sum_file)
 
+        # The staged files might have been evicted before the delivery order was committed, once it is committed
+        # they will not be
+        stage_order_session = object_session(stage_order)
+        if stage_order_session:
+            stage_order_session.refresh(stage_order)
+        if stage_order.status != StagingStatus.staging_successful:
+            delivery_order.delivery_status = DeliveryStatus.delivery_failed
+            self.session_factory().commit()
+            raise InvalidStatusException("The staged files of: {} were evicted before they could be delivered".
+                                         format(stage_order))
+
+        stage_order.last_used_at = time.time()
+        if stage_order_session:
+            stage_order_session.commit()
+
         args_for_run_mover = {'delivery_order_id': delivery_order.id,
                               'delivery_order_repo': self.delivery_repo,
                               'external_program_service': self.mover_external_program_service,
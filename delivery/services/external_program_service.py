@@ -1,6 +1,7 @@
 
 
 from tornado.process import Subprocess
+from tornado.iostream import StreamClosedError
 from tornado import gen
 
 from subprocess import PIPE
@@ -13,30 +14,70 @@ class ExternalProgramService(object):
     A service for running external programs
     """
 
+    # Number of bytes to read at a time when following the output of a program
+    OUTPUT_CHUNK_SIZE = 64 * 1024
+
     @staticmethod
-    def run(cmd):
+    def run(cmd, follow_output=False):
         """
         Run a process and do not wait for it to finish
         :param cmd: the command to run as a list, i.e. ['ls','-l', '/']
+        :param follow_output: if True, the output of the process can be followed as it is written, by passing an
+                              `output_callback` to `wait_for_execution`
         :return: A instance of Execution
         """
+        output = Subprocess.STREAM if follow_output else PIPE
         p = Subprocess(cmd,
-                       stdout=PIPE,
-                       stderr=PIPE,
+                       stdout=output,
+                       stderr=output,
                        stdin=PIPE)
         return Execution(pid=p.pid, process_obj=p)
 
     @staticmethod
     @gen.coroutine
-    def wait_for_execution(execution):
+    def _follow_output(stream, output_callback):
+        kept_lines = []
+        unfinished_line = b''
+        try:
+            while True:
+                chunk = yield stream.read_bytes(ExternalProgramService.OUTPUT_CHUNK_SIZE, partial=True)
+                # Progress is often reported by rewriting the same line, ending it with a carriage return
+                lines = (unfinished_line + chunk).replace(b'\r', b'\n').split(b'\n')
+                unfinished_line = lines.pop()
+                for line in lines:
+                    decoded_line = line.decode('UTF-8')
+                    if not output_callback(decoded_line):
+                        kept_lines.append(decoded_line)
+        except StreamClosedError:
+            pass
+
+        if unfinished_line:
+            decoded_line = unfinished_line.decode('UTF-8')
+            if not output_callback(decoded_line):
+                kept_lines.append(decoded_line)
+
+        return '\n'.join(kept_lines)
+
+    @staticmethod
+    @gen.coroutine
+    def wait_for_execution(execution, output_callback=None):
         """
         Wait for an execution to finish
         :param execution: instance of Execution
+        :param output_callback: if the execution was started with `follow_output`, this is called with each line
+                                written to stdout as soon as it has been written. If it returns True, the line is
+                                considered handled and is left out of the stdout of the ExecutionResult.
         :return: an ExecutionResult for the execution
         """
-        status_code = yield execution.process_obj.wait_for_exit(raise_error=False)
-        out = execution.process_obj.stdout.read().decode('UTF-8')
-        err = execution.process_obj.stderr.read().decode('UTF-8')
+        if output_callback:
+            out, err = yield [ExternalProgramService._follow_output(execution.process_obj.stdout, output_callback),
+                              execution.process_obj.stderr.read_until_close()]
+            err = err.decode('UTF-8')
+            status_code = yield execution.process_obj.wait_for_exit(raise_error=False)
+        else:
+            status_code = yield execution.process_obj.wait_for_exit(raise_error=False)
+            out = execution.process_obj.stdout.read().decode('UTF-8')
+            err = execution.process_obj.stderr.read().decode('UTF-8')
 
         return ExecutionResult(out, err, status_code)
 
@@ -49,4 +90,3 @@ class ExternalProgramService(object):
         """
         execution = ExternalProgramService.run(cmd)
         return ExternalProgramService.wait_for_execution(execution)
-
@@ -1,10 +1,22 @@
 
+import fcntl
+import hashlib
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
 import logging
 
+from tornado import gen
+
+from delivery.exceptions import FileSystemTimeoutException
+
 log = logging.getLogger(__name__)
 
+# ioctl request to clone a file, see `man ioctl_ficlone`
+FICLONE = 0x40049409
+
 
 class FileSystemService(object):
     """
@@ -12,6 +24,36 @@ class FileSystemService(object):
     easily be mocked out in testing.
     """
 
+    @staticmethod
+    def scan_directories(base_path, batch_size=None):
+        """
+        Stream the directories in base_path as `os.DirEntry` instances. Whether an entry is a directory
+        is decided from the file type which the directory read itself returns (on file systems which support it),
+        so this does not require a stat call per entry. Stat results fetched with `DirEntry.stat()` are cached
+        on the entry.
+        :param base_path: base path to list directories in.
+        :param batch_size: if set, yield lists of at most `batch_size` entries instead of single entries
+        :return: a generator of `os.DirEntry` instances, or of lists of them if `batch_size` is set. The `path`
+                 of each entry is absolute.
+        """
+        abs_base_path = os.path.abspath(base_path)
+        log.debug("Listing dirs in: {}".format(abs_base_path))
+
+        batch = []
+        with os.scandir(abs_base_path) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                if not batch_size:
+                    yield entry
+                    continue
+                batch.append(entry)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
     @staticmethod
     def list_directories(base_path):
         """
@@ -19,14 +61,165 @@ class FileSystemService(object):
         :param base_path: base path to list directories in.
         :return: a generator of paths to directories
         """
+        for entry in FileSystemService.scan_directories(base_path):
+            yield entry.path
+
+    @staticmethod
+    def walk_tree(path):
+        """
+        Walk a directory tree the way it is staged, i.e. following symlinks like `rsync --copy-links`, but only
+        entering a linked directory once.
+        :param path: directory to walk
+        :return: a generator of (path relative to `path`, os.DirEntry) tuples, for all directories and files.
+                 Directories are generated before anything they contain.
+        """
+        visited_linked_directories = set()
+        directories = ['']
+        while directories:
+            relative_dir = directories.pop()
+            with os.scandir(os.path.join(path, relative_dir)) as entries:
+                for entry in entries:
+                    relative_path = os.path.join(relative_dir, entry.name)
+                    if entry.is_dir():
+                        if entry.is_symlink():
+                            entry_stat = entry.stat()
+                            inode = (entry_stat.st_dev, entry_stat.st_ino)
+                            if inode in visited_linked_directories:
+                                continue
+                            visited_linked_directories.add(inode)
+                        directories.append(relative_path)
+                    yield relative_path, entry
 
-        log.debug("Listing dirs in: {}".format(os.path.abspath(base_path)))
-        for my_dir in os.listdir(base_path):
-            dir_abs_path = os.path.abspath(os.path.join(base_path, my_dir))
+    @staticmethod
+    def size_and_file_count(path):
+        """
+        Sum up the size of all files under path. Symlinks are followed, in the same way as when the
+        path is staged, see `walk_tree`.
+        :param path: a directory or file
+        :return: a tuple of the total size in bytes and the number of files
+        """
+        if not os.path.isdir(path):
+            return os.path.getsize(path), 1
 
-            if os.path.isdir(dir_abs_path):
-                log.debug("Found dir: {}".format(dir_abs_path))
-                yield dir_abs_path
+        total_size = 0
+        nbr_of_files = 0
+        for _, entry in FileSystemService.walk_tree(path):
+            if not entry.is_dir():
+                total_size += entry.stat().st_size
+                nbr_of_files += 1
+        return total_size, nbr_of_files
+
+    @staticmethod
+    def fingerprint(path):
+        """
+        Compute a fingerprint of a directory tree, or a file, from a manifest of the paths, sizes and modification
+        times of its files and the paths of its directories. Symlinks are followed, see `walk_tree`. The
+        fingerprint changes when anything is added, removed, renamed or modified, but the contents of the files are
+        not read, so it is cheap to compute.
+        :param path: a directory or file
+        :return: the fingerprint as a hex string
+        """
+        if not os.path.isdir(path):
+            file_stat = os.stat(path)
+            manifest = [('', file_stat.st_size, file_stat.st_mtime_ns)]
+        else:
+            manifest = []
+            for relative_path, entry in FileSystemService.walk_tree(path):
+                if entry.is_dir():
+                    manifest.append((relative_path, None, None))
+                else:
+                    entry_stat = entry.stat()
+                    manifest.append((relative_path, entry_stat.st_size, entry_stat.st_mtime_ns))
+            # The order in which the entries are listed is arbitrary
+            manifest.sort()
+
+        fingerprint = hashlib.sha256()
+        for relative_path, size, mtime in manifest:
+            line = '{}\0{}\0{}\n'.format(relative_path, size, mtime)
+            fingerprint.update(line.encode('UTF-8', 'surrogateescape'))
+        return fingerprint.hexdigest()
+
+    @staticmethod
+    def md5sum(path, buffer_size=8 * 1024 * 1024):
+        """
+        Compute the md5 checksum of a file, reading it in large sequential chunks. Since this is a plain function
+        of the path it can be run in a process pool, so that many files can be hashed in parallel.
+        :param path: file to hash
+        :param buffer_size: number of bytes to read at a time
+        :return: the checksum as a hex string
+        """
+        checksum = hashlib.md5()
+        with open(path, 'rb') as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            for chunk in iter(lambda: f.read(buffer_size), b''):
+                checksum.update(chunk)
+        return checksum.hexdigest()
+
+    @staticmethod
+    def hardlink(source, target):
+        """
+        Shadows os.link
+        :param source: existing file
+        :param target: new link to create
+        :return: None
+        """
+        os.link(source, target)
+
+    @staticmethod
+    def reflink(source, target):
+        """
+        Create a copy-on-write clone of a file, which shares its data with the original until either is modified.
+        Only supported by some file systems (e.g. btrfs and xfs), and only within a file system.
+        :param source: existing file
+        :param target: new file to create
+        :return: None
+        :raises OSError: if the file system does not support cloning the file, in which case no target is left
+        """
+        try:
+            with open(source, 'rb') as source_file, open(target, 'wb') as target_file:
+                fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+            shutil.copymode(source, target)
+        except OSError:
+            # Don't leave an empty file behind, which would be in the way of e.g. hardlinking the file instead
+            if os.path.lexists(target):
+                os.remove(target)
+            raise
+
+    @staticmethod
+    def link_tree(source, target, link_file):
+        """
+        Recreate a directory tree, or a single file, by linking each file to the original, e.g. with `hardlink`
+        or `reflink`. Symlinks are followed, see `walk_tree`. If linking fails, anything already created is
+        removed.
+        :param source: directory or file to recreate
+        :param target: path to recreate it at, which must not exist
+        :param link_file: function taking a source and target file path and creating the target from the source
+        :return: the total size in bytes of the linked files
+        """
+        if not os.path.isdir(source):
+            try:
+                link_file(source, target)
+            except Exception:
+                if os.path.lexists(target):
+                    os.remove(target)
+                raise
+            return os.path.getsize(target)
+
+        total_size = 0
+        os.mkdir(target)
+        try:
+            for relative_path, entry in FileSystemService.walk_tree(source):
+                target_path = os.path.join(target, relative_path)
+                if entry.is_dir():
+                    os.mkdir(target_path)
+                else:
+                    link_file(entry.path, target_path)
+                    total_size += entry.stat().st_size
+        except Exception:
+            shutil.rmtree(target, ignore_errors=True)
+            raise
+        return total_size
 
     def find_project_directories(self, projects_base_dir):
         """
@@ -62,6 +255,34 @@ class FileSystemService(object):
         """
         return os.path.isfile(path)
 
+    @staticmethod
+    def getmtime(path):
+        """
+        Shadows os.path.getmtime
+        :param path: to get the modification time for
+        :return: the modification time of path as per os.path.getmtime
+        """
+        return os.path.getmtime(path)
+
+    @staticmethod
+    def device_of(path):
+        """
+        Get the id of the device on which a file or directory resides, following symlinks
+        :param path: to get the device for
+        :return: the device id as per os.stat(path).st_dev
+        """
+        return os.stat(path).st_dev
+
+    @staticmethod
+    def free_space(path):
+        """
+        Get the free space available to unprivileged users on the file system of a path, as per os.statvfs
+        :param path: on the file system
+        :return: the number of free bytes
+        """
+        stat = os.statvfs(path)
+        return stat.f_bavail * stat.f_frsize
+
     @staticmethod
     def basename(path):
         """
@@ -79,3 +300,45 @@ class FileSystemService(object):
         :return: abs path to file/dir as per os.path.abspath
         """
         return os.path.abspath(path)
+
+
+class FileSystemExecutor(object):
+    """
+    Runs blocking file system calls on a dedicated, bounded, thread pool so that they do not block the IOLoop.
+    Since a call on e.g. a hung NFS mount might never return, calls can be given a timeout after which the
+    caller gives up on them.
+    """
+
+    def __init__(self, max_workers=4, timeout=None):
+        """
+        Instantiate a new FileSystemExecutor
+        :param max_workers: the maximum number of file system calls to run at the same time
+        :param timeout: number of seconds to wait for a call to finish before giving up on it, defaults to None,
+                        i.e. waiting forever.
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    @gen.coroutine
+    def run(self, function, *args, **kwargs):
+        """
+        Run function with the given arguments on the thread pool
+        :param function: to run
+        :return: the return value of function
+        :raises FileSystemTimeoutException: if the call did not finish within the timeout. A call which is still
+                                            waiting for a free thread at that point is cancelled, while one which
+                                            has already started keeps its thread until it returns.
+        """
+        future = self._executor.submit(function, *args, **kwargs)
+        if not self.timeout:
+            result = yield future
+            return result
+
+        try:
+            result = yield gen.with_timeout(timedelta(seconds=self.timeout), future)
+            return result
+        except gen.TimeoutError:
+            future.cancel()
+            raise FileSystemTimeoutException("File system call {} did not finish within {} seconds".
+                                             format(getattr(function, "__name__", function), self.timeout))
@@ -0,0 +1,176 @@
+
+import copy
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from delivery.services.file_system_service import FileSystemService, FileSystemExecutor
+
+log = logging.getLogger(__name__)
+
+
+class ProjectSizeService(object):
+    """
+    Keeps track of the size and number of files of all runfolder and general projects. Projects are scanned in
+    parallel in the background, and the results are stored in the database. A project is only scanned again once
+    the modification time of its directory, or of any of its immediate subdirectories (e.g. the sample directories
+    of a runfolder project), has changed.
+
+    Since changes further down in a project, or to the contents of its files, do not change those modification
+    times, a scanned size is only an indication of the size of a project. It is good enough to show to clients,
+    but not to rely on, e.g. when deciding whether there is room to stage a project.
+    """
+
+    def __init__(self, runfolder_repo, general_project_repo, directory_size_repo,
+                 file_system_service=FileSystemService(), scan_workers=4, file_system_executor=None):
+        """
+        Instantiate a new ProjectSizeService
+        :param runfolder_repo: a `FileSystemBasedRunfolderRepository` to find runfolder projects in
+        :param general_project_repo: a `GeneralProjectRepository` to find general projects in
+        :param directory_size_repo: a `DatabaseBasedDirectorySizeRepository` to store the sizes in
+        :param file_system_service: a service which can access the file system
+        :param scan_workers: number of projects to scan at the same time
+        :param file_system_executor: a `FileSystemExecutor` which the `*_async` methods run their file system and
+                                     database calls on. Defaults to a new `FileSystemExecutor` for this service.
+        """
+        self.runfolder_repo = runfolder_repo
+        self.general_project_repo = general_project_repo
+        self.directory_size_repo = directory_size_repo
+        self.file_system_service = file_system_service
+        self.scan_workers = scan_workers
+        self.file_system_executor = file_system_executor or FileSystemExecutor()
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._scan_in_progress = False
+        self._periodic_callback = None
+
+    def _mtime_of(self, path):
+        mtimes = [self.file_system_service.getmtime(path)]
+        for entry in self.file_system_service.scan_directories(path):
+            mtimes.append(entry.stat().st_mtime)
+        return max(mtimes)
+
+    def _scan(self, path):
+        try:
+            # The modification time is read before scanning, so that any change made
+            # while scanning will be picked up by the next scan.
+            mtime = self._mtime_of(path)
+            size, file_count = self.file_system_service.size_and_file_count(path)
+            return path, size, file_count, mtime
+        except OSError as e:
+            log.warning("Could not scan the size of {}: {}".format(path, e))
+            return None
+
+    def _all_project_paths(self):
+        runfolder_projects = (project
+                              for runfolder in self.runfolder_repo.get_runfolders()
+                              for project in runfolder.projects or [])
+        general_projects = self.general_project_repo.get_projects()
+        return [project.path for project in itertools.chain(runfolder_projects, general_projects)]
+
+    def scan(self):
+        """
+        Scan all projects which have not been scanned since they were last modified. This blocks, so don't call it
+        from the IOLoop.
+        :return: the number of projects which were scanned
+        """
+        stored_sizes = self.directory_size_repo.get_directory_sizes()
+
+        def needs_scan(path):
+            stored = stored_sizes.get(path)
+            try:
+                return not stored or stored.mtime != self._mtime_of(path)
+            except OSError:
+                return False
+
+        with ThreadPoolExecutor(max_workers=self.scan_workers) as scan_executor:
+            paths = self._all_project_paths()
+            paths_to_scan = [path for path, stale in zip(paths, scan_executor.map(needs_scan, paths)) if stale]
+            results = [result for result in scan_executor.map(self._scan, paths_to_scan) if result]
+
+        if results:
+            self.directory_size_repo.store_directory_sizes(results)
+            log.info("Scanned the size of {} projects".format(len(results)))
+
+        return len(results)
+
+    @gen.coroutine
+    def scan_in_background(self):
+        """
+        Scan projects on a background thread. If a scan is already in progress this does nothing.
+        :return: None
+        """
+        if self._scan_in_progress:
+            log.debug("Project size scan already in progress, skipping this one")
+            return
+
+        self._scan_in_progress = True
+        try:
+            yield self._executor.submit(self.scan)
+        except Exception as e:
+            log.error("Failed to scan project sizes: {}".format(e))
+        finally:
+            self._scan_in_progress = False
+
+    def start(self, interval):
+        """
+        Scan projects right away, and then every `interval` seconds
+        :param interval: number of seconds between scans
+        :return: None
+        """
+        IOLoop.current().spawn_callback(self.scan_in_background)
+        self._periodic_callback = PeriodicCallback(self.scan_in_background, interval * 1000)
+        self._periodic_callback.start()
+
+    def _up_to_date_size(self, stored, path):
+        try:
+            if stored and stored.mtime == self._mtime_of(path):
+                return stored.size, stored.file_count
+        except OSError:
+            pass
+        return None
+
+    def get_size(self, path):
+        """
+        Get the size of a scanned directory, if it is still up to date. This checks the modification time of the
+        directory, so don't call it from the IOLoop.
+        :param path: of the directory
+        :return: a tuple of the size in bytes and the number of files, or None if the directory has not been scanned
+                 since it was last modified
+        """
+        return self._up_to_date_size(self.directory_size_repo.get_directory_size(path), path)
+
+    def projects_with_sizes(self, projects):
+        """
+        Get copies of projects with their `size` and `file_count` filled in from their latest scans, if those are
+        still up to date. The projects themselves are left as they are, since they might be shared, e.g. by a
+        runfolder index. This checks the modification times of the projects, so don't call it from the IOLoop.
+        :param projects: to fill in sizes for
+        :return: a list of the copies, in the same order as the projects
+        """
+        projects = list(projects)
+        stored_sizes = self.directory_size_repo.get_directory_sizes([project.path for project in projects])
+
+        projects_with_sizes = []
+        for project in projects:
+            project = copy.copy(project)
+            size_and_file_count = self._up_to_date_size(stored_sizes.get(project.path), project.path)
+            if size_and_file_count:
+                project.size, project.file_count = size_and_file_count
+            projects_with_sizes.append(project)
+        return projects_with_sizes
+
+    @gen.coroutine
+    def projects_with_sizes_async(self, projects):
+        """
+        Same as `projects_with_sizes`, but without blocking the IOLoop
+        :raises FileSystemTimeoutException: if the file system did not respond in time
+        """
+        projects = list(projects)
+        if not projects:
+            return []
+        projects_with_sizes = yield self.file_system_executor.run(self.projects_with_sizes, projects)
+        return projects_with_sizes
@@ -0,0 +1,88 @@
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+log = logging.getLogger(__name__)
+
+
+class RunfolderCatalogSyncService(object):
+    """
+    Keeps a `DatabaseBasedRunfolderCatalogRepository` in sync with the runfolders on the file system. Only runfolders
+    which have been added or removed, or whose Projects directory has a new modification time, are looked up on
+    the file system and written to the catalog.
+    """
+
+    def __init__(self, runfolder_repo, catalog_repo):
+        """
+        Instantiate a new RunfolderCatalogSyncService
+        :param runfolder_repo: a `FileSystemBasedRunfolderRepository` to read the runfolders from
+        :param catalog_repo: a `DatabaseBasedRunfolderCatalogRepository` to write the runfolders to
+        """
+        self.runfolder_repo = runfolder_repo
+        self.catalog_repo = catalog_repo
+
+        # Syncing touches both the file system and the database, and can take a long time on a large
+        # runfolder directory, so it gets a thread of its own.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._sync_in_progress = False
+        self._periodic_callback = None
+
+    def sync(self):
+        """
+        Synchronize the catalog with the file system. This blocks, so don't call it from the IOLoop.
+        :return: a tuple of the number of runfolders which were added or updated, and the number which were removed
+        """
+        catalogued = self.catalog_repo.get_projects_modification_times()
+        on_file_system = self.runfolder_repo.get_runfolder_names()
+
+        changed_runfolders = []
+        for name in on_file_system:
+            # The modification time is read before the projects are listed, so that any change made
+            # while listing them will be picked up by the next sync.
+            projects_mtime = self.runfolder_repo.get_projects_modification_time(name)
+            if name in catalogued and catalogued[name] == projects_mtime:
+                continue
+
+            runfolder = self.runfolder_repo.get_runfolder(name)
+            if runfolder:
+                changed_runfolders.append((runfolder, projects_mtime))
+
+        removed_runfolders = set(catalogued) - set(on_file_system)
+
+        if changed_runfolders or removed_runfolders:
+            self.catalog_repo.update_catalog(changed_runfolders, removed_runfolders)
+            log.info("Synced runfolder catalog, {} runfolders added or updated and {} removed".
+                     format(len(changed_runfolders), len(removed_runfolders)))
+
+        return len(changed_runfolders), len(removed_runfolders)
+
+    @gen.coroutine
+    def sync_in_background(self):
+        """
+        Synchronize the catalog on a background thread. If a sync is already in progress this does nothing.
+        :return: None
+        """
+        if self._sync_in_progress:
+            log.debug("Runfolder catalog sync already in progress, skipping this one")
+            return
+
+        self._sync_in_progress = True
+        try:
+            yield self._executor.submit(self.sync)
+        except Exception as e:
+            log.error("Failed to sync runfolder catalog: {}".format(e))
+        finally:
+            self._sync_in_progress = False
+
+    def start(self, interval):
+        """
+        Sync the catalog right away, and then every `interval` seconds
+        :param interval: number of seconds between syncs
+        :return: None
+        """
+        IOLoop.current().spawn_callback(self.sync_in_background)
+        self._periodic_callback = PeriodicCallback(self.sync_in_background, interval * 1000)
+        self._periodic_callback.start()
@@ -0,0 +1,151 @@
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from delivery.models.db_models import StagingMode
+from delivery.services.file_system_service import FileSystemService
+
+log = logging.getLogger(__name__)
+
+
+class StagingEvictionService(object):
+    """
+    Removes staged files from the staging directory to free up space. When the free space in the staging directory
+    drops below `free_space_watermark`, the stagings which are done (successful or failed) are evicted, least
+    recently used first, until there is at least `free_space_target` bytes free. Stagings made by linking the source
+    files are not evicted to free up space, since their data is shared with the source. If `max_age` is set,
+    stagings which have not been used for that long are evicted regardless of the free space. A staging is used
+    when it is staged, when its files are reused by another staging, and when it is delivered.
+
+    Stagings which are being delivered by a delivery order which is pending or in progress are never evicted. An
+    evicted staging order gets the status `evicted`, and the time of the eviction is stored on it, before its
+    staged files are removed. Evicting runs on a background thread, so it never blocks the IOLoop.
+    """
+
+    def __init__(self, staging_repo, session_factory, staging_dir, free_space_watermark=None, free_space_target=None,
+                 max_age=None, file_system_service=FileSystemService()):
+        """
+        Instantiate a new StagingEvictionService
+        :param staging_repo: a `DatabaseBasedStagingRepository`
+        :param session_factory: a factory method which can produce new sqlalchemy Session instances
+        :param staging_dir: the directory which stagings are staged to
+        :param free_space_watermark: number of free bytes in the staging directory below which stagings are evicted,
+                                     defaults to None, which means that stagings are not evicted to free up space
+        :param free_space_target: number of free bytes to evict stagings until there are, defaults to None, which
+                                  means the same as `free_space_watermark`
+        :param max_age: number of seconds after which an unused staging is evicted, defaults to None, which means
+                        that stagings are only evicted to free up space
+        :param file_system_service: a service which can access the file system
+        """
+        self.staging_repo = staging_repo
+        self.session_factory = session_factory
+        self.staging_dir = staging_dir
+        self.free_space_watermark = free_space_watermark
+        self.free_space_target = free_space_target if free_space_target is not None else free_space_watermark
+        self.max_age = max_age
+        self.file_system_service = file_system_service
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._eviction_in_progress = False
+        self._periodic_callback = None
+
+    def _is_short_of_space(self, target):
+        if target is None:
+            return False
+        return self.file_system_service.free_space(self.staging_dir) < target
+
+    def _is_too_old(self, staging_order, now):
+        # Orders staged before their use was tracked have no age, they are only evicted to free up space
+        if self.max_age is None or staging_order.last_used_at is None:
+            return False
+        return staging_order.last_used_at < now - self.max_age
+
+    def _remove_staged_files(self, staging_order):
+        # The staging target holds the staged files and the md5sum manifest of this order only
+        staging_target = staging_order.staging_target
+        if self.file_system_service.isdir(staging_target):
+            shutil.rmtree(staging_target)
+        elif self.file_system_service.isfile(staging_target):
+            os.remove(staging_target)
+
+    def evict(self):
+        """
+        Evict stagings which are too old, and stagings in least recently used order while the staging directory is
+        short of space. This blocks, so don't call it from the IOLoop.
+        :return: the evicted staging orders, as a list
+        """
+        session = self.session_factory()
+        now = time.time()
+        short_of_space = self._is_short_of_space(self.free_space_watermark)
+
+        evicted_orders = []
+        for staging_order in self.staging_repo.get_evictable_staging_orders(custom_session=session):
+            # Linked files share their data with the source, so removing them does not free up any space
+            frees_up_space = staging_order.staging_mode not in (StagingMode.hardlink, StagingMode.reflink)
+
+            still_short_of_space = short_of_space and self._is_short_of_space(self.free_space_target)
+
+            if still_short_of_space and frees_up_space:
+                log.debug("Evicting: {} since {} is short of space".format(staging_order, self.staging_dir))
+            elif self._is_too_old(staging_order, now):
+                log.debug("Evicting: {} since it was last used at: {}".format(staging_order,
+                                                                               staging_order.last_used_at))
+            elif still_short_of_space or staging_order.last_used_at is None:
+                # More recently used orders might still free up space, or be too old
+                continue
+            else:
+                # The orders are ordered by when they were last used, so none of the rest are too old either
+                break
+
+            evicted_order = self.staging_repo.mark_staging_order_evicted(staging_order.id, custom_session=session)
+            if not evicted_order:
+                log.debug("Not evicting: {} since it has started being delivered".format(staging_order))
+                continue
+
+            try:
+                self._remove_staged_files(evicted_order)
+            except OSError as e:
+                log.error("Could not remove the staged files of evicted staging order: {}: {}".
+                          format(evicted_order, e))
+            log.info("Evicted: {} of {} bytes from: {}".format(evicted_order, evicted_order.size,
+                                                               evicted_order.staging_target))
+            evicted_orders.append(evicted_order)
+
+        if short_of_space and self._is_short_of_space(self.free_space_target):
+            log.warning("Could not free up {} bytes in {} by evicting stagings".
+                        format(self.free_space_target, self.staging_dir))
+
+        return evicted_orders
+
+    @gen.coroutine
+    def evict_in_background(self):
+        """
+        Evict stagings on a background thread. If an eviction is already in progress this does nothing.
+        :return: None
+        """
+        if self._eviction_in_progress:
+            log.debug("Eviction of stagings already in progress, skipping this one")
+            return
+
+        self._eviction_in_progress = True
+        try:
+            yield self._executor.submit(self.evict)
+        except Exception as e:
+            log.error("Failed to evict stagings: {}".format(e))
+        finally:
+            self._eviction_in_progress = False
+
+    def start(self, interval):
+        """
+        Evict stagings right away, and then every `interval` seconds
+        :param interval: number of seconds between evictions
+        :return: None
+        """
+        IOLoop.current().spawn_callback(self.evict_in_background)
+        self._periodic_callback = PeriodicCallback(self.evict_in_background, interval * 1000)
+        self._periodic_callback.start()
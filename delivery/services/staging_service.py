@@ -1,37 +1,124 @@
 
 import logging
 import os
-import signal
-import re
+import shutil
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from tornado import gen
+from tornado.ioloop import IOLoop
 
-from delivery.models.db_models import StagingStatus
+from delivery.models.db_models import StagingStatus, StagingMode
+from delivery.models.staging_progress import StagingProgress
+from delivery.services.file_system_service import FileSystemService
+from delivery.services.transfer_engines import RsyncTransferEngine
 from delivery.exceptions import RunfolderNotFoundException, InvalidStatusException,\
-    ProjectNotFoundException, TooManyProjectsFound
+    ProjectNotFoundException
 
 log = logging.getLogger(__name__)
 
+# The staging directory, the set of devices read from and written to, the device and number of bytes of the
+# space reserved in the staging directory, and the priority it was started with, of a staging in progress
+_StagingSlot = namedtuple('_StagingSlot', ['target_dir', 'devices', 'target_device', 'reserved_size', 'priority'])
+
+
+def _is_staging_process_alive(pid):
+    """
+    Check if a process staging an order is still running. That is either an rsync process, or, for orders copied by
+    the native transfer engine, which copies in the service itself, another instance of this service.
+    :param pid: a process id stored on the staging order, or None
+    :return: True if the process is running, otherwise False
+    """
+    # An order copied by this very process would still be in progress here, so this is a reused pid
+    if not pid or pid == os.getpid():
+        return False
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, but as another user
+        pass
+
+    # After a reboot the pid might have been given to another process
+    cmdline_path = '/proc/{}/cmdline'.format(pid)
+    try:
+        with open(cmdline_path, 'rb') as cmdline:
+            cmdline = cmdline.read()
+        with open('/proc/self/cmdline', 'rb') as own_cmdline:
+            own_cmdline = own_cmdline.read()
+    except OSError:
+        # No /proc, or the process could not be looked into, so it can not be ruled out
+        return True
+
+    # The cmdline is empty for a process which is just being started, and for a zombie. Since the staging would be
+    # removed if the process was taken for dead, it is taken for alive until it is known to be something else.
+    if not cmdline:
+        return True
+    return b'rsync' in cmdline or cmdline == own_cmdline
+
 
 class StagingService(object):
     """
     Starting in this context means copying a directory or file to a separate directory before delivering it.
-    This service handles that in a asynchronous way. Copying operations (right nwo powered by rsync) can be
-    started, and their status monitored by querying the underlying database for their status.
-    """
+    This service handles that in a asynchronous way. Copying operations (carried out by a `TransferEngine`, rsync
+    unless another engine is given) can be started, and their status monitored by querying the underlying database
+    for their status.
+
+    Staging orders are queued in the database with the status `pending`, and are started in order of priority, and
+    in the order they were created within the same priority, as soon as there is a free slot, i.e. when fewer than
+    `max_concurrent_stagings` stagings are in progress in total and fewer than `max_concurrent_stagings_per_target`
+    to the same staging directory. If `max_concurrent_stagings_per_device` is set, stagings are also limited by the
+    devices they read from and write to, and orders are started in turns from different source devices rather than
+    strictly in the order they were created, so that stagings are spread out over all devices.
+
+    If `zero_copy_staging_modes` are given, and the source is on the same file system as the staging directory, the
+    staged files are created as hardlinks or clones of the original files instead of being copied, which is almost
+    instant and does not use any extra space. If the file system does not support any of the modes, the source is
+    copied instead.
+
+    With the default rsync engine, a directory can be copied by several rsync processes at once, each copying its
+    share of the files, by setting `rsync_workers_per_staging`. If any of them fails, the others are stopped and the
+    staging fails as a whole.
+
+    The progress of the stagings which are copied is followed as the transfer engine reports it, and is stored in
+    the database at most every `progress_update_interval` seconds.
+
+    If `reuse_prior_stagings` is set, a source which has not changed since it was last staged successfully is
+    staged by hardlinking the files of that earlier staging, provided that they are still there, instead of
+    staging it all over again. Whether the source has changed is decided from a fingerprint of the names, sizes and
+    modification times of its files.
+
+    If `md5sum_files` is set, a manifest of the md5 checksums of the staged files, in the format of `md5sum`, is
+    written next to the staged directory (as `<name>.md5`) before the staging is marked as successful, and is
+    used when the staged files are delivered. If the transfer engine computed the checksums while copying they are
+    used as they are, otherwise the staged files are hashed in parallel on a pool of `checksum_workers` processes.
+    A staging which reuses an earlier staging reuses its manifest too.
+
+    If `verify_stagings` is set, the files of a staging which was copied are checked against the source before it
+    is marked as successful, while its status is `staging_verifying`. The source and staged files are hashed in
+    parallel on the same process pool, and a source file which has an md5 sidecar (`<file>.md5`) is not read again.
+    If any file does not match, the staging fails, and the mismatching files are recorded in the database. The
+    checksums of the staged files are then used for the md5sum manifest, so that the files are only read once.
 
-    # TODO On initiation of a Staging service, restart any ongoing stagings
-    # since they should all have been killed.
-    # And if we do so we need to make sure that the Staging service
-    # acts as a singleton, look at:
-    # http://python-3-patterns-idioms-test.readthedocs.io/en/latest/Singleton.html
-    #
-    # Alternative suggestion from Steinar on how to solve the problem, which is probably better:
-    # "Do you mean to ensure that only one thread tries doing that at a time? An idea could
-    #  be to take a database lock to ensure this, i.e. fetch all objects in the unfinished
-    #  state, restart them, change the status and then commit, locking the sqlite database
-    #  briefly while doing so (I think row level locking is limited in sqlite.)"
-    #  / JD 20161111
+    If `min_free_space` is set, an order is only started once there is room for it in the staging directory, i.e.
+    if the free space on its file system, less the space reserved by the stagings in progress and `min_free_space`,
+    is at least the size of the source. Until then it stays queued, while the orders after it may be started. The
+    size of a source is found by walking it in the background, and each staging in progress reserves the part of
+    its size which it has not copied yet.
+
+    If `priority_aging_interval` is set, the priority of a pending order is raised by one for each such interval
+    it has waited in the queue, so that orders of a low priority are not starved by a steady stream of orders of a
+    higher priority. If `preempt_lower_priority_stagings` is set, and an order can not be started because all
+    slots it could use are taken, a copy which was started with a lower priority than that of the order is
+    stopped and put back in the queue, to make room for it. Only copies are paused like this, and aging does not
+    cause other stagings to be paused, only a higher priority given when the order was queued does.
+
+    Stagings which were interrupted when the service was stopped are put back in the queue by
+    `recover_interrupted_staging_orders`, and copying them continues where it stopped.
+    """
 
     def __init__(self,
                  staging_dir,
@@ -39,7 +126,23 @@ class StagingService(object):
                  staging_repo,
                  runfolder_repo,
                  project_dir_repo,
-                 session_factory):
+                 session_factory,
+                 max_concurrent_stagings=None,
+                 max_concurrent_stagings_per_target=None,
+                 max_concurrent_stagings_per_device=None,
+                 zero_copy_staging_modes=None,
+                 rsync_workers_per_staging=1,
+                 progress_update_interval=10,
+                 reuse_prior_stagings=False,
+                 md5sum_files=False,
+                 checksum_workers=None,
+                 checksum_files_in_flight=None,
+                 verify_stagings=False,
+                 min_free_space=None,
+                 priority_aging_interval=None,
+                 preempt_lower_priority_stagings=False,
+                 transfer_engine=None,
+                 file_system_service=FileSystemService()):
         """
         Instantiate a new StagingService
         :param staging_dir: the directory to which files/dirs should be staged
@@ -48,6 +151,40 @@ class StagingService(object):
         :param runfolder_repo: a instance of FileSystemBasedRunfolderRepository
         :param project_dir_repo: a instance of GeneralProjectRepository
         :param session_factory: a factory method which can produce new sqlalchemy Session instances
+        :param max_concurrent_stagings: the maximum number of stagings to run at the same time, defaults to None
+                                        which means no limit
+        :param max_concurrent_stagings_per_target: the maximum number of stagings to run at the same time into the
+                                                   same staging directory, defaults to None which means no limit
+        :param max_concurrent_stagings_per_device: the maximum number of stagings to run at the same time which read
+                                                   from or write to the same device, defaults to None which means no
+                                                   limit
+        :param zero_copy_staging_modes: list of `StagingMode`s (hardlink and/or reflink) to try, in order, before
+                                        falling back to copying the source. Defaults to None, which means that
+                                        the source is always copied.
+        :param rsync_workers_per_staging: number of rsync processes to copy a directory with, if `transfer_engine`
+                                          is not given. Defaults to 1
+        :param progress_update_interval: minimum number of seconds between storing the progress of a staging in the
+                                         database, defaults to 10
+        :param reuse_prior_stagings: if True, link the files of an earlier staging of the same source instead of
+                                     staging it again, if the source has not changed since. Defaults to False.
+        :param md5sum_files: if True, write a manifest of the md5 checksums of the staged files for each staging
+                             order. Defaults to False.
+        :param checksum_workers: number of processes to hash the staged files with, if the transfer engine did not
+                                 compute their checksums while copying. Defaults to None, which means one per CPU.
+        :param checksum_files_in_flight: maximum number of files to hash, or queue for hashing, at a time. Defaults
+                                         to None, which means twice the number of `checksum_workers`.
+        :param verify_stagings: if True, check that the copied files match the source before a staging is marked as
+                                successful. Defaults to False.
+        :param min_free_space: number of bytes to keep free in the staging directory. If set, orders are not
+                               started until there is room for them. Defaults to None, which means that the free
+                               space is not checked.
+        :param priority_aging_interval: number of seconds after which the priority of a pending order is raised by
+                                        one, defaults to None, which means that priorities are never raised
+        :param preempt_lower_priority_stagings: if True, pause copies of a lower priority to make room for pending
+                                                orders of a higher priority. Defaults to False.
+        :param transfer_engine: the `TransferEngine` to copy the sources with. Defaults to None, which means that
+                                they are copied with rsync.
+        :param file_system_service: a service which can access the file system
         """
         self.staging_dir = staging_dir
         self.external_program_service = external_program_service
@@ -55,55 +192,284 @@ class StagingService(object):
         self.runfolder_repo = runfolder_repo
         self.project_dir_repo = project_dir_repo
         self.session_factory = session_factory
+        self.max_concurrent_stagings = max_concurrent_stagings
+        self.max_concurrent_stagings_per_target = max_concurrent_stagings_per_target
+        self.max_concurrent_stagings_per_device = max_concurrent_stagings_per_device
+        self.zero_copy_staging_modes = zero_copy_staging_modes or []
+        self.progress_update_interval = progress_update_interval
+        self.reuse_prior_stagings = reuse_prior_stagings
+        self.md5sum_files = md5sum_files
+        self.verify_stagings = verify_stagings
+        self.checksum_files_in_flight = checksum_files_in_flight or 2 * (checksum_workers or os.cpu_count() or 1)
+        self.min_free_space = min_free_space
+        self.priority_aging_interval = priority_aging_interval
+        self.preempt_lower_priority_stagings = preempt_lower_priority_stagings
+        self.file_system_service = file_system_service
+        self.transfer_engine = transfer_engine or RsyncTransferEngine(external_program_service,
+                                                                      workers=rsync_workers_per_staging,
+                                                                      file_system_service=file_system_service)
+
+        # Linking and listing files blocks, so it is done on threads of its own
+        self._staging_executor = ThreadPoolExecutor(max_workers=max_concurrent_stagings or 4)
+        # Hashing is CPU bound, so it is done in processes of its own
+        self._checksum_executor = ProcessPoolExecutor(max_workers=checksum_workers) \
+            if md5sum_files or verify_stagings else None
+        # Staging order id -> the latest StagingProgress, of the stagings which are being copied
+        self._progress_of_stagings = {}
+        # Staging order id -> time the progress was last stored in the database
+        self._progress_stored_at = {}
+        # Ids of the stagings being copied whose transfers have started, and which can thus be cancelled
+        self._started_stagings = set()
+
+        # Staging order id -> _StagingSlot, of the stagings started by this service which are still running
+        self._stagings_in_progress = {}
+        # Staging order id -> (source device, target device), of pending orders, so that their devices are
+        # only looked up once
+        self._devices_of_pending_orders = {}
+        # Staging order id -> the size of the source in bytes, or None if it could not be found, of pending orders
+        self._sizes_of_pending_orders = {}
+        # Ids of the pending orders whose source sizes are being looked up
+        self._sizing_pending_orders = set()
+        # Staging order id -> id of the pending order it is being paused for, of the stagings being paused
+        self._preempted_stagings = {}
+        self._dispatching = False
+        self._dispatch_requested = False
+
+    def _follow_progress(self, staging_order, session):
+        """
+        Create a callback which follows the progress of the transfer of a staging order
+        :param staging_order: being copied
+        :param session: which the staging order belongs to
+        :return: a function to pass as `progress_callback` to `TransferEngine.transfer`
+        """
+        self._progress_of_stagings[staging_order.id] = StagingProgress()
+
+        def on_progress(progress):
+            self._progress_of_stagings[staging_order.id] = progress
+
+            now = time.monotonic()
+            if now - self._progress_stored_at.get(staging_order.id, 0) >= self.progress_update_interval:
+                staging_order.bytes_transferred = progress.bytes_transferred
+                staging_order.files_transferred = progress.files_transferred
+                session.commit()
+                self._progress_stored_at[staging_order.id] = now
+
+        return on_progress
+
+    def _stop_following_progress(self, staging_order_id):
+        self._progress_of_stagings.pop(staging_order_id, None)
+        self._progress_stored_at.pop(staging_order_id, None)
+        self._started_stagings.discard(staging_order_id)
 
     @staticmethod
+    def _md5sum_file_path(staging_order):
+        return staging_order.get_staging_path() + '.md5'
+
+    def _list_files(self, path):
+        # The files are listed relative to the parent of path, i.e. in the same way as relative to a staging target
+        name = os.path.basename(path)
+        if not self.file_system_service.isdir(path):
+            return [name]
+        return [os.path.join(name, relative_path)
+                for relative_path, entry in self.file_system_service.walk_tree(path)
+                if not entry.is_dir()]
+
     @gen.coroutine
-    def _copy_dir(staging_order_id, external_program_service, session_factory, staging_repo):
+    def _hash_files(self, paths, unreadable_as_none=False):
         """
-        Copies the file or directory indicated by the staging order by calling the external_program_service.
-        It will attempt the copying and update the database with the status of the StagingOrder depending on the
-        outcome.
+        Compute the md5 checksums of files in parallel on the checksum processes, with at most
+        `checksum_files_in_flight` files being hashed or waiting to be hashed at a time
+        :param paths: a dict of keys to the paths of the files to hash
+        :param unreadable_as_none: if True, give the checksum of a file which could not be read as None instead of
+                                   raising an error
+        :return: a dict of the same keys to the md5 checksums of the files
+        :raises OSError: if a file could not be read, unless `unreadable_as_none` is set
+        """
+        checksums = {}
+        keys = iter(paths)
+
+        # Each hasher takes the next file as soon as it is done with the previous one. Since they all run on the
+        # IOLoop they can safely share the iterator.
+        @gen.coroutine
+        def hasher():
+            for key in keys:
+                try:
+                    checksums[key] = yield self._checksum_executor.submit(self.file_system_service.md5sum,
+                                                                          paths[key])
+                except OSError as e:
+                    if not unreadable_as_none:
+                        raise
+                    log.debug("Could not hash {}: {}".format(paths[key], e))
+                    checksums[key] = None
+
+        yield [hasher() for _ in range(min(self.checksum_files_in_flight, len(paths)))]
+        return checksums
+
+    @staticmethod
+    def _write_md5sum_manifest(checksums, staging_path, md5sum_file):
+        # The paths are given relative to the staged directory, or as the file name for a staged file
+        prefix = os.path.basename(staging_path) + os.sep
+        tmp_md5sum_file = md5sum_file + '.tmp'
+        with open(tmp_md5sum_file, 'w', encoding='UTF-8', errors='surrogateescape') as manifest:
+            for path in sorted(checksums):
+                relative_path = path[len(prefix):] if path.startswith(prefix) else path
+                manifest.write('{}  {}\n'.format(checksums[path], relative_path))
+        os.replace(tmp_md5sum_file, md5sum_file)
+
+    @gen.coroutine
+    def _create_md5sum_file(self, staging_order, checksums=None, prior_md5sum_file=None):
+        """
+        Write the md5sum manifest of a staging order, unless `md5sum_files` is off
+        :param staging_order: which has been staged
+        :param checksums: a dict of the staged files, relative to the staging target, to their md5 checksums, if
+                          they were computed while staging. Otherwise the staged files are hashed.
+        :param prior_md5sum_file: the manifest of an earlier staging of the same files, to copy, if there is one
+        :return: the path to the manifest, or None if no manifest was written
+        :raises OSError: if the manifest could not be written
+        """
+        if not self.md5sum_files:
+            return None
+
+        staging_path = staging_order.get_staging_path()
+        md5sum_file = self._md5sum_file_path(staging_order)
+
+        if prior_md5sum_file and self.file_system_service.isfile(prior_md5sum_file):
+            yield self._staging_executor.submit(shutil.copyfile, prior_md5sum_file, md5sum_file)
+            return md5sum_file
+
+        if checksums is None:
+            staged_files = yield self._staging_executor.submit(self._list_files, staging_path)
+            checksums = yield self._hash_files({staged_file: os.path.join(staging_order.staging_target, staged_file)
+                                                for staged_file in staged_files})
+
+        yield self._staging_executor.submit(self._write_md5sum_manifest, checksums, staging_path, md5sum_file)
+        log.debug("Wrote md5sums of {} files staged by: {} to: {}".format(len(checksums), staging_order, md5sum_file))
+        return md5sum_file
+
+    @staticmethod
+    def _read_md5sum_sidecar(path):
+        # A sidecar holds the checksum of a single file, in the format of `md5sum` or as just the checksum
+        try:
+            with open(path) as sidecar:
+                checksum = sidecar.read(1024).split(maxsplit=1)[0].lower()
+        except (OSError, UnicodeDecodeError, IndexError):
+            return None
+        if len(checksum) == 32 and all(c in '0123456789abcdef' for c in checksum):
+            return checksum
+        return None
+
+    def _list_source_files_and_sidecar_checksums(self, source):
+        source_files = self._list_files(source)
+        source_parent = os.path.dirname(os.path.abspath(source))
+        sidecar_checksums = {}
+        listed_files = set(source_files)
+        for source_file in source_files:
+            sidecar = source_file + '.md5'
+            if sidecar in listed_files:
+                checksum = self._read_md5sum_sidecar(os.path.join(source_parent, sidecar))
+                if checksum:
+                    sidecar_checksums[source_file] = checksum
+        return source_files, sidecar_checksums
+
+    @gen.coroutine
+    def _verify_staging(self, staging_order, source_checksums=None):
+        """
+        Check that the staged files of a staging order match the files of its source. The staged files are always
+        hashed, while the checksum of a source file is taken from `source_checksums`, or from an md5 sidecar next to
+        it in the source (i.e. `<file>.md5`), if there is one, and is otherwise computed from the source file.
+        :param staging_order: which has been copied
+        :param source_checksums: a dict of files, relative to the staging target, to the md5 checksums of their
+                                 source files, if they were computed while staging
+        :return: a tuple of a dict of the staged files, relative to the staging target, to their md5 checksums, and
+                 a list of (file, source checksum, staged checksum) tuples of the files which did not match
+        """
+        source_files, sidecar_checksums = yield self._staging_executor.submit(
+            self._list_source_files_and_sidecar_checksums, staging_order.source)
+        source_checksums = dict(source_checksums or {})
+        for source_file, checksum in sidecar_checksums.items():
+            source_checksums.setdefault(source_file, checksum)
+
+        source_parent = os.path.dirname(os.path.abspath(staging_order.source))
+        paths = {}
+        for source_file in source_files:
+            paths[('staged', source_file)] = os.path.join(staging_order.staging_target, source_file)
+            if source_file not in source_checksums:
+                paths[('source', source_file)] = os.path.join(source_parent, source_file)
+
+        log.info("Verifying {} files staged by: {}, {} of which have known source checksums".
+                 format(len(source_files), staging_order, 2 * len(source_files) - len(paths)))
+        hashed = yield self._hash_files(paths, unreadable_as_none=True)
+
+        staged_checksums = {}
+        mismatches = []
+        for source_file in source_files:
+            source_checksum = source_checksums.get(source_file, hashed.get(('source', source_file)))
+            staged_checksum = hashed[('staged', source_file)]
+            staged_checksums[source_file] = staged_checksum
+            if source_checksum is None or source_checksum != staged_checksum:
+                mismatches.append((source_file, source_checksum, staged_checksum))
+
+        return staged_checksums, mismatches
+
+    @gen.coroutine
+    def _copy_dir(self, staging_order_id):
+        """
+        Copies the file or directory indicated by the staging order with the transfer engine, and update the database
+        with the status of the StagingOrder depending on the outcome.
         :param staging_order_id: The id of the staging order to execute
-        :param external_program_service: A instance of ExternalProgramService
-        :param session_factory: A factory method which can produce a new sql alchemy Session instance
-        :param staging_repo: A instance of DatabaseBasedStagingRepository
         :return: None, only reports back through side-effects
         """
 
-        session = session_factory()
+        session = self.session_factory()
 
         # This is a somewhat hacky work-around to the problem that objects created in one
         # thread, and thus associated with another session cannot be accessed by another
         # thread, there fore it is re-materialized in here...
-        staging_order = staging_repo.get_staging_order_by_id(staging_order_id, session)
+        staging_order = self.staging_repo.get_staging_order_by_id(staging_order_id, session)
         try:
+            def on_started(pids):
+                staging_order.set_pids(pids)
+                staging_order.staging_mode = StagingMode.copy
+                session.commit()
+                self._started_stagings.add(staging_order_id)
 
-            cmd = ['rsync', '--stats', '-r', '--copy-links', staging_order.source, staging_order.staging_target]
+            transfer_result = yield self.transfer_engine.transfer(staging_order,
+                                                                  progress_callback=self._follow_progress(
+                                                                      staging_order, session),
+                                                                  started_callback=on_started)
+            if not transfer_result.successful:
+                if self._preempted_stagings.pop(staging_order_id, None) is not None:
+                    staging_order.status = StagingStatus.pending
+                    staging_order.set_pids(None)
+                    log.info("Requeued: {} since it was paused for a staging of higher priority".format(staging_order))
+                    return
 
-            execution = external_program_service.run(cmd)
+                staging_order.status = StagingStatus.staging_failed
+                log.info("Failed in staging: {} because: {}".format(staging_order, transfer_result.message))
+                return
 
-            staging_order.pid = execution.pid
-            session.commit()
+            staging_order.size = transfer_result.size
+            staging_order.bytes_transferred = staging_order.size
+            checksums = transfer_result.checksums
 
-            execution_result = yield external_program_service.wait_for_execution(execution)
-            log.debug("Execution result: {}".format(execution_result))
-            if execution_result.status_code == 0:
-
-                # Parse the file size from the output of rsync stats:
-                # Total file size: 207,707,566 bytes
-                match = re.search('Total file size: ([\d,]+) bytes',
-                                  execution_result.stdout,
-                                  re.MULTILINE)
-                size_of_transfer = match.group(1)
-                size_of_transfer = int(size_of_transfer.replace(",", ""))
-                staging_order.size = size_of_transfer
-
-                staging_order.status = StagingStatus.staging_successful
-                log.info("Successfully staged: {} to: {}".format(staging_order, staging_order.get_staging_path()))
-            else:
-                staging_order.status = StagingStatus.staging_failed
-                log.info("Failed in staging: {} because rsync returned exit code: {}".
-                         format(staging_order, execution_result.status_code))
+            if self.verify_stagings:
+                staging_order.status = StagingStatus.staging_verifying
+                session.commit()
+                self._stop_following_progress(staging_order_id)
+
+                checksums, mismatches = yield self._verify_staging(staging_order, checksums)
+                if mismatches:
+                    self.staging_repo.add_verification_mismatches(staging_order.id, mismatches, session)
+                    staging_order.status = StagingStatus.staging_failed
+                    log.warning("Failed in staging: {} because {} staged files did not match the source, e.g: {}".
+                                format(staging_order, len(mismatches), mismatches[0][0]))
+                    return
+
+            staging_order.md5sum_file = yield self._create_md5sum_file(staging_order, checksums)
+
+            staging_order.status = StagingStatus.staging_successful
+            staging_order.last_used_at = time.time()
+            log.info("Successfully staged: {} to: {}".format(staging_order, staging_order.get_staging_path()))
 
         # TODO Better exception handling here...
         except Exception as e:
@@ -111,57 +477,578 @@ class StagingService(object):
             log.info("Failed in staging: {} because this exception was logged: {}".
                      format(staging_order, e))
         finally:
+            self._stop_following_progress(staging_order_id)
             # Always commit the state change to the database
             session.commit()
 
-    @gen.coroutine
-    def stage_order(self, stage_order):
+    @staticmethod
+    def _staging_target_dir(stage_order):
+        return os.path.dirname(stage_order.staging_target)
+
+    def _devices_of(self, stage_order):
+        if self.max_concurrent_stagings_per_device is None:
+            return ()
+
+        if stage_order.id not in self._devices_of_pending_orders:
+            try:
+                devices = (self.file_system_service.device_of(stage_order.source),
+                           self.file_system_service.device_of(self._staging_target_dir(stage_order)))
+            except OSError as e:
+                # Let the staging itself fail and report the problem instead
+                log.warning("Could not get the devices of staging order: {}: {}".format(stage_order, e))
+                devices = ()
+            self._devices_of_pending_orders[stage_order.id] = devices
+
+        return self._devices_of_pending_orders[stage_order.id]
+
+    def _size_of_source(self, source):
+        # A scanned size is not used here, since it might be out of date, see `ProjectSizeService`
+        size, _ = self.file_system_service.size_and_file_count(source)
+        return size
+
+    def _on_source_sized(self, stage_order_id, future):
+        self._sizing_pending_orders.discard(stage_order_id)
+        try:
+            self._sizes_of_pending_orders[stage_order_id] = future.result()
+        except OSError as e:
+            # Let the staging itself fail and report the problem instead
+            log.warning("Could not get the size of the source of staging order: {}: {}".format(stage_order_id, e))
+            self._sizes_of_pending_orders[stage_order_id] = None
+        self.dispatch_pending_staging_orders()
+
+    def _size_pending_orders(self, pending_orders):
         """
-        Validate a staging order and hand of the actual stating to a separate thread.
-        :param stage_order: to stage
+        Look up the sizes of the sources of pending orders in the background, the queue is dispatched again as each
+        size is found
+        :param pending_orders: to look up the sizes of, unless they are known or being looked up already
         :return: None
         """
+        pending_ids = set(stage_order.id for stage_order in pending_orders)
+        for stage_order_id in list(self._sizes_of_pending_orders):
+            if stage_order_id not in pending_ids:
+                del self._sizes_of_pending_orders[stage_order_id]
 
-        session = self.session_factory()
+        for stage_order in pending_orders:
+            if stage_order.id in self._sizes_of_pending_orders or stage_order.id in self._sizing_pending_orders:
+                continue
+            self._sizing_pending_orders.add(stage_order.id)
+            future = self._staging_executor.submit(self._size_of_source, stage_order.source)
+            IOLoop.current().add_future(future, lambda f, stage_order_id=stage_order.id:
+                                        self._on_source_sized(stage_order_id, f))
+
+    def _remaining_reserved_size(self, stage_order_id, staging_slot):
+        progress = self._progress_of_stagings.get(stage_order_id)
+        bytes_transferred = (progress.bytes_transferred or 0) if progress else 0
+        return max(staging_slot.reserved_size - bytes_transferred, 0)
+
+    def _reserve_space(self, stage_order):
+        """
+        Check if there is room for a pending order in its staging directory
+        :param stage_order: to check
+        :return: a tuple of whether the order fits, and the device and size of the space to reserve for it
+        """
+        if self.min_free_space is None:
+            return True, None, 0
+
+        if stage_order.id not in self._sizes_of_pending_orders:
+            return False, None, 0
 
+        size = self._sizes_of_pending_orders[stage_order.id]
+        if size is None:
+            return True, None, 0
+
+        target_dir = self._staging_target_dir(stage_order)
         try:
+            target_device = self.file_system_service.device_of(target_dir)
+            free_space = self.file_system_service.free_space(target_dir)
+        except OSError as e:
+            log.warning("Could not get the free space of: {}: {}".format(target_dir, e))
+            return True, None, 0
 
-            if stage_order.status != StagingStatus.pending:
-                raise InvalidStatusException("Cannot start staging a delivery order with status: {}".
-                                             format(stage_order.status))
+        reserved_space = sum(self._remaining_reserved_size(stage_order_id, staging_slot)
+                             for stage_order_id, staging_slot in self._stagings_in_progress.items()
+                             if staging_slot.target_device == target_device)
 
-            stage_order.status = StagingStatus.staging_in_progress
+        if free_space - reserved_space - self.min_free_space < size:
+            log.debug("Not starting: {} of {} bytes yet, since {} bytes are free in {} and {} bytes are reserved".
+                      format(stage_order, size, free_space, target_dir, reserved_space))
+            return False, None, 0
+
+        return True, target_device, size
+
+    def _has_free_slot(self, staging_slot, ignored_stage_order_id=None):
+        slots_in_use = [slot for stage_order_id, slot in self._stagings_in_progress.items()
+                        if stage_order_id != ignored_stage_order_id]
+
+        if self.max_concurrent_stagings is not None and len(slots_in_use) >= self.max_concurrent_stagings:
+            return False
+
+        if self.max_concurrent_stagings_per_target is not None:
+            nbr_in_target = sum(1 for slot in slots_in_use if slot.target_dir == staging_slot.target_dir)
+            if nbr_in_target >= self.max_concurrent_stagings_per_target:
+                return False
+
+        for device in staging_slot.devices:
+            nbr_on_device = sum(1 for slot in slots_in_use if device in slot.devices)
+            if nbr_on_device >= self.max_concurrent_stagings_per_device:
+                return False
+
+        return True
+
+    def _preempt_lower_priority_staging(self, stage_order, staging_slot):
+        """
+        Pause a copy of a lower priority than a pending order, if that makes room for the pending order. The copy is
+        stopped, and is put back in the queue once it has stopped, see `_copy_dir`.
+        :param stage_order: the pending order to make room for
+        :param staging_slot: the slot the pending order needs
+        :return: None
+        """
+        # Only pause one staging for each pending order at a time
+        if stage_order.id in self._preempted_stagings.values():
+            return
+
+        # Pause the staging of the lowest priority, and the newest order of those
+        candidates = [(slot.priority, -stage_order_id)
+                      for stage_order_id, slot in self._stagings_in_progress.items()
+                      if slot.priority < (stage_order.priority or 0) and
+                      stage_order_id in self._started_stagings and
+                      stage_order_id not in self._preempted_stagings and
+                      self._has_free_slot(staging_slot, ignored_stage_order_id=stage_order_id)]
+        if not candidates:
+            return
+
+        _, negated_stage_order_id = min(candidates)
+        preempted_order = self.staging_repo.get_staging_order_by_id(-negated_stage_order_id)
+        self._preempted_stagings[preempted_order.id] = stage_order.id
+        try:
+            self.transfer_engine.cancel(preempted_order)
+        except OSError as e:
+            del self._preempted_stagings[preempted_order.id]
+            log.error("Failed to pause: {} because: {}".format(preempted_order, e))
+            return
+
+        log.info("Pausing: {} of priority {} to make room for: {} of priority {}".
+                 format(preempted_order, self._stagings_in_progress[preempted_order.id].priority,
+                        stage_order, stage_order.priority))
+
+    def _effective_priority(self, stage_order, now):
+        priority = stage_order.priority or 0
+        if self.priority_aging_interval and stage_order.queued_at:
+            priority += int(max(now - stage_order.queued_at, 0) // self.priority_aging_interval)
+        return priority
+
+    def _prioritize(self, stage_orders):
+        """
+        Order pending orders by their priority, raised by the time they have waited if aging is enabled, and by
+        the order they were created in within the same priority
+        :param stage_orders: the pending orders
+        :return: a tuple of the ordered stage orders, as a list, and a dict of stage order id -> effective priority
+        """
+        now = time.time()
+        priorities = {stage_order.id: self._effective_priority(stage_order, now) for stage_order in stage_orders}
+        return sorted(stage_orders, key=lambda stage_order: (-priorities[stage_order.id], stage_order.id)), \
+            priorities
+
+    def _interleave_by_source_device(self, stage_orders, priorities):
+        # Within each priority, take one order from each source device in turn, e.g. orders on devices
+        # [a, a, a, b, b, c] are started in the order [a, b, c, a, b, a].
+        nbr_seen_on_device = {}
+        keys = {}
+        for queue_index, stage_order in enumerate(stage_orders):
+            devices = self._devices_of(stage_order)
+            source_device = devices[0] if devices else None
+            priority = priorities[stage_order.id]
+            rank = nbr_seen_on_device.get((priority, source_device), 0)
+            nbr_seen_on_device[(priority, source_device)] = rank + 1
+            keys[stage_order.id] = (-priority, rank, queue_index)
+        return sorted(stage_orders, key=lambda stage_order: keys[stage_order.id])
+
+    def _link_files(self, source, staging_target, staging_path):
+        if self.file_system_service.device_of(source) != self.file_system_service.device_of(
+                os.path.dirname(staging_target)):
+            log.debug("Not linking {} since it is on a different file system than {}".format(source, staging_target))
+            return None, None
+
+        link_functions = {StagingMode.hardlink: self.file_system_service.hardlink,
+                          StagingMode.reflink: self.file_system_service.reflink}
+
+        os.makedirs(staging_target, exist_ok=True)
+        for staging_mode in self.zero_copy_staging_modes:
+            try:
+                size = self.file_system_service.link_tree(source, staging_path, link_functions[staging_mode])
+                return staging_mode, size
+            except OSError as e:
+                log.info("Could not stage {} using {}: {}".format(source, staging_mode.name, e))
+
+        return None, None
+
+    @gen.coroutine
+    def _finish_linked_staging(self, staging_order, session, prior_md5sum_file=None):
+        try:
+            staging_order.md5sum_file = yield self._create_md5sum_file(staging_order,
+                                                                       prior_md5sum_file=prior_md5sum_file)
+            staging_order.status = StagingStatus.staging_successful
+            staging_order.last_used_at = time.time()
+        except Exception as e:
+            staging_order.status = StagingStatus.staging_failed
+            log.info("Failed in staging: {} because the md5sums could not be written: {}".format(staging_order, e))
+        finally:
             session.commit()
 
-            args_for_copy_dir = {"staging_order_id": stage_order.id,
-                                 "external_program_service": self.external_program_service,
-                                 "staging_repo": self.staging_repo,
-                                 "session_factory": self.session_factory}
+    @gen.coroutine
+    def _link_dir(self, staging_order_id):
+        """
+        Try to stage the staging order by linking its files, using the first of the zero copy staging modes which
+        works, and update the database with the outcome if it was successful.
+        :param staging_order_id: The id of the staging order to execute
+        :return: True if the staging order was staged, otherwise False
+        """
+        if not self.zero_copy_staging_modes:
+            return False
+
+        session = self.session_factory()
+        staging_order = self.staging_repo.get_staging_order_by_id(staging_order_id, session)
+
+        try:
+            staging_mode, size = yield self._staging_executor.submit(self._link_files,
+                                                                     staging_order.source,
+                                                                     staging_order.staging_target,
+                                                                     staging_order.get_staging_path())
+        except OSError as e:
+            log.info("Could not stage {} without copying: {}".format(staging_order, e))
+            return False
+
+        if not staging_mode:
+            return False
+
+        staging_order.staging_mode = staging_mode
+        staging_order.size = size
+        yield self._finish_linked_staging(staging_order, session)
+        if staging_order.status != StagingStatus.staging_successful:
+            return True
+        log.info("Successfully staged: {} to: {} using {}".format(staging_order,
+                                                                  staging_order.get_staging_path(),
+                                                                  staging_mode.name))
+        return True
+
+    def _fingerprint(self, path):
+        try:
+            return self.file_system_service.fingerprint(path)
+        except OSError as e:
+            log.info("Could not fingerprint {}: {}".format(path, e))
+            return None
+
+    def _link_prior_staging(self, prior_staging_path, prior_size, staging_target, staging_path):
+        if not (self.file_system_service.isdir(prior_staging_path) or
+                self.file_system_service.isfile(prior_staging_path)):
+            return None
+
+        os.makedirs(staging_target, exist_ok=True)
+        size = self.file_system_service.link_tree(prior_staging_path, staging_path, self.file_system_service.hardlink)
+        # Files might have been removed from the earlier staging since it was made
+        if size != prior_size:
+            log.info("Not reusing {} since its size has changed from {} to {} bytes".
+                     format(prior_staging_path, prior_size, size))
+            if os.path.isdir(staging_path):
+                shutil.rmtree(staging_path)
+            else:
+                os.remove(staging_path)
+            return None
+        return size
+
+    @gen.coroutine
+    def _reuse_prior_staging(self, staging_order_id, source_fingerprint):
+        """
+        Try to stage the staging order by hardlinking the files of the latest successful staging of the same source,
+        made when the source had the same fingerprint, and update the database with the outcome if it was successful.
+        :param staging_order_id: The id of the staging order to execute
+        :param source_fingerprint: the current fingerprint of the source
+        :return: True if the staging order was staged, otherwise False
+        """
+        session = self.session_factory()
+        staging_order = self.staging_repo.get_staging_order_by_id(staging_order_id, session)
+        prior_order = self.staging_repo.get_reusable_staging_order(staging_order.source, source_fingerprint, session)
+        if not prior_order or prior_order.size is None:
+            return False
+
+        try:
+            size = yield self._staging_executor.submit(self._link_prior_staging,
+                                                       prior_order.get_staging_path(),
+                                                       prior_order.size,
+                                                       staging_order.staging_target,
+                                                       staging_order.get_staging_path())
+        except OSError as e:
+            log.info("Could not reuse the staging of: {} for: {}: {}".format(prior_order, staging_order, e))
+            return False
 
-            yield StagingService._copy_dir(**args_for_copy_dir)
+        if size is None:
+            return False
+
+        staging_order.staging_mode = StagingMode.hardlink
+        staging_order.reused_staging_order_id = prior_order.id
+        prior_order.last_used_at = time.time()
+        staging_order.size = size
+        yield self._finish_linked_staging(staging_order, session, prior_order.md5sum_file)
+        if staging_order.status != StagingStatus.staging_successful:
+            return True
+        log.info("Successfully staged: {} to: {} by reusing the staging of: {}".
+                 format(staging_order, staging_order.get_staging_path(), prior_order))
+        return True
+
+    @gen.coroutine
+    def _fingerprint_source(self, staging_order_id):
+        staging_order = self.staging_repo.get_staging_order_by_id(staging_order_id, self.session_factory())
+        source_fingerprint = yield self._staging_executor.submit(self._fingerprint, staging_order.source)
+        return source_fingerprint
+
+    @gen.coroutine
+    def _store_source_fingerprint(self, staging_order_id, source_fingerprint):
+        session = self.session_factory()
+        staging_order = self.staging_repo.get_staging_order_by_id(staging_order_id, session)
+        if staging_order.status != StagingStatus.staging_successful:
+            return
 
-        # TODO Better error handling
+        # If the source changed while it was staged, the staging might not match either fingerprint
+        fingerprint_after_staging = yield self._fingerprint_source(staging_order_id)
+        if fingerprint_after_staging != source_fingerprint:
+            log.info("Source of: {} changed while it was staged, so the staging will not be reused".
+                     format(staging_order))
+            return
+
+        staging_order.source_fingerprint = source_fingerprint
+        session.commit()
+
+    @gen.coroutine
+    def _stage_and_dispatch_next(self, stage_order_id):
+
+        try:
+            source_fingerprint = None
+            was_staged = False
+            if self.reuse_prior_stagings:
+                source_fingerprint = yield self._fingerprint_source(stage_order_id)
+            if source_fingerprint:
+                was_staged = yield self._reuse_prior_staging(stage_order_id, source_fingerprint)
+
+            if not was_staged:
+                was_staged = yield self._link_dir(stage_order_id)
+            if not was_staged:
+                yield self._copy_dir(stage_order_id)
+
+            if source_fingerprint:
+                yield self._store_source_fingerprint(stage_order_id, source_fingerprint)
+        finally:
+            self._stagings_in_progress.pop(stage_order_id, None)
+            self._preempted_stagings.pop(stage_order_id, None)
+            self.dispatch_pending_staging_orders()
+
+    def _start_staging(self, stage_order, staging_slot):
+        session = self.session_factory()
+
+        try:
+            stage_order.status = StagingStatus.staging_in_progress
+            session.commit()
         except Exception as e:
+            log.error("Failed to start staging: {} because this exception was logged: {}".format(stage_order, e))
             stage_order.status = StagingStatus.staging_failed
             session.commit()
-            raise e
+            return
+
+        self._stagings_in_progress[stage_order.id] = staging_slot
+        self._devices_of_pending_orders.pop(stage_order.id, None)
+        self._sizes_of_pending_orders.pop(stage_order.id, None)
+        log.debug("Starting staging: {}, {} stagings in progress".format(stage_order,
+                                                                         len(self._stagings_in_progress)))
+
+        # This runs until the copying is started, and then hands back control.
+        self._stage_and_dispatch_next(stage_order.id)
+
+    def _start_pending_staging_orders(self):
+        # The order might already have been started, if a staging finished while dispatching, and orders
+        # which could not be given a staging target can never be started.
+        pending_orders = [stage_order for stage_order in self.staging_repo.get_pending_staging_orders()
+                          if stage_order.status == StagingStatus.pending and
+                          stage_order.id not in self._stagings_in_progress and
+                          stage_order.staging_target]
+        pending_orders, priorities = self._prioritize(pending_orders)
+
+        if self.max_concurrent_stagings_per_device is not None:
+            pending_ids = set(stage_order.id for stage_order in pending_orders)
+            for stage_order_id in list(self._devices_of_pending_orders):
+                if stage_order_id not in pending_ids:
+                    del self._devices_of_pending_orders[stage_order_id]
+            pending_orders = self._interleave_by_source_device(pending_orders, priorities)
+
+        if self.min_free_space is not None:
+            self._size_pending_orders(pending_orders)
+
+        for stage_order in pending_orders:
+            if self.max_concurrent_stagings is not None and \
+                    len(self._stagings_in_progress) >= self.max_concurrent_stagings and \
+                    not self.preempt_lower_priority_stagings:
+                break
+
+            staging_slot = _StagingSlot(target_dir=self._staging_target_dir(stage_order),
+                                        devices=frozenset(self._devices_of(stage_order)),
+                                        target_device=None,
+                                        reserved_size=0,
+                                        priority=priorities[stage_order.id])
+            if not self._has_free_slot(staging_slot):
+                if self.preempt_lower_priority_stagings:
+                    self._preempt_lower_priority_staging(stage_order, staging_slot)
+                continue
+
+            fits, target_device, reserved_size = self._reserve_space(stage_order)
+            if fits:
+                self._start_staging(stage_order, staging_slot._replace(target_device=target_device,
+                                                                       reserved_size=reserved_size))
+
+    def dispatch_pending_staging_orders(self):
+        """
+        Start as many of the pending staging orders as the concurrency limits allow, in order of priority.
+        This is done whenever an order is queued or a staging finishes, and should be done once when the service
+        starts to pick up orders which were queued before it was last shut down.
+        :return: None
+        """
+        # Stagings which finish straight away will dispatch again from within the loop below,
+        # in that case make another pass once the current one is done instead.
+        if self._dispatching:
+            self._dispatch_requested = True
+            return
+
+        self._dispatching = True
+        try:
+            self._dispatch_requested = True
+            while self._dispatch_requested:
+                self._dispatch_requested = False
+                self._start_pending_staging_orders()
+        finally:
+            self._dispatching = False
+
+    def recover_interrupted_staging_orders(self):
+        """
+        Put the staging orders which were left in progress when the service was last stopped back in the queue, so
+        that they are staged again. Copying continues into the existing staging, while stagings which were being
+        linked are removed and linked again. An order is only requeued if none of the processes copying it are still
+        running, since it might be copied by another instance of the service. An order copied by the native
+        transfer engine is copied by the instance of the service which started it, so it is requeued once that
+        instance is no longer running. The staging orders in progress are
+        locked in the database while this is done, so that services which start at the same time do not requeue
+        the same orders. This should be done once when the service starts, before dispatching the pending orders.
+        :return: the requeued staging orders, as a list
+        """
+        session = self.session_factory()
+        requeued_orders = []
+        try:
+            for stage_order in self.staging_repo.get_staging_orders_in_progress(lock=True, custom_session=session):
+                if stage_order.id in self._stagings_in_progress:
+                    continue
+
+                running_pids = [pid for pid in stage_order.get_pids() if _is_staging_process_alive(pid)]
+                if running_pids:
+                    log.info("Not requeuing staging order: {} since its processes: {} are still running".
+                             format(stage_order, running_pids))
+                    continue
+
+                if stage_order.staging_mode != StagingMode.copy and stage_order.staging_target:
+                    staging_path = stage_order.get_staging_path()
+                    if self.file_system_service.isdir(staging_path):
+                        shutil.rmtree(staging_path)
+                    elif self.file_system_service.isfile(staging_path):
+                        os.remove(staging_path)
+
+                log.info("Requeuing interrupted staging order: {}".format(stage_order))
+                stage_order.status = StagingStatus.pending
+                stage_order.set_pids(None)
+                requeued_orders.append(stage_order)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+        return requeued_orders
+
+    @gen.coroutine
+    def stage_order(self, stage_order):
+        """
+        Validate a staging order and queue it for staging. It will be started as soon as there is a free slot.
+        :param stage_order: to stage
+        :return: None
+        """
+        if stage_order.status != StagingStatus.pending:
+            raise InvalidStatusException("Cannot start staging a delivery order with status: {}".
+                                         format(stage_order.status))
+
+        self.dispatch_pending_staging_orders()
+
+    def get_progress_of_stage_order(self, stage_order):
+        """
+        Get the progress of a staging order which is in progress
+        :param stage_order: to get the progress of
+        :return: a StagingProgress, or None if the staging order is not in progress
+        """
+        if stage_order.status != StagingStatus.staging_in_progress:
+            return None
+
+        if stage_order.id in self._progress_of_stagings:
+            return self._progress_of_stagings[stage_order.id]
+
+        # The staging might be run by another instance of the service, in that case the last stored progress is used
+        return StagingProgress(bytes_transferred=stage_order.bytes_transferred or 0,
+                               files_transferred=stage_order.files_transferred or 0)
+
+    def get_verification_mismatches(self, stage_order):
+        """
+        Get the staged files which did not match the source when a staging order was verified
+        :param stage_order: to get the mismatching files of
+        :return: a list of StagingVerificationMismatches, which is empty unless the staging failed
+        """
+        if stage_order.status != StagingStatus.staging_failed:
+            return []
+        return self.staging_repo.get_verification_mismatches(stage_order.id)
+
+    def get_queue_position(self, stage_order):
+        """
+        Get the position of a staging order in the staging queue
+        :param stage_order: to get the position of
+        :return: the position in the queue, starting at 1 for the next order to be staged, or None if the order
+                 is not queued
+        """
+        if stage_order.status != StagingStatus.pending:
+            return None
+
+        if not self.priority_aging_interval:
+            return self.staging_repo.get_number_of_pending_staging_orders_before(stage_order) + 1
+
+        # The priorities of the orders depend on how long they have waited, so the queue has to be ordered here
+        pending_orders, _ = self._prioritize(self.staging_repo.get_pending_staging_orders())
+        for queue_index, pending_order in enumerate(pending_orders):
+            if pending_order.id == stage_order.id:
+                return queue_index + 1
+        return None
 
     def _validate_project_lists(self, projects_on_runfolder, projects_to_stage):
         projects_to_stage_set = set(projects_to_stage)
         projects_on_runfolder_set = set(projects_on_runfolder)
         return projects_to_stage_set.issubset(projects_on_runfolder_set)
 
-    def stage_runfolder(self, runfolder_id, projects_to_stage=None, callback=None):
-        """
-        Stage a runfolder
-        :param runfolder_id: identifier (name) of runfolder that should be staged
-        :param projects_to_stage: defaults to None, otherwise only stage the project names given in this list, i.e.
-                                  ["ABC_123", "DEF_456"]
-        :return: the ids of the stage orders created, as a dict of project -> stage id.
-         This can than be used to poll for status using e.g. `get_status_of_stage_order`
-        """
+    def _get_or_create_staging_orders(self, sources, priority=0):
+        staging_orders = []
+        for (staging_order, created), source in zip(
+                self.staging_repo.get_or_create_staging_orders(sources=sources,
+                                                               staging_target_dir=self.staging_dir,
+                                                               priority=priority),
+                sources):
+            if created:
+                log.debug("Created a staging order: {}".format(staging_order))
+            else:
+                log.info("{} is already being staged by: {}, using it instead of staging it again".
+                         format(source, staging_order))
+            staging_orders.append(staging_order)
+        return staging_orders
 
-        runfolder = self.runfolder_repo.get_runfolder(runfolder_id)
+    @gen.coroutine
+    def _find_projects_to_stage(self, runfolder_id, projects_to_stage=None):
+        runfolder = yield self.runfolder_repo.get_runfolder_async(runfolder_id)
 
         if not runfolder:
             raise RunfolderNotFoundException(
@@ -179,44 +1066,91 @@ class StagingService(object):
             raise ProjectNotFoundException("Projects to stage: {} do not match projects on runfolder: {}".
                                            format(projects_to_stage, names_of_project_on_runfolder))
 
-        project_and_stage_order_ids = {}
-        for project in runfolder.projects:
-            if project.name in projects_to_stage:
-                # TODO Verify that there is no currently ongoing staging order before
-                # creating a new one...
+        return [project for project in runfolder.projects if project.name in projects_to_stage]
 
-                staging_order = self.staging_repo.create_staging_order(source=project.path,
-                                                                       status=StagingStatus.pending,
-                                                                       staging_target_dir=self.staging_dir)
-                log.debug("Created a staging order: {}".format(staging_order))
-                self.stage_order(staging_order)
-                project_and_stage_order_ids[project.name] = staging_order.id
+    def _find_general_project(self, dir_name):
+        exact_project = self.project_dir_repo.get_project(dir_name)
+
+        if not exact_project:
+            raise ProjectNotFoundException("Could not find a project with name: {}".format(dir_name))
 
-        return project_and_stage_order_ids
+        return exact_project
 
-    def stage_directory(self, dir_name):
+    @gen.coroutine
+    def stage_runfolder(self, runfolder_id, projects_to_stage=None, callback=None, priority=0):
+        """
+        Stage a runfolder. The runfolder is looked up without blocking the IOLoop.
+        :param runfolder_id: identifier (name) of runfolder that should be staged
+        :param projects_to_stage: defaults to None, otherwise only stage the project names given in this list, i.e.
+                                  ["ABC_123", "DEF_456"]
+        :param priority: of the stage orders, higher priorities are staged first. Defaults to 0. A project which is
+                         already pending with a lower priority is given this priority.
+        :return: the ids of the stage orders created, as a dict of project -> stage id. If a project is already
+         pending or being staged, the id of that stage order is given instead of creating a new one.
+         This can than be used to poll for status using e.g. `get_status_of_stage_order`
+        :raises FileSystemTimeoutException: if the file system did not respond in time
+        """
+        projects = yield self._find_projects_to_stage(runfolder_id, projects_to_stage)
+
+        staging_orders = self._get_or_create_staging_orders([project.path for project in projects], priority)
+        self.dispatch_pending_staging_orders()
+
+        return {project.name: staging_order.id for project, staging_order in zip(projects, staging_orders)}
+
+    def stage_directory(self, dir_name, priority=0):
         """
         Stage a project directory from a "general" directory
         :param dir_name: to stage from
-        :return: a dictionary for project name -> staging id
+        :param priority: of the stage order, see `stage_runfolder`
+        :return: a dictionary for project name -> staging id, which is the id of the existing stage order if the
+                 directory is already pending or being staged
         """
-        known_projects = self.project_dir_repo.get_projects()
+        exact_project = self._find_general_project(dir_name)
 
-        matching_project = list(filter(lambda p: p.name == dir_name, known_projects))
+        staging_order, = self._get_or_create_staging_orders([exact_project.path], priority)
+        self.dispatch_pending_staging_orders()
+        return {exact_project.name: staging_order.id}
 
-        if not matching_project:
-            raise ProjectNotFoundException("Could not find a project with name: {}".format(dir_name))
-        if len(matching_project) > 1:
-            raise TooManyProjectsFound("Found more than one project matching name: {}. This should"
-                                      "not be possible...".format(dir()))
+    @gen.coroutine
+    def stage_in_bulk(self, runfolders_and_projects=None, general_projects=None, priority=0):
+        """
+        Stage projects from many runfolders, and/or many general projects, at once. All runfolders and projects are
+        looked up before anything is staged, so if any of them can not be found nothing is staged. The staging
+        orders are then created in a single transaction, and queued together.
+        :param runfolders_and_projects: a dict of runfolder identifiers (names) to lists of the names of the projects
+                                        to stage from them, where an empty list means all projects in the runfolder
+        :param general_projects: a list of names of general projects to stage
+        :param priority: of the stage orders, see `stage_runfolder`
+        :return: a tuple of the ids of the stage orders, as a dict of runfolder -> dict of project -> stage id, and
+                 as a dict of general project -> stage id. Projects which are already pending or being staged get
+                 the id of that stage order.
+        :raises FileSystemTimeoutException: if the file system did not respond in time
+        """
+        runfolders_and_projects = runfolders_and_projects or {}
+        general_projects = general_projects or []
 
-        exact_project = matching_project[0]
+        runfolder_ids = list(runfolders_and_projects)
+        projects_of_runfolders = yield [self._find_projects_to_stage(runfolder_id,
+                                                                     runfolders_and_projects[runfolder_id])
+                                        for runfolder_id in runfolder_ids]
+        projects_of_runfolders = dict(zip(runfolder_ids, projects_of_runfolders))
+        exact_general_projects = [self._find_general_project(dir_name) for dir_name in general_projects]
 
-        staging_order = self.staging_repo.create_staging_order(source=exact_project.path,
-                                                               status=StagingStatus.pending,
-                                                               staging_target_dir=self.staging_dir)
-        self.stage_order(staging_order)
-        return {exact_project.name: staging_order.id}
+        sources = [project.path for runfolder_id in runfolder_ids for project in projects_of_runfolders[runfolder_id]]
+        sources += [project.path for project in exact_general_projects]
+        staging_orders = iter(self._get_or_create_staging_orders(sources, priority))
+        self.dispatch_pending_staging_orders()
+
+        runfolder_stage_order_ids = {runfolder_id: {project.name: next(staging_orders).id
+                                                    for project in projects_of_runfolders[runfolder_id]}
+                                     for runfolder_id in runfolder_ids}
+        general_project_stage_order_ids = {project.name: next(staging_orders).id
+                                           for project in exact_general_projects}
+
+        log.info("Queued {} staging orders from {} runfolders and {} general projects".
+                 format(len(sources), len(runfolder_ids), len(exact_general_projects)))
+
+        return runfolder_stage_order_ids, general_project_stage_order_ids
 
     def get_stage_order_by_id(self, stage_order_id):
         """
@@ -257,7 +1191,7 @@ class StagingService(object):
                 raise InvalidStatusException(
                     "Can only kill processes where the staging order is 'staging_in_progress'")
 
-            os.kill(stage_order.pid, signal.SIGTERM)
+            self.transfer_engine.cancel(stage_order)
 
         except OSError:
             log.error("Failed to kill process with pid: {} associated with staging order: {} ".
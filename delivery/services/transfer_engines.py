@@ -0,0 +1,654 @@
+
+import errno
+import hashlib
+import heapq
+import logging
+import mmap
+import os
+import re
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from tornado import gen
+
+from delivery.exceptions import TransferCancelledException
+from delivery.models.staging_progress import StagingProgress
+from delivery.models.transfer_result import TransferResult
+from delivery.services.file_system_service import FileSystemService
+
+log = logging.getLogger(__name__)
+
+
+class TransferEngine(object):
+    """
+    Base class of the engines which copy the source of a staging order, a directory or a file, to its staging path,
+    i.e. `staging_order.get_staging_path()`. Symlinks in the source are followed. Copying into what an earlier,
+    interrupted, transfer of the same source left behind should continue that transfer rather than start over.
+    """
+
+    @gen.coroutine
+    def transfer(self, staging_order, progress_callback, started_callback):
+        """
+        Copy the source of a staging order
+        :param staging_order: to copy
+        :param progress_callback: called with a StagingProgress of the transfer, every now and then while copying
+        :param started_callback: called with a list of the pids of the processes which copy the files, once the
+                                 copying has started. Files which are copied by this process are reported with
+                                 the pid of this process.
+        :return: a TransferResult
+        """
+        raise NotImplementedError()
+
+    def cancel(self, staging_order):
+        """
+        Stop the transfer of a staging order, which will then finish as unsuccessful
+        :param staging_order: to stop copying
+        :return: None
+        :raises OSError: if the transfer could not be stopped
+        """
+        raise NotImplementedError()
+
+
+def _size_balanced_shards(files_and_sizes, nbr_of_shards):
+    """
+    Split files into shards of about the same total size, by adding the files, largest first, to the
+    shard which is currently the smallest.
+    :param files_and_sizes: list of (file, size) tuples
+    :param nbr_of_shards: to split the files into
+    :return: a list of lists of files, without any empty shards
+    """
+    shards = [(0, i, []) for i in range(nbr_of_shards)]
+    for file_name, size in sorted(files_and_sizes, key=lambda file_and_size: file_and_size[1], reverse=True):
+        shard_size, i, shard = heapq.heappop(shards)
+        shard.append(file_name)
+        heapq.heappush(shards, (shard_size + size, i, shard))
+    return [shard for _, _, shard in sorted(shards, key=lambda shard: shard[1]) if shard]
+
+
+# A line of progress output from rsync --info=progress2, e.g:
+#   1,238,099,968  45%  118.07MB/s    0:00:10 (xfr#5, to-chk=3/10)
+# The time is the estimated time left, except on lines written as a file is finished (the ones
+# with a transfer count), where it is the time elapsed.
+_RSYNC_PROGRESS = re.compile(r'^\s*([\d,]+)\s+(\d+)%\s+([\d.]+)([kMGT]?B)/s\s+(\d+):(\d+):(\d+)(?:\s+\(xfr#(\d+),)?')
+_RSYNC_RATE_UNITS = {'B': 1, 'kB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+
+
+def _parse_rsync_progress(line, previous_progress):
+    """
+    Parse a line of progress output from rsync
+    :param line: to parse
+    :param previous_progress: the StagingProgress parsed from the previous line, used to fill in what is not
+                              reported on every line
+    :return: a new StagingProgress, or None if the line is not a progress line
+    """
+    match = _RSYNC_PROGRESS.match(line)
+    if not match:
+        return None
+
+    bytes_transferred, percent_done, rate, rate_unit, hours, minutes, seconds, files_transferred = match.groups()
+    if files_transferred:
+        eta_seconds = previous_progress.eta_seconds
+    else:
+        eta_seconds = int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+    return StagingProgress(bytes_transferred=int(bytes_transferred.replace(",", "")),
+                           files_transferred=int(files_transferred or previous_progress.files_transferred),
+                           bytes_per_second=int(float(rate) * _RSYNC_RATE_UNITS[rate_unit]),
+                           eta_seconds=eta_seconds,
+                           percent_done=float(percent_done))
+
+
+# Directory, relative to each directory copied to, in which rsync keeps partially copied files if it is interrupted
+_RSYNC_PARTIAL_DIR = '.rsync-partial'
+
+
+def _rsync_options(resume):
+    """
+    Options for copying with rsync, such that an interrupted copy can be resumed. Files which have already been copied
+    keep the modification time of the original, and are skipped. Files which were partially copied are kept in
+    `_RSYNC_PARTIAL_DIR`, and when resuming they are used as the basis of the new copy so that the data which was
+    already copied is not copied again.
+    :param resume: True if continuing to copy into an existing staging
+    :return: a list of options
+    """
+    options = ['--times', '--partial-dir={}'.format(_RSYNC_PARTIAL_DIR)]
+    if resume:
+        # rsync copies local files whole by default, which would not make any use of the partial files
+        options.append('--no-whole-file')
+    return options
+
+
+def _parse_total_file_size(rsync_stdout):
+    # Parse the file size from the output of rsync stats:
+    # Total file size: 207,707,566 bytes
+    match = re.search(r'Total file size: ([\d,]+) bytes', rsync_stdout, re.MULTILINE)
+    return int(match.group(1).replace(",", ""))
+
+
+class RsyncTransferEngine(TransferEngine):
+    """
+    Copies with rsync. A directory can be copied by several rsync processes at once, each copying its share of the
+    files, by setting `workers`. If any of them fails, the others are stopped, everything which has been copied is
+    removed and the transfer fails as a whole.
+
+    If a `BandwidthGovernor` is given, each transfer is limited (with `--bwlimit`) to its fair share of the
+    bandwidth limits as they are when it starts, split evenly between its rsync processes. The limit of an rsync
+    process can not be changed once it is running, so changes to the limits apply to the transfers started after
+    them.
+    """
+
+    def __init__(self, external_program_service, workers=1, file_system_service=FileSystemService(),
+                 bandwidth_governor=None):
+        """
+        Instantiate a new RsyncTransferEngine
+        :param external_program_service: a instance of ExternalProgramService
+        :param workers: number of rsync processes to copy a directory with, defaults to 1
+        :param file_system_service: a service which can access the file system
+        :param bandwidth_governor: a `BandwidthGovernor` to limit the bandwidth of the transfers with, defaults to
+                                   None, which means that they are not limited
+        """
+        self.external_program_service = external_program_service
+        self.workers = workers
+        self.file_system_service = file_system_service
+        self.bandwidth_governor = bandwidth_governor
+
+        # Listing the files to split them between the processes blocks, so it is done on threads of its own
+        self._executor = ThreadPoolExecutor(max_workers=4)
+        # Staging order id -> pids of the rsync processes copying it
+        self._pids_of_transfers = {}
+
+    def _has_been_partly_staged(self, staging_order):
+        staging_path = staging_order.get_staging_path()
+        return self.file_system_service.isdir(staging_path) or self.file_system_service.isfile(staging_path)
+
+    @gen.coroutine
+    def transfer(self, staging_order, progress_callback, started_callback):
+        if self.bandwidth_governor:
+            self.bandwidth_governor.transfer_started(staging_order.id, os.path.dirname(staging_order.staging_target))
+        try:
+            if self.workers > 1:
+                file_lists_and_total_size = yield self._executor.submit(self._write_shard_file_lists, staging_order)
+                if file_lists_and_total_size is not None:
+                    result = yield self._copy_in_shards(staging_order, progress_callback, started_callback,
+                                                        *file_lists_and_total_size)
+                    return result
+
+            result = yield self._copy(staging_order, progress_callback, started_callback)
+            return result
+        finally:
+            if self.bandwidth_governor:
+                self.bandwidth_governor.transfer_finished(staging_order.id)
+
+    def _bwlimit_options(self, staging_order, nbr_of_processes=1):
+        """
+        Options which limit each of the rsync processes of a transfer to their share of its share of the bandwidth
+        :param staging_order: being transferred
+        :param nbr_of_processes: number of rsync processes copying it
+        :return: a list of options, which is empty if the bandwidth is not limited
+        """
+        if not self.bandwidth_governor:
+            return []
+        fair_share = self.bandwidth_governor.fair_share(staging_order.id)
+        if fair_share is None:
+            return []
+        # rsync takes the limit in KiB per second
+        kib_per_second = max(fair_share // nbr_of_processes // 1024, 1)
+        log.debug("Limiting the rsync processes of: {} to {} KiB/s each".format(staging_order, kib_per_second))
+        return ['--bwlimit={}'.format(kib_per_second)]
+
+    @staticmethod
+    def _follow_progress(progresses, process_index, total_size, progress_callback):
+        def on_output_line(line):
+            progress = _parse_rsync_progress(line, progresses[process_index])
+            if not progress:
+                return False
+
+            progresses[process_index] = progress
+            progress_callback(StagingProgress.combine(progresses, total_size))
+            return True
+
+        return on_output_line
+
+    @gen.coroutine
+    def _copy(self, staging_order, progress_callback, started_callback):
+        cmd = ['rsync', '--stats', '--info=progress2', '-r', '--copy-links'] + \
+            _rsync_options(resume=self._has_been_partly_staged(staging_order)) + \
+            self._bwlimit_options(staging_order) + \
+            [staging_order.source, staging_order.staging_target]
+
+        execution = self.external_program_service.run(cmd, follow_output=True)
+        self._pids_of_transfers[staging_order.id] = {execution.pid}
+        try:
+            started_callback([execution.pid])
+
+            execution_result = yield self.external_program_service.wait_for_execution(
+                execution, output_callback=self._follow_progress([StagingProgress()], 0, None, progress_callback))
+            log.debug("Execution result: {}".format(execution_result))
+        finally:
+            self._pids_of_transfers.pop(staging_order.id, None)
+
+        if execution_result.status_code != 0:
+            return TransferResult(successful=False,
+                                  message="rsync returned exit code: {}".format(execution_result.status_code))
+        return TransferResult(successful=True, size=_parse_total_file_size(execution_result.stdout))
+
+    def _write_shard_file_lists(self, staging_order):
+        """
+        Split the files of a directory into shards for `workers` processes to copy, and write a file list for each of
+        them.
+        :param staging_order: to split the files of
+        :return: a tuple of the paths to the file lists and the total size of the files, or None if the source is
+                 not a directory
+        """
+        source = os.path.abspath(staging_order.source)
+        if not os.path.isdir(source):
+            return None
+
+        # The paths are relative to the parent directory, so that they are copied into
+        # `staging_target/<source name>` as when copying the whole directory at once.
+        source_name = os.path.basename(source)
+        directories = [source_name]
+        files_and_sizes = []
+        for relative_path, entry in self.file_system_service.walk_tree(source):
+            if entry.is_dir():
+                directories.append(os.path.join(source_name, relative_path))
+            else:
+                files_and_sizes.append((os.path.join(source_name, relative_path), entry.stat().st_size))
+
+        shards = _size_balanced_shards(files_and_sizes, self.workers) or [[]]
+        # Let one of the processes create all directories, so that empty ones are copied too
+        shards[0] = directories + shards[0]
+
+        file_lists = []
+        try:
+            for shard in shards:
+                with tempfile.NamedTemporaryFile(mode='w',
+                                                 prefix='staging_order_{}_'.format(staging_order.id),
+                                                 delete=False) as file_list:
+                    file_lists.append(file_list.name)
+                    file_list.write('\0'.join(shard))
+        except Exception:
+            self._remove_files(file_lists)
+            raise
+        return file_lists, sum(size for _, size in files_and_sizes)
+
+    @staticmethod
+    def _remove_files(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError as e:
+                log.warning("Could not remove {}: {}".format(path, e))
+
+    @staticmethod
+    def _terminate(pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    @gen.coroutine
+    def _copy_in_shards(self, staging_order, progress_callback, started_callback, file_lists, total_size):
+        try:
+            source_parent = os.path.dirname(os.path.abspath(staging_order.source))
+            options = _rsync_options(resume=self._has_been_partly_staged(staging_order)) + \
+                self._bwlimit_options(staging_order, nbr_of_processes=len(file_lists))
+            executions = [self.external_program_service.run(['rsync', '--stats', '--info=progress2',
+                                                             '--copy-links', '--from0',
+                                                             '--files-from={}'.format(file_list)] + options +
+                                                            [source_parent, staging_order.staging_target],
+                                                            follow_output=True)
+                          for file_list in file_lists]
+            running_pids = set(execution.pid for execution in executions)
+            self._pids_of_transfers[staging_order.id] = running_pids
+
+            started_callback([execution.pid for execution in executions])
+
+            progresses = [StagingProgress() for _ in executions]
+
+            @gen.coroutine
+            def wait_for_shard(process_index, execution):
+                try:
+                    execution_result = yield self.external_program_service.wait_for_execution(
+                        execution,
+                        output_callback=self._follow_progress(progresses, process_index, total_size,
+                                                              progress_callback))
+                finally:
+                    running_pids.discard(execution.pid)
+                if execution_result.status_code != 0:
+                    log.info("rsync of a shard of: {} returned exit code: {}, stopping the others".
+                             format(staging_order, execution_result.status_code))
+                    self._terminate(list(running_pids))
+                return execution_result
+
+            execution_results = yield [wait_for_shard(process_index, execution)
+                                       for process_index, execution in enumerate(executions)]
+
+            failed = [result for result in execution_results if result.status_code != 0]
+            if failed:
+                result = TransferResult(successful=False,
+                                        message="{} of {} rsync processes failed".format(len(failed),
+                                                                                          len(execution_results)))
+            else:
+                result = TransferResult(successful=True,
+                                        size=sum(_parse_total_file_size(execution_result.stdout)
+                                                 for execution_result in execution_results))
+        except Exception:
+            self._terminate(list(self._pids_of_transfers.get(staging_order.id, [])))
+            raise
+        finally:
+            self._pids_of_transfers.pop(staging_order.id, None)
+            self._remove_files(file_lists)
+
+        if not result.successful and staging_order.staging_target:
+            yield self._executor.submit(shutil.rmtree, staging_order.staging_target, ignore_errors=True)
+        return result
+
+    def cancel(self, staging_order):
+        # If the order is copied by several processes, all of them are killed
+        for pid in list(self._pids_of_transfers.get(staging_order.id) or staging_order.get_pids()):
+            os.kill(pid, signal.SIGTERM)
+
+
+class _TransferCounter(object):
+    """
+    Keeps count of the bytes and files copied by the threads of a transfer
+    """
+
+    def __init__(self, total_bytes):
+        self.total_bytes = total_bytes
+        self.bytes_transferred = 0
+        self.files_transferred = 0
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, nbr_of_bytes=0, nbr_of_files=0):
+        with self._lock:
+            self.bytes_transferred += nbr_of_bytes
+            self.files_transferred += nbr_of_files
+
+    def progress(self):
+        with self._lock:
+            bytes_transferred, files_transferred = self.bytes_transferred, self.files_transferred
+
+        elapsed = time.monotonic() - self.started_at
+        bytes_per_second = int(bytes_transferred / elapsed) if elapsed > 0 else None
+        if bytes_per_second:
+            eta_seconds = int((self.total_bytes - bytes_transferred) / bytes_per_second)
+        else:
+            eta_seconds = None
+        percent_done = 100.0 * bytes_transferred / self.total_bytes if self.total_bytes else None
+
+        return StagingProgress(bytes_transferred=bytes_transferred,
+                               files_transferred=files_transferred,
+                               bytes_per_second=bytes_per_second,
+                               eta_seconds=eta_seconds,
+                               percent_done=percent_done)
+
+
+def _fadvise(fd, advice_name):
+    # Only a hint, so it does not matter if it is not supported
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, 0, 0, getattr(os, advice_name))
+        except OSError:
+            pass
+
+
+def _copy_range(source_fd, target_fd, offset, count):
+    """
+    Copy up to `count` bytes from `offset` in the source file to the current position of the target file, without
+    passing them through user space
+    :return: the number of bytes copied, which is 0 at the end of the source file
+    """
+    if hasattr(os, 'copy_file_range'):
+        return os.copy_file_range(source_fd, target_fd, count, offset)
+    return os.sendfile(target_fd, source_fd, offset, count)
+
+
+class NativeTransferEngine(TransferEngine):
+    """
+    Copies in this process, spreading the files over a pool of threads which copy one file each at a time.
+
+    Files are copied within the kernel with `copy_file_range` (or `sendfile` where that is not available), which
+    avoids copying the data through user space, and lets file systems which support it clone or copy the data
+    server-side. If `compute_checksums` is set, the data has to be read anyway to compute the md5 checksums of the
+    files, so the files are instead copied through large, page aligned, buffers, computing the checksums in the same
+    pass as the copying. Either way, the kernel is told that the files are read sequentially, and that the data read
+    will not be needed again once copied.
+
+    Files which already have the same size and modification time as their source, i.e. which were copied by an
+    earlier transfer which was interrupted, are not copied again.
+
+    If a `BandwidthGovernor` is given, the threads take bandwidth from it for each chunk they copy (or read to
+    compute its checksum), and wait before copying the next chunk if they have to. Changes to the limits therefore
+    apply straight away, also to the transfers in progress.
+    """
+
+    def __init__(self, workers=4, buffer_size=8 * 1024 * 1024, compute_checksums=False, progress_interval=1,
+                 bandwidth_governor=None):
+        """
+        Instantiate a new NativeTransferEngine
+        :param workers: number of files to copy at the same time, in total for all transfers. Defaults to 4
+        :param buffer_size: number of bytes to copy at a time. Defaults to 8 MiB
+        :param compute_checksums: if True, compute the md5 checksums of the files while copying them. Defaults to
+                                  False
+        :param progress_interval: number of seconds between reporting the progress of a transfer, defaults to 1
+        :param bandwidth_governor: a `BandwidthGovernor` to limit the bandwidth of the transfers with, defaults to
+                                   None, which means that they are not limited
+        """
+        self.workers = workers
+        self.buffer_size = buffer_size
+        self.compute_checksums = compute_checksums
+        self.progress_interval = progress_interval
+        self.bandwidth_governor = bandwidth_governor
+
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._buffers = threading.local()
+        # Ids of the staging orders being transferred, and of those of them which should stop
+        self._transfers = set()
+        self._cancelled_transfers = set()
+
+    def _buffer(self):
+        if getattr(self._buffers, 'buffer', None) is None:
+            # An anonymous memory map is page aligned
+            self._buffers.buffer = memoryview(mmap.mmap(-1, self.buffer_size))
+        return self._buffers.buffer
+
+    def _check_not_cancelled(self, transfer_id):
+        if transfer_id in self._cancelled_transfers:
+            raise TransferCancelledException("The transfer of staging order: {} was cancelled".format(transfer_id))
+
+    def _throttle(self, transfer_id, nbr_of_bytes):
+        if not self.bandwidth_governor:
+            return
+        wait_until = time.monotonic() + self.bandwidth_governor.reserve(transfer_id, nbr_of_bytes)
+        # Wait in short steps, so that a cancelled transfer stops in time
+        while True:
+            self._check_not_cancelled(transfer_id)
+            time_left = wait_until - time.monotonic()
+            if time_left <= 0:
+                return
+            time.sleep(min(time_left, 0.5))
+
+    @staticmethod
+    def _list_and_create_directories(source, staging_path):
+        """
+        List the files to copy, and create the directories to copy them into
+        :return: a list of (path relative to the source, size) tuples of the files to copy. The path of a source
+                 which is a file is ''.
+        """
+        if not os.path.isdir(source):
+            os.makedirs(os.path.dirname(staging_path), exist_ok=True)
+            return [('', os.path.getsize(source))]
+
+        os.makedirs(staging_path, exist_ok=True)
+        files_and_sizes = []
+        for relative_path, entry in FileSystemService.walk_tree(source):
+            if entry.is_dir():
+                os.makedirs(os.path.join(staging_path, relative_path), exist_ok=True)
+            else:
+                files_and_sizes.append((relative_path, entry.stat().st_size))
+        return files_and_sizes
+
+    def _read_checksum(self, source_file, counter, transfer_id):
+        checksum = hashlib.md5()
+        buffer = self._buffer()
+        while True:
+            self._check_not_cancelled(transfer_id)
+            nbr_of_bytes = source_file.readinto(buffer)
+            if not nbr_of_bytes:
+                return checksum.hexdigest()
+            checksum.update(buffer[:nbr_of_bytes])
+            counter.add(nbr_of_bytes)
+            self._throttle(transfer_id, nbr_of_bytes)
+
+    def _copy_and_checksum(self, source_file, target_file, counter, transfer_id):
+        checksum = hashlib.md5()
+        buffer = self._buffer()
+        while True:
+            self._check_not_cancelled(transfer_id)
+            nbr_of_bytes = source_file.readinto(buffer)
+            if not nbr_of_bytes:
+                return checksum.hexdigest()
+            checksum.update(buffer[:nbr_of_bytes])
+            target_file.write(buffer[:nbr_of_bytes])
+            counter.add(nbr_of_bytes)
+            self._throttle(transfer_id, nbr_of_bytes)
+
+    def _copy_in_kernel(self, source_file, target_file, counter, transfer_id):
+        offset = 0
+        while True:
+            self._check_not_cancelled(transfer_id)
+            try:
+                nbr_of_bytes = _copy_range(source_file.fileno(), target_file.fileno(), offset, self.buffer_size)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EXDEV, errno.EOPNOTSUPP):
+                    raise
+                # Not supported for these files, copy the rest through user space instead
+                source_file.seek(offset)
+                self._copy_and_checksum(source_file, target_file, counter, transfer_id)
+                return
+            if not nbr_of_bytes:
+                return
+            offset += nbr_of_bytes
+            counter.add(nbr_of_bytes)
+            self._throttle(transfer_id, nbr_of_bytes)
+
+    def _copy_file(self, source, target, counter, transfer_id):
+        """
+        Copy a file, along with its permissions and modification time
+        :return: the md5 checksum of the file if `compute_checksums` is set, otherwise None
+        """
+        self._check_not_cancelled(transfer_id)
+        source_stat = os.stat(source)
+        try:
+            target_stat = os.stat(target)
+            already_copied = target_stat.st_size == source_stat.st_size and \
+                target_stat.st_mtime_ns == source_stat.st_mtime_ns
+        except FileNotFoundError:
+            already_copied = False
+
+        if already_copied and not self.compute_checksums:
+            counter.add(source_stat.st_size, 1)
+            return None
+
+        checksum = None
+        with open(source, 'rb', buffering=0) as source_file:
+            _fadvise(source_file.fileno(), 'POSIX_FADV_SEQUENTIAL')
+            if already_copied:
+                checksum = self._read_checksum(source_file, counter, transfer_id)
+            else:
+                with open(target, 'wb', buffering=0) as target_file:
+                    if self.compute_checksums:
+                        checksum = self._copy_and_checksum(source_file, target_file, counter, transfer_id)
+                    else:
+                        self._copy_in_kernel(source_file, target_file, counter, transfer_id)
+            _fadvise(source_file.fileno(), 'POSIX_FADV_DONTNEED')
+
+        if not already_copied:
+            shutil.copymode(source, target)
+            os.utime(target, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+        counter.add(nbr_of_files=1)
+        return checksum
+
+    def _copy_file_or_cancel_others(self, source, target, counter, transfer_id):
+        try:
+            return self._copy_file(source, target, counter, transfer_id)
+        except Exception:
+            # There is no point in copying the rest if one of the files could not be copied
+            self._cancelled_transfers.add(transfer_id)
+            raise
+
+    @gen.coroutine
+    def transfer(self, staging_order, progress_callback, started_callback):
+        transfer_id = staging_order.id
+        source = os.path.abspath(staging_order.source)
+        staging_path = staging_order.get_staging_path()
+
+        self._transfers.add(transfer_id)
+        if self.bandwidth_governor:
+            self.bandwidth_governor.transfer_started(transfer_id, os.path.dirname(staging_order.staging_target))
+        copies = []
+        try:
+            files_and_sizes = yield self._executor.submit(self._list_and_create_directories, source, staging_path)
+            started_callback([os.getpid()])
+
+            counter = _TransferCounter(total_bytes=sum(size for _, size in files_and_sizes))
+            # Start with the largest files, so that the threads finish at about the same time
+            files_and_sizes = sorted(files_and_sizes, key=lambda file_and_size: file_and_size[1], reverse=True)
+            copies = [self._executor.submit(self._copy_file_or_cancel_others,
+                                            os.path.join(source, relative_path) if relative_path else source,
+                                            os.path.join(staging_path, relative_path) if relative_path else
+                                            staging_path,
+                                            counter,
+                                            transfer_id)
+                      for relative_path, _ in files_and_sizes]
+
+            all_copied = gen.multi_future(copies)
+            while True:
+                try:
+                    checksums = yield gen.with_timeout(timedelta(seconds=self.progress_interval), all_copied,
+                                                       quiet_exceptions=(Exception,))
+                    break
+                except gen.TimeoutError:
+                    progress_callback(counter.progress())
+            progress_callback(counter.progress())
+
+        except Exception as e:
+            # Stop the threads which are still copying, or waiting for bandwidth, before forgetting the transfer
+            self._cancelled_transfers.add(transfer_id)
+            error = e
+            for copy in copies:
+                try:
+                    yield copy
+                except TransferCancelledException:
+                    pass
+                except Exception as copy_error:
+                    # The other copies were cancelled because of the first file which could not be copied
+                    if isinstance(error, TransferCancelledException):
+                        error = copy_error
+            return TransferResult(successful=False, message=str(error))
+        finally:
+            self._transfers.discard(transfer_id)
+            self._cancelled_transfers.discard(transfer_id)
+            if self.bandwidth_governor:
+                self.bandwidth_governor.transfer_finished(transfer_id)
+
+        checksums_by_path = None
+        if self.compute_checksums:
+            staged_name = os.path.basename(staging_path)
+            checksums_by_path = {os.path.join(staged_name, relative_path) if relative_path else staged_name: checksum
+                                 for (relative_path, _), checksum in zip(files_and_sizes, checksums)}
+        return TransferResult(successful=True, size=counter.total_bytes, checksums=checksums_by_path)
+
+    def cancel(self, staging_order):
+        if staging_order.id not in self._transfers:
+            raise OSError(errno.ESRCH, "No transfer of staging order: {} in progress".format(staging_order.id))
+        self._cancelled_transfers.add(staging_order.id)
@@ -0,0 +1,66 @@
+"""
+Benchmark of listing all runfolders with `FileSystemBasedRunfolderRepository` using different numbers of
+discovery workers, on a synthetic runfolder directory where every directory listing is delayed to mimic
+a network file system.
+
+Run it with:
+
+    python -m tests.benchmarks.parallel_project_discovery
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import timeit
+
+from delivery.repositories.runfolder_repository import FileSystemBasedRunfolderRepository
+from delivery.services.file_system_service import FileSystemService
+
+NBR_OF_RUNFOLDERS = 200
+NBR_OF_PROJECTS = 3
+LATENCY_PER_LISTING = 0.005
+DISCOVERY_WORKERS = [1, 4, 16, 32]
+REPEATS = 3
+
+
+class SlowFileSystemService(FileSystemService):
+
+    @staticmethod
+    def list_directories(base_path):
+        time.sleep(LATENCY_PER_LISTING)
+        return list(FileSystemService.list_directories(base_path))
+
+
+def create_runfolder_directory(root):
+    for i in range(NBR_OF_RUNFOLDERS):
+        runfolder = os.path.join(root, "160930_ST-E00216_{:04d}_BH37CWALXX".format(i))
+        for j in range(NBR_OF_PROJECTS):
+            os.makedirs(os.path.join(runfolder, "Projects", "ABC_{}".format(j)))
+
+
+def main():
+    root = tempfile.mkdtemp()
+    try:
+        create_runfolder_directory(root)
+        print("{} runfolders, {} ms latency per listing".format(NBR_OF_RUNFOLDERS, LATENCY_PER_LISTING * 1000))
+        print("{:>8} {:>12}".format("workers", "time (ms)"))
+        expected = None
+        for workers in DISCOVERY_WORKERS:
+            repo = FileSystemBasedRunfolderRepository(root,
+                                                      file_system_service=SlowFileSystemService(),
+                                                      discovery_workers=workers)
+            runfolders = list(repo.get_runfolders())
+            if expected is None:
+                expected = runfolders
+            assert runfolders == expected
+            assert [r.projects for r in runfolders] == [r.projects for r in expected]
+
+            elapsed = timeit.timeit(lambda: list(repo.get_runfolders()), number=REPEATS) / REPEATS
+            print("{:>8} {:>12.1f}".format(workers, elapsed * 1000))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
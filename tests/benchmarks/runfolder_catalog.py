@@ -0,0 +1,58 @@
+"""
+Benchmark of listing runfolders from the `DatabaseBasedRunfolderCatalogRepository`, with and without a name
+prefix filter, for a catalog of 10000 runfolders with three projects each.
+
+Run it with:
+
+    python -m tests.benchmarks.runfolder_catalog
+"""
+
+import timeit
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from delivery.models.db_models import SQLAlchemyBase
+from delivery.models.project import RunfolderProject
+from delivery.models.runfolder import Runfolder
+from delivery.repositories.runfolder_catalog_repository import DatabaseBasedRunfolderCatalogRepository
+
+NBR_OF_RUNFOLDERS = 10000
+NBR_OF_PROJECTS = 3
+REPEATS = 5
+
+
+def create_runfolders():
+    for i in range(NBR_OF_RUNFOLDERS):
+        name = "{:06d}_ST-E00216_0111_BH37CWALXX".format(i)
+        runfolder = Runfolder(name=name, path="/data/{}".format(name))
+        runfolder.projects = [RunfolderProject(name="ABC_{}".format(j),
+                                               path="/data/{}/Projects/ABC_{}".format(name, j),
+                                               runfolder_path=runfolder.path)
+                              for j in range(NBR_OF_PROJECTS)]
+        yield runfolder, 1.0
+
+
+def main():
+    engine = create_engine('sqlite:///:memory:', echo=False)
+    SQLAlchemyBase.metadata.create_all(engine)
+    session_factory = scoped_session(sessionmaker())
+    session_factory.configure(bind=engine)
+    repo = DatabaseBasedRunfolderCatalogRepository(session_factory)
+
+    insert_time = timeit.timeit(lambda: repo.update_catalog(list(create_runfolders()), []), number=1)
+    print("Cataloguing {} runfolders: {:.1f} ms".format(NBR_OF_RUNFOLDERS, insert_time * 1000))
+
+    list_time = timeit.timeit(lambda: list(repo.get_runfolders()), number=REPEATS) / REPEATS
+    print("Listing all runfolders: {:.1f} ms".format(list_time * 1000))
+
+    prefix_time = timeit.timeit(lambda: list(repo.get_runfolders(name_prefix="0099")), number=REPEATS) / REPEATS
+    print("Listing runfolders with a name prefix: {:.1f} ms".format(prefix_time * 1000))
+
+    lookup_time = timeit.timeit(lambda: repo.get_runfolder("009999_ST-E00216_0111_BH37CWALXX"),
+                                number=REPEATS) / REPEATS
+    print("Looking up one runfolder: {:.1f} ms".format(lookup_time * 1000))
+
+
+if __name__ == "__main__":
+    main()
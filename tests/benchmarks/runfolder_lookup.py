@@ -0,0 +1,51 @@
+"""
+Benchmark of looking up a single runfolder with `FileSystemBasedRunfolderRepository.get_runfolder`, compared
+to finding it by scanning all runfolders, for increasingly large runfolder directories.
+
+Run it with:
+
+    python -m tests.benchmarks.runfolder_lookup
+"""
+
+import os
+import shutil
+import tempfile
+import timeit
+
+from delivery.repositories.runfolder_repository import FileSystemBasedRunfolderRepository
+
+NBR_OF_RUNFOLDERS = [10, 100, 1000, 5000]
+NBR_OF_PROJECTS = 3
+REPEATS = 20
+
+
+def create_runfolder_directory(root, nbr_of_runfolders):
+    for i in range(nbr_of_runfolders):
+        runfolder = os.path.join(root, "160930_ST-E00216_{:04d}_BH37CWALXX".format(i))
+        for j in range(NBR_OF_PROJECTS):
+            os.makedirs(os.path.join(runfolder, "Projects", "ABC_{}".format(j)))
+
+
+def lookup_by_scanning(repo, name):
+    return [r for r in repo.get_runfolders() if r.name == name]
+
+
+def main():
+    print("{:>12} {:>16} {:>16}".format("runfolders", "scan (ms)", "direct (ms)"))
+    for nbr_of_runfolders in NBR_OF_RUNFOLDERS:
+        root = tempfile.mkdtemp()
+        try:
+            create_runfolder_directory(root, nbr_of_runfolders)
+            repo = FileSystemBasedRunfolderRepository(root)
+            name = "160930_ST-E00216_{:04d}_BH37CWALXX".format(nbr_of_runfolders - 1)
+
+            scan_time = timeit.timeit(lambda: lookup_by_scanning(repo, name), number=REPEATS) / REPEATS
+            direct_time = timeit.timeit(lambda: repo.get_runfolder(name), number=REPEATS) / REPEATS
+
+            print("{:>12} {:>16.3f} {:>16.3f}".format(nbr_of_runfolders, scan_time * 1000, direct_time * 1000))
+        finally:
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
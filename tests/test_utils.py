@@ -4,6 +4,8 @@ import random
 
 from mock import MagicMock
 
+from tornado.concurrent import Future
+
 from delivery.models.project import RunfolderProject
 from delivery.models.runfolder import Runfolder
 from delivery.services.external_program_service import ExecutionResult, Execution
@@ -17,6 +19,40 @@ class MockIOLoop():
     def spawn_callback(self, f, **args):
         f(**args)
 
+def future_with_result(result):
+    """
+    Create a future which has already been resolved with result, e.g. to use as the return value
+    of a mocked coroutine.
+    """
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def batches_of(*batches):
+    """
+    Create a coroutine function which returns the given batches one at a time, and then an empty list, e.g. to use as
+    the return value of a mocked `get_*_batches_async` method.
+    """
+    remaining = list(batches)
+
+    def next_batch():
+        return future_with_result(list(remaining.pop(0)) if remaining else [])
+
+    return next_batch
+
+
+def runfolder_batches_after(runfolders):
+    """
+    Create a fake `get_runfolder_batches_async` method, e.g. to use as the side effect of a mocked one, which returns
+    the given runfolders whose names come after `after` in a single batch.
+    """
+    def get_runfolder_batches_async(after=None, **kwargs):
+        return batches_of([runfolder for runfolder in runfolders if after is None or runfolder.name > after])
+
+    return get_runfolder_batches_async
+
+
 class TestUtils:
     DUMMY_CONFIG = {"monitored_directory": "/foo"}
 
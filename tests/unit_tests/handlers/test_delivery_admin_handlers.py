@@ -0,0 +1,47 @@
+import json
+
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from delivery.app import routes
+from delivery.services.bandwidth_governor import BandwidthGovernor
+
+from tests.test_utils import DummyConfig
+
+
+class TestBandwidthLimitsHandler(AsyncHTTPTestCase):
+
+    API_BASE = "/api/1.0"
+
+    def get_app(self):
+        self.bandwidth_governor = BandwidthGovernor(limit=1000)
+        self.bandwidth_governor.transfer_started(1, '/staging')
+        return Application(
+            routes(
+                config=DummyConfig(),
+                bandwidth_governor=self.bandwidth_governor))
+
+    def test_get_bandwidth_limits(self):
+        response = self.fetch(self.API_BASE + "/admin/bandwidth")
+
+        self.assertEqual(response.code, 200)
+        self.assertDictEqual(json.loads(response.body), {'limit': 1000,
+                                                        'limits_per_target': {},
+                                                        'transfers_in_progress': 1})
+
+    def test_set_bandwidth_limits(self):
+        body = {'limits_per_target': {'/staging': 500}}
+        response = self.fetch(self.API_BASE + "/admin/bandwidth", method='PUT', body=json.dumps(body))
+
+        self.assertEqual(response.code, 200)
+        self.assertDictEqual(json.loads(response.body), {'limit': None,
+                                                        'limits_per_target': {'/staging': 500},
+                                                        'transfers_in_progress': 1})
+        self.assertEqual(self.bandwidth_governor.fair_share(1), 500)
+
+    def test_set_invalid_bandwidth_limits(self):
+        for body in [{'limit': -1}, {'limits_per_target': {'/staging': 'fast'}}, {'limits_per_target': 5}]:
+            response = self.fetch(self.API_BASE + "/admin/bandwidth", method='PUT', body=json.dumps(body))
+            self.assertEqual(response.code, 400)
+
+        self.assertTupleEqual(self.bandwidth_governor.get_limits(), (1000, {}))
@@ -8,7 +8,7 @@ from tornado.web import Application
 
 from delivery.app import routes
 
-from tests.test_utils import DummyConfig, FAKE_RUNFOLDERS
+from tests.test_utils import DummyConfig, FAKE_RUNFOLDERS, future_with_result
 
 
 class TestDeliveryHandlers(AsyncHTTPTestCase):
@@ -18,8 +18,8 @@ class TestDeliveryHandlers(AsyncHTTPTestCase):
     mock_runfolder_repo = MagicMock()
 
     def get_app(self):
-        self.mock_runfolder_repo.get_runfolders.return_value = FAKE_RUNFOLDERS
-        self.mock_runfolder_repo.get_runfolder.return_value = FAKE_RUNFOLDERS[0]
+        self.mock_runfolder_repo.get_runfolders_async.return_value = future_with_result(FAKE_RUNFOLDERS)
+        self.mock_runfolder_repo.get_runfolder_async.return_value = future_with_result(FAKE_RUNFOLDERS[0])
 
         return Application(
             routes(
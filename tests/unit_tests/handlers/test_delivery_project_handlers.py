@@ -1,4 +1,5 @@
 
+import copy
 import json
 from mock import MagicMock
 
@@ -8,7 +9,8 @@ from tornado.web import Application
 
 from delivery.app import routes
 
-from tests.test_utils import DummyConfig, FAKE_RUNFOLDERS
+from tests.test_utils import DummyConfig, FAKE_RUNFOLDERS, future_with_result, batches_of, \
+    runfolder_batches_after
 
 
 class TestProjectHandlers(AsyncHTTPTestCase):
@@ -18,8 +20,8 @@ class TestProjectHandlers(AsyncHTTPTestCase):
     mock_runfolder_repo = MagicMock()
 
     def get_app(self):
-        self.mock_runfolder_repo.get_runfolders.return_value = FAKE_RUNFOLDERS
-        self.mock_runfolder_repo.get_runfolder.return_value = FAKE_RUNFOLDERS[0]
+        self.mock_runfolder_repo.get_runfolder_batches_async.side_effect = lambda **kwargs: batches_of(FAKE_RUNFOLDERS)
+        self.mock_runfolder_repo.get_runfolder_async.return_value = future_with_result(FAKE_RUNFOLDERS[0])
 
         return Application(
             routes(
@@ -38,7 +40,7 @@ class TestProjectHandlers(AsyncHTTPTestCase):
         self.assertDictEqual(json.loads(response.body), {"projects": expected_result})
 
     def test_get_projects_empty(self):
-        self.mock_runfolder_repo.get_runfolders.return_value = []
+        self.mock_runfolder_repo.get_runfolder_batches_async.side_effect = lambda **kwargs: batches_of([])
 
         response = self.fetch(self.API_BASE + "/projects")
 
@@ -50,3 +52,64 @@ class TestProjectHandlers(AsyncHTTPTestCase):
             self.API_BASE + "/runfolders/160930_ST-E00216_0111_BH37CWALXX/projects")
         self.assertEqual(response.code, 200)
         self.assertTrue(len(json.loads(response.body)["projects"]) == 2)
+
+    def test_get_projects_paged(self):
+        self.mock_runfolder_repo.get_runfolder_batches_async.side_effect = runfolder_batches_after(FAKE_RUNFOLDERS)
+
+        response = self.fetch(self.API_BASE + "/projects?limit=3&after=160930_ST-E00216_0111_BH37CWALXX/ABC_123")
+        response_json = json.loads(response.body)
+
+        self.assertEqual(response.code, 200)
+        self.assertListEqual([p["path"] for p in response_json["projects"]],
+                             ["/foo/160930_ST-E00216_0111_BH37CWALXX/Projects/DEF_456",
+                              "/foo/160930_ST-E00216_0112_BH37CWALXX/Projects/ABC_123",
+                              "/foo/160930_ST-E00216_0112_BH37CWALXX/Projects/DEF_456"])
+        self.assertIsNone(response_json["next_after"])
+
+    def test_get_projects_paged_with_invalid_after(self):
+        response = self.fetch(self.API_BASE + "/projects?limit=3&after=160930_ST-E00216_0111_BH37CWALXX")
+        self.assertEqual(response.code, 400)
+
+    def test_get_projects_streamed(self):
+        self.mock_runfolder_repo.get_runfolder_batches_async.side_effect = lambda **kwargs: batches_of(FAKE_RUNFOLDERS)
+
+        response = self.fetch(self.API_BASE + "/projects?stream=true&limit=1")
+        response_json = json.loads(response.body)
+
+        self.assertEqual(response.code, 200)
+        self.assertListEqual(response_json["projects"], [FAKE_RUNFOLDERS[0].projects[0].__dict__])
+        self.assertEqual(response_json["next_after"], "160930_ST-E00216_0111_BH37CWALXX/ABC_123")
+
+    def test_get_projects_with_name_prefix(self):
+        self.mock_runfolder_repo.get_runfolder_batches_async.side_effect = lambda **kwargs: batches_of(FAKE_RUNFOLDERS)
+
+        response = self.fetch(self.API_BASE + "/projects?name_prefix=DEF")
+        response_json = json.loads(response.body)
+
+        self.assertEqual(response.code, 200)
+        self.assertListEqual([p["name"] for p in response_json["projects"]], ["DEF_456", "DEF_456"])
+
+    def test_get_projects_with_sizes(self):
+        def projects_with_sizes_async(projects):
+            projects_with_sizes = []
+            for project in projects:
+                project = copy.copy(project)
+                project.size = 10
+                project.file_count = 2
+                projects_with_sizes.append(project)
+            return future_with_result(projects_with_sizes)
+
+        mock_project_size_service = MagicMock()
+        mock_project_size_service.projects_with_sizes_async.side_effect = projects_with_sizes_async
+        self._app = Application(
+            routes(
+                config=DummyConfig(),
+                runfolder_repo=self.mock_runfolder_repo,
+                project_size_service=mock_project_size_service))
+        self.http_server.request_callback = self._app
+
+        response = self.fetch(self.API_BASE + "/projects")
+        response_json = json.loads(response.body)
+
+        self.assertEqual(response.code, 200)
+        self.assertTrue(all(p["size"] == 10 and p["file_count"] == 2 for p in response_json["projects"]))
@@ -1,13 +1,17 @@
 
+import copy
 import json
 from mock import MagicMock
 
+from tornado.concurrent import Future
 from tornado.testing import *
 from tornado.web import Application
 
 from delivery.app import routes
+from delivery.exceptions import FileSystemTimeoutException
 
-from tests.test_utils import DummyConfig, FAKE_RUNFOLDERS
+from tests.test_utils import DummyConfig, FAKE_RUNFOLDERS, future_with_result, batches_of, \
+    runfolder_batches_after
 
 
 class TestRunfolderHandlers(AsyncHTTPTestCase):
@@ -24,7 +28,7 @@ class TestRunfolderHandlers(AsyncHTTPTestCase):
 
     def test_get_runfolders(self):
 
-        self.mock_runfolder_repo.get_runfolders.return_value = FAKE_RUNFOLDERS
+        self.mock_runfolder_repo.get_runfolder_batches_async.side_effect = lambda **kwargs: batches_of(FAKE_RUNFOLDERS)
 
         response = self.fetch(self.API_BASE + "/runfolders")
 
@@ -36,7 +40,7 @@ class TestRunfolderHandlers(AsyncHTTPTestCase):
 
     def test_get_runfolders_empty(self):
 
-        self.mock_runfolder_repo.get_runfolders.return_value = []
+        self.mock_runfolder_repo.get_runfolder_batches_async.side_effect = lambda **kwargs: batches_of([])
 
         response = self.fetch(self.API_BASE + "/runfolders")
 
@@ -44,3 +48,106 @@ class TestRunfolderHandlers(AsyncHTTPTestCase):
 
         self.assertEqual(response.code, 200)
         self.assertDictEqual(json.loads(response.body), expected_result)
+
+    def test_get_runfolders_paged(self):
+
+        self.mock_runfolder_repo.get_runfolder_batches_async.side_effect = runfolder_batches_after(FAKE_RUNFOLDERS)
+
+        response = self.fetch(self.API_BASE + "/runfolders?limit=1")
+        response_json = json.loads(response.body)
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual([r["name"] for r in response_json["runfolders"]], [FAKE_RUNFOLDERS[0].name])
+        self.assertEqual(response_json["next_after"], FAKE_RUNFOLDERS[0].name)
+
+        response = self.fetch(self.API_BASE + "/runfolders?limit=1&after={}".format(response_json["next_after"]))
+        response_json = json.loads(response.body)
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual([r["name"] for r in response_json["runfolders"]], [FAKE_RUNFOLDERS[1].name])
+        self.assertIsNone(response_json["next_after"])
+
+    def test_get_runfolders_invalid_limit(self):
+        self.mock_runfolder_repo.get_runfolder_batches_async.side_effect = lambda **kwargs: batches_of(FAKE_RUNFOLDERS)
+        response = self.fetch(self.API_BASE + "/runfolders?limit=-1")
+        self.assertEqual(response.code, 400)
+
+    def test_get_runfolders_streamed(self):
+
+        self.mock_runfolder_repo.get_runfolder_batches_async.side_effect = lambda **kwargs: batches_of(FAKE_RUNFOLDERS)
+
+        response = self.fetch(self.API_BASE + "/runfolders?stream=true")
+
+        expected_result = list([runfolder.__dict__ for runfolder in FAKE_RUNFOLDERS])
+        expected_json = json.dumps({"runfolders": expected_result}, default=lambda x: x.__dict__)
+
+        self.assertEqual(response.code, 200)
+        self.assertDictEqual(json.loads(response.body), json.loads(expected_json))
+
+    def test_get_runfolders_streamed_empty(self):
+
+        self.mock_runfolder_repo.get_runfolder_batches_async.side_effect = lambda **kwargs: batches_of([])
+
+        response = self.fetch(self.API_BASE + "/runfolders?stream=true&limit=10")
+
+        self.assertEqual(response.code, 200)
+        self.assertDictEqual(json.loads(response.body), {"runfolders": [], "next_after": None})
+
+    def test_get_runfolders_streamed_in_batches(self):
+        next_batch = MagicMock(side_effect=batches_of(FAKE_RUNFOLDERS[:1], FAKE_RUNFOLDERS[1:]))
+        self.mock_runfolder_repo.get_runfolder_batches_async.side_effect = lambda **kwargs: next_batch
+
+        response = self.fetch(self.API_BASE + "/runfolders?stream=true&limit=1")
+        response_json = json.loads(response.body)
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual([r["name"] for r in response_json["runfolders"]], [FAKE_RUNFOLDERS[0].name])
+        self.assertEqual(response_json["next_after"], FAKE_RUNFOLDERS[0].name)
+        # The batch after the page is only asked for to know if there are more runfolders
+        self.assertEqual(next_batch.call_count, 2)
+
+        self.mock_runfolder_repo.get_runfolder_batches_async.side_effect = runfolder_batches_after(FAKE_RUNFOLDERS)
+        response = self.fetch(self.API_BASE + "/runfolders?stream=true&after={}".format(FAKE_RUNFOLDERS[0].name))
+
+        self.assertEqual([r["name"] for r in json.loads(response.body)["runfolders"]],
+                         [runfolder.name for runfolder in FAKE_RUNFOLDERS[1:]])
+        # The runfolders to start after are skipped by the repository, rather than the handler
+        self.mock_runfolder_repo.get_runfolder_batches_async.assert_called_with(name_prefix=None,
+                                                                                after=FAKE_RUNFOLDERS[0].name)
+
+    def test_get_runfolders_with_sizes(self):
+        def projects_with_sizes_async(projects):
+            projects_with_sizes = []
+            for project in projects:
+                project = copy.copy(project)
+                project.size = 10
+                projects_with_sizes.append(project)
+            return future_with_result(projects_with_sizes)
+
+        mock_project_size_service = MagicMock()
+        mock_project_size_service.projects_with_sizes_async.side_effect = projects_with_sizes_async
+        self._app = Application(
+            routes(
+                config=DummyConfig(),
+                runfolder_repo=self.mock_runfolder_repo,
+                project_size_service=mock_project_size_service))
+        self.http_server.request_callback = self._app
+        self.mock_runfolder_repo.get_runfolder_batches_async.side_effect = lambda **kwargs: batches_of(FAKE_RUNFOLDERS)
+
+        response = self.fetch(self.API_BASE + "/runfolders")
+        response_json = json.loads(response.body)
+
+        self.assertEqual(response.code, 200)
+        self.assertListEqual([[p["size"] for p in r["projects"]] for r in response_json["runfolders"]],
+                             [[10] * len(runfolder.projects) for runfolder in FAKE_RUNFOLDERS])
+        # The runfolders which were listed are left as they are
+        self.assertTrue(all(project.size is None for runfolder in FAKE_RUNFOLDERS for project in runfolder.projects))
+
+    def test_get_runfolders_file_system_timeout(self):
+        timed_out = Future()
+        timed_out.set_exception(FileSystemTimeoutException("Timed out"))
+        self.mock_runfolder_repo.get_runfolder_batches_async.side_effect = lambda **kwargs: lambda: timed_out
+
+        response = self.fetch(self.API_BASE + "/runfolders")
+
+        self.assertEqual(response.code, 503)
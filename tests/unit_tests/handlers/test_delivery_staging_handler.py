@@ -1,11 +1,16 @@
+import json
 from mock import MagicMock
 
+from tornado.concurrent import Future
 from tornado.testing import *
 from tornado.web import Application
 
 from delivery.app import routes
 
-from tests.test_utils import DummyConfig, FAKE_RUNFOLDERS
+from delivery.models.db_models import StagingOrder, StagingStatus, StagingVerificationMismatch
+
+from delivery.exceptions import RunfolderNotFoundException
+from tests.test_utils import DummyConfig, FAKE_RUNFOLDERS, future_with_result
 
 
 class TestStagingHandlers(AsyncHTTPTestCase):
@@ -13,12 +18,14 @@ class TestStagingHandlers(AsyncHTTPTestCase):
     API_BASE = "/api/1.0"
 
     mock_runfolder_repo = MagicMock()
+    mock_staging_service = MagicMock()
 
     def get_app(self):
         return Application(
             routes(
                 config=DummyConfig(),
-                runfolder_repo=self.mock_runfolder_repo))
+                runfolder_repo=self.mock_runfolder_repo,
+                staging_service=self.mock_staging_service))
 
     ###
     # A staging handler should:
@@ -45,3 +52,123 @@ class TestStagingHandlers(AsyncHTTPTestCase):
     # - kill the process of a staging attempt
     def test_cancel_staging_process(self):
         pass
+
+    # - stage projects from many runfolders, and general projects, in one request
+    def test_stage_in_bulk(self):
+        self.mock_staging_service.stage_in_bulk.reset_mock()
+        self.mock_staging_service.stage_in_bulk.return_value = future_with_result(
+            ({'runfolder_a': {'ABC_123': 1}, 'runfolder_b': {'ABC_123': 2}}, {'foo': 3}))
+
+        body = {'runfolders': {'runfolder_a': ['ABC_123'], 'runfolder_b': []}, 'projects': ['foo'], 'priority': 10}
+        response = self.fetch(self.API_BASE + "/stage/bulk", method='POST', body=json.dumps(body))
+
+        self.assertEqual(response.code, 202)
+        self.mock_staging_service.stage_in_bulk.assert_called_once_with(
+            runfolders_and_projects={'runfolder_a': ['ABC_123'], 'runfolder_b': []}, general_projects=['foo'],
+            priority=10)
+        response_json = json.loads(response.body)
+        self.assertDictEqual(response_json['staging_order_ids'],
+                             {'runfolders': {'runfolder_a': {'ABC_123': 1}, 'runfolder_b': {'ABC_123': 2}},
+                              'projects': {'foo': 3}})
+        self.assertTrue(response_json['staging_order_links']['runfolders']['runfolder_b']['ABC_123'].
+                        endswith('/api/1.0/stage/2'))
+        self.assertTrue(response_json['staging_order_links']['projects']['foo'].endswith('/api/1.0/stage/3'))
+
+    # - stage nothing, and return 404, if any runfolder can not be found
+    def test_stage_in_bulk_with_missing_runfolder(self):
+        future = Future()
+        future.set_exception(RunfolderNotFoundException("Couldn't find runfolder matching: runfolder_b"))
+        self.mock_staging_service.stage_in_bulk.return_value = future
+
+        body = {'runfolders': {'runfolder_a': [], 'runfolder_b': []}}
+        response = self.fetch(self.API_BASE + "/stage/bulk", method='POST', body=json.dumps(body))
+
+        self.assertEqual(response.code, 404)
+
+    # - stage nothing, and return 400, if the body is not on the expected format
+    def test_stage_in_bulk_with_invalid_body(self):
+        self.mock_staging_service.stage_in_bulk.reset_mock()
+
+        for body in ['not json',
+                     json.dumps(['runfolder_a']),
+                     json.dumps({'runfolders': ['runfolder_a']}),
+                     json.dumps({'runfolders': {'runfolder_a': 'ABC_123'}}),
+                     json.dumps({'runfolders': {'runfolder_a': [1]}}),
+                     json.dumps({'projects': 'foo'}),
+                     json.dumps({'projects': [{'name': 'foo'}]})]:
+            response = self.fetch(self.API_BASE + "/stage/bulk", method='POST', body=body)
+            self.assertEqual(response.code, 400, body)
+
+        self.mock_staging_service.stage_in_bulk.assert_not_called()
+
+    # - stage with a priority, and return 400 if the priority is not an integer
+    def test_stage_with_priority(self):
+        self.mock_staging_service.stage_directory.reset_mock()
+        self.mock_staging_service.stage_directory.return_value = {'foo': 1}
+
+        response = self.fetch(self.API_BASE + "/stage/project/foo", method='POST', body=json.dumps({'priority': 5}))
+        self.assertEqual(response.code, 202)
+        self.mock_staging_service.stage_directory.assert_called_once_with('foo', priority=5)
+
+        response = self.fetch(self.API_BASE + "/stage/project/foo", method='POST',
+                              body=json.dumps({'priority': 'urgent'}))
+        self.assertEqual(response.code, 400)
+        self.mock_staging_service.stage_directory.assert_called_once_with('foo', priority=5)
+
+        response = self.fetch(self.API_BASE + "/stage/runfolder/foo", method='POST',
+                              body=json.dumps({'priority': 1.5}))
+        self.assertEqual(response.code, 400)
+
+    # - stage nothing, and return 400, if the body is JSON but not an object
+    def test_stage_with_body_which_is_not_an_object(self):
+        self.mock_staging_service.stage_directory.reset_mock()
+        self.mock_staging_service.stage_runfolder.reset_mock()
+
+        for body in [json.dumps(['ABC_123']), json.dumps(5)]:
+            response = self.fetch(self.API_BASE + "/stage/project/foo", method='POST', body=body)
+            self.assertEqual(response.code, 400, body)
+            response = self.fetch(self.API_BASE + "/stage/runfolder/foo", method='POST', body=body)
+            self.assertEqual(response.code, 400, body)
+
+        self.mock_staging_service.stage_directory.assert_not_called()
+        self.mock_staging_service.stage_runfolder.assert_not_called()
+
+    # - get the status and queue position of a staging order
+    def test_get_staging_status(self):
+        self.mock_staging_service.get_stage_order_by_id.return_value = StagingOrder(id=1,
+                                                                                    source='/foo',
+                                                                                    status=StagingStatus.pending,
+                                                                                    priority=0)
+        self.mock_staging_service.get_queue_position.return_value = 3
+        self.mock_staging_service.get_progress_of_stage_order.return_value = None
+        self.mock_staging_service.get_verification_mismatches.return_value = []
+
+        response = self.fetch(self.API_BASE + "/stage/1")
+
+        self.assertEqual(response.code, 200)
+        self.assertDictEqual(json.loads(response.body), {"status": "pending",
+                                                        "priority": 0,
+                                                        "size": None,
+                                                        "queue_position": 3,
+                                                        "staging_mode": None,
+                                                        "reused_staging_order_id": None,
+                                                        "md5sum_file": None,
+                                                        "verification_mismatches": [],
+                                                        "progress": None})
+
+    # - list the files which did not match the source when the staging was verified
+    def test_get_staging_status_with_verification_mismatches(self):
+        self.mock_staging_service.get_stage_order_by_id.return_value = StagingOrder(id=1,
+                                                                                    source='/foo',
+                                                                                    status=StagingStatus.staging_failed)
+        self.mock_staging_service.get_queue_position.return_value = None
+        self.mock_staging_service.get_progress_of_stage_order.return_value = None
+        self.mock_staging_service.get_verification_mismatches.return_value = [
+            StagingVerificationMismatch(staging_order_id=1, path='foo/a', source_md5sum='abc', staged_md5sum=None)]
+
+        response = self.fetch(self.API_BASE + "/stage/1")
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body)["status"], "staging_failed")
+        self.assertListEqual(json.loads(response.body)["verification_mismatches"],
+                             [{"path": "foo/a", "source_md5sum": "abc", "staged_md5sum": None}])
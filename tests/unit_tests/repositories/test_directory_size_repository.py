@@ -0,0 +1,44 @@
+
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from delivery.models.db_models import SQLAlchemyBase
+from delivery.repositories.directory_size_repository import DatabaseBasedDirectorySizeRepository
+
+
+class TestDirectorySizeRepository(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite:///:memory:', echo=False)
+        SQLAlchemyBase.metadata.create_all(engine)
+
+        session_factory = scoped_session(sessionmaker())
+        session_factory.configure(bind=engine)
+
+        self.directory_size_repo = DatabaseBasedDirectorySizeRepository(session_factory)
+        self.directory_size_repo.store_directory_sizes([("/foo/a", 10, 2, 1.0), ("/foo/b", 20, 3, 2.0)])
+
+    def test_get_directory_size(self):
+        directory_size = self.directory_size_repo.get_directory_size("/foo/a")
+        self.assertEqual((directory_size.size, directory_size.file_count, directory_size.mtime), (10, 2, 1.0))
+
+    def test_get_directory_size_not_scanned(self):
+        self.assertIsNone(self.directory_size_repo.get_directory_size("/foo/c"))
+
+    def test_get_directory_sizes(self):
+        directory_sizes = self.directory_size_repo.get_directory_sizes()
+        self.assertListEqual(sorted(directory_sizes), ["/foo/a", "/foo/b"])
+        self.assertEqual(directory_sizes["/foo/b"].size, 20)
+
+    def test_get_directory_sizes_of_paths(self):
+        directory_sizes = self.directory_size_repo.get_directory_sizes(["/foo/b", "/foo/c"])
+        self.assertListEqual(list(directory_sizes), ["/foo/b"])
+
+    def test_store_directory_sizes_replaces_previous(self):
+        self.directory_size_repo.store_directory_sizes([("/foo/a", 15, 4, 3.0)])
+
+        directory_sizes = self.directory_size_repo.get_directory_sizes()
+        self.assertEqual(len(directory_sizes), 2)
+        self.assertEqual((directory_sizes["/foo/a"].size, directory_sizes["/foo/a"].file_count), (15, 4))
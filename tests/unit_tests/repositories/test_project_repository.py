@@ -1,4 +1,7 @@
 
+import os
+import shutil
+import tempfile
 import unittest
 from mock import MagicMock
 
@@ -37,3 +40,22 @@ class TestGeneralProjectRepository(unittest.TestCase):
 
         actual = repo.get_projects()
         self.assertEqual(list(actual), expected)
+
+    def test_get_project(self):
+        root_directory = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(root_directory, 'foo'))
+            open(os.path.join(root_directory, 'not_a_dir'), 'w').close()
+            repo = GeneralProjectRepository(root_directory=root_directory)
+
+            self.assertEqual(repo.get_project('foo'),
+                             GeneralProject(name='foo', path=os.path.join(root_directory, 'foo')))
+            self.assertIsNone(repo.get_project('bar'))
+            self.assertIsNone(repo.get_project('not_a_dir'))
+        finally:
+            shutil.rmtree(root_directory)
+
+    def test_get_project_rejects_paths(self):
+        repo = GeneralProjectRepository(root_directory='/foo')
+        for name in ['', '.', '..', '../foo', 'foo/bar', '/foo']:
+            self.assertIsNone(repo.get_project(name))
@@ -0,0 +1,129 @@
+
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import StaticPool
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from delivery.models.db_models import SQLAlchemyBase, CatalogRunfolder, CatalogProject
+from delivery.models.runfolder import Runfolder
+from delivery.repositories.runfolder_catalog_repository import DatabaseBasedRunfolderCatalogRepository
+
+from tests.test_utils import FAKE_RUNFOLDERS
+
+
+def _session_factory():
+    # The `*_async` methods query the catalog from another thread, so all threads have to share the same
+    # connection to the in-memory database.
+    engine = create_engine('sqlite:///:memory:', echo=False,
+                           connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    SQLAlchemyBase.metadata.create_all(engine)
+
+    session_factory = scoped_session(sessionmaker())
+    session_factory.configure(bind=engine)
+    return session_factory
+
+
+class TestRunfolderCatalogRepository(unittest.TestCase):
+
+    def setUp(self):
+        session_factory = _session_factory()
+        self.session = session_factory()
+
+        self.catalog_repo = DatabaseBasedRunfolderCatalogRepository(session_factory)
+        self.catalog_repo.update_catalog([(FAKE_RUNFOLDERS[1], 2.0), (FAKE_RUNFOLDERS[0], 1.0)], [])
+
+    def test_get_runfolders(self):
+        actual_runfolders = list(self.catalog_repo.get_runfolders())
+        self.assertListEqual(actual_runfolders, FAKE_RUNFOLDERS)
+        for actual, expected in zip(actual_runfolders, FAKE_RUNFOLDERS):
+            self.assertListEqual(actual.projects, expected.projects)
+
+    def test_get_runfolders_with_name_prefix(self):
+        actual_runfolders = list(self.catalog_repo.get_runfolders(name_prefix="160930_ST-E00216_0112"))
+        self.assertListEqual(actual_runfolders, [FAKE_RUNFOLDERS[1]])
+        self.assertListEqual(actual_runfolders[0].projects, FAKE_RUNFOLDERS[1].projects)
+
+        # Underscores should not be treated as wildcards
+        self.assertListEqual(list(self.catalog_repo.get_runfolders(name_prefix="160930-")), [])
+
+    def test_get_runfolder(self):
+        actual_runfolder = self.catalog_repo.get_runfolder("160930_ST-E00216_0111_BH37CWALXX")
+        self.assertEqual(actual_runfolder, FAKE_RUNFOLDERS[0])
+        self.assertListEqual(actual_runfolder.projects, FAKE_RUNFOLDERS[0].projects)
+
+        self.assertIsNone(self.catalog_repo.get_runfolder("foo"))
+
+    def test_get_projects(self):
+        actual_projects = list(self.catalog_repo.get_projects())
+        self.assertListEqual(actual_projects, FAKE_RUNFOLDERS[0].projects + FAKE_RUNFOLDERS[1].projects)
+
+        actual_projects = list(self.catalog_repo.get_projects(name_prefix="DEF"))
+        self.assertListEqual(actual_projects, [FAKE_RUNFOLDERS[0].projects[1], FAKE_RUNFOLDERS[1].projects[1]])
+
+    def test_get_projects_modification_times(self):
+        self.assertDictEqual(self.catalog_repo.get_projects_modification_times(),
+                             {"160930_ST-E00216_0111_BH37CWALXX": 1.0,
+                              "160930_ST-E00216_0112_BH37CWALXX": 2.0})
+
+    def test_update_catalog(self):
+        runfolder_without_projects = Runfolder(name="160930_ST-E00216_0111_BH37CWALXX",
+                                               path="/foo/160930_ST-E00216_0111_BH37CWALXX")
+
+        self.catalog_repo.update_catalog([(runfolder_without_projects, None)], ["160930_ST-E00216_0112_BH37CWALXX"])
+
+        self.assertListEqual(list(self.catalog_repo.get_runfolders()), [runfolder_without_projects])
+        self.assertIsNone(self.catalog_repo.get_runfolder("160930_ST-E00216_0111_BH37CWALXX").projects)
+        self.assertEqual(self.session.query(CatalogRunfolder).count(), 1)
+        self.assertEqual(self.session.query(CatalogProject).count(), 0)
+
+
+class TestRunfolderCatalogRepositoryAsync(AsyncTestCase):
+
+    def setUp(self):
+        super(TestRunfolderCatalogRepositoryAsync, self).setUp()
+        self.catalog_repo = DatabaseBasedRunfolderCatalogRepository(_session_factory())
+        self.catalog_repo.update_catalog([(FAKE_RUNFOLDERS[1], 2.0), (FAKE_RUNFOLDERS[0], 1.0)], [])
+
+    @staticmethod
+    @gen.coroutine
+    def _all_batches(next_batch):
+        batches = []
+        batch = yield next_batch()
+        while batch:
+            batches.append(batch)
+            batch = yield next_batch()
+        return batches
+
+    @gen_test
+    def test_get_runfolders_async(self):
+        actual_runfolders = yield self.catalog_repo.get_runfolders_async()
+        self.assertListEqual(actual_runfolders, FAKE_RUNFOLDERS)
+
+    @gen_test
+    def test_get_runfolder_batches_async(self):
+        batches = yield self._all_batches(self.catalog_repo.get_runfolder_batches_async(batch_size=1))
+        self.assertListEqual(batches, [[runfolder] for runfolder in FAKE_RUNFOLDERS])
+        for batch, expected in zip(batches, FAKE_RUNFOLDERS):
+            self.assertListEqual(batch[0].projects, expected.projects)
+
+        batches = yield self._all_batches(
+            self.catalog_repo.get_runfolder_batches_async(after="160930_ST-E00216_0111_BH37CWALXX"))
+        self.assertListEqual(batches, [[FAKE_RUNFOLDERS[1]]])
+
+    @gen_test
+    def test_get_project_batches_async(self):
+        all_projects = FAKE_RUNFOLDERS[0].projects + FAKE_RUNFOLDERS[1].projects
+
+        batches = yield self._all_batches(self.catalog_repo.get_project_batches_async(batch_size=3))
+        self.assertListEqual(batches, [all_projects[:3], all_projects[3:]])
+
+        after = ("160930_ST-E00216_0111_BH37CWALXX", FAKE_RUNFOLDERS[0].projects[0].name)
+        batches = yield self._all_batches(self.catalog_repo.get_project_batches_async(after=after))
+        self.assertListEqual(batches, [all_projects[1:]])
+
+        batches = yield self._all_batches(self.catalog_repo.get_project_batches_async(name_prefix="DEF",
+                                                                                       batch_size=1))
+        self.assertListEqual(batches, [[FAKE_RUNFOLDERS[0].projects[1]], [FAKE_RUNFOLDERS[1].projects[1]]])
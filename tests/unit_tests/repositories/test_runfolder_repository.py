@@ -1,7 +1,11 @@
+import os
 import unittest
 
+from tornado.testing import AsyncTestCase, gen_test
+
 from delivery.models.runfolder import Runfolder
 from delivery.repositories.runfolder_repository import FileSystemBasedRunfolderRepository
+from delivery.services.file_system_service import FileSystemService
 
 from tests.test_utils import FAKE_RUNFOLDERS, mock_file_system_service, fake_directories, fake_projects
 
@@ -26,6 +30,17 @@ class TestRunfolderRepository(unittest.TestCase):
                     self.assertListEqual(
                         actual_runfolder.projects, expected_runfolder.projects)
 
+    def test_get_runfolders_after(self):
+        file_system_service = mock_file_system_service(fake_directories, fake_projects)
+        repo = FileSystemBasedRunfolderRepository(base_path="/foo", file_system_service=file_system_service)
+
+        actual_runfolders = list(repo.get_runfolders(after=FAKE_RUNFOLDERS[0].name))
+
+        self.assertListEqual(actual_runfolders, FAKE_RUNFOLDERS[1:])
+        # The projects of the runfolders which are skipped are not looked up
+        file_system_service.find_project_directories.assert_called_once_with(
+            os.path.join(FAKE_RUNFOLDERS[1].path, "Projects"))
+
     def test_get_runfolders_does_not_return_none_runfolder(self):
         # Adding a directory which does not conform to the runfolder pattern
         with_non_runfolder_dir = fake_directories + ["bar"]
@@ -41,3 +56,167 @@ class TestRunfolderRepository(unittest.TestCase):
         actual_runfolder = self.repo.get_runfolder(runfolder_name)
         self.assertIsInstance(actual_runfolder, Runfolder)
         self.assertEqual(actual_runfolder.name, runfolder_name)
+        self.assertEqual(actual_runfolder.path, "/foo/160930_ST-E00216_0111_BH37CWALXX")
+        self.assertListEqual(actual_runfolder.projects, FAKE_RUNFOLDERS[0].projects)
+
+    def test_get_runfolder_does_not_list_runfolder_directory(self):
+        file_system_service = mock_file_system_service(fake_directories,
+                                                       fake_projects)
+        repo = FileSystemBasedRunfolderRepository(base_path="/foo",
+                                                  file_system_service=file_system_service)
+        repo.get_runfolder("160930_ST-E00216_0111_BH37CWALXX")
+        file_system_service.find_runfolder_directories.assert_not_called()
+        file_system_service.find_project_directories.assert_called_once_with(
+            "/foo/160930_ST-E00216_0111_BH37CWALXX/Projects")
+
+    def test_get_runfolder_with_relative_base_path(self):
+        runfolder_dir = os.path.join(os.path.dirname(__file__), "..", "..", "resources", "runfolders")
+        repo = FileSystemBasedRunfolderRepository(base_path=os.path.relpath(runfolder_dir),
+                                                  file_system_service=FileSystemService())
+
+        actual_runfolder = repo.get_runfolder("160930_ST-E00216_0111_BH37CWALXX")
+        self.assertEqual(actual_runfolder.path,
+                         os.path.abspath(os.path.join(runfolder_dir, "160930_ST-E00216_0111_BH37CWALXX")))
+        self.assertListEqual([project.name for project in actual_runfolder.projects], ["ABC_123"])
+
+    def test_get_runfolder_not_a_directory(self):
+        file_system_service = mock_file_system_service(fake_directories,
+                                                       fake_projects)
+        file_system_service.isdir.return_value = False
+        repo = FileSystemBasedRunfolderRepository(base_path="/foo",
+                                                  file_system_service=file_system_service)
+        self.assertIsNone(repo.get_runfolder("160930_ST-E00216_0111_BH37CWALXX"))
+
+    def test_get_runfolder_rejects_invalid_names(self):
+        self.assertIsNone(self.repo.get_runfolder("bar"))
+        self.assertIsNone(self.repo.get_runfolder("160930_ST-E00216_0111_BH37CWALXX/Projects"))
+        self.assertIsNone(self.repo.get_runfolder("../160930_ST-E00216_0111_BH37CWALXX"))
+        self.assertIsNone(self.repo.get_runfolder(""))
+
+class TestRunfolderRepositoryWithDiscoveryWorkers(unittest.TestCase):
+
+    def test_get_runfolders(self):
+        many_directories = ["160930_ST-E00216_{:04d}_BH37CWALXX".format(i) for i in range(50)]
+        file_system_service = mock_file_system_service(list(reversed(many_directories)),
+                                                       fake_projects)
+        repo = FileSystemBasedRunfolderRepository(base_path="/foo",
+                                                  file_system_service=file_system_service,
+                                                  discovery_workers=4)
+
+        actual_runfolders = list(repo.get_runfolders())
+
+        self.assertListEqual([r.name for r in actual_runfolders], many_directories)
+        for runfolder in actual_runfolders:
+            self.assertListEqual([p.name for p in runfolder.projects], fake_projects)
+            self.assertTrue(all(p.runfolder_path == runfolder.path for p in runfolder.projects))
+
+    def test_get_runfolders_with_index(self):
+        file_system_service = mock_file_system_service(fake_directories,
+                                                       fake_projects)
+        repo = FileSystemBasedRunfolderRepository(base_path="/foo",
+                                                  file_system_service=file_system_service,
+                                                  index_max_staleness=0,
+                                                  discovery_workers=4)
+
+        self.assertListEqual(FAKE_RUNFOLDERS, list(repo.get_runfolders()))
+        self.assertListEqual(FAKE_RUNFOLDERS, list(repo.get_runfolders()))
+
+
+class TestRunfolderRepositoryWithIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.file_system_service = mock_file_system_service(fake_directories,
+                                                            fake_projects)
+        self.mtimes = {"/foo": 1,
+                       "/foo/160930_ST-E00216_0111_BH37CWALXX/Projects": 1,
+                       "/foo/160930_ST-E00216_0112_BH37CWALXX/Projects": 1}
+        self.file_system_service.getmtime.side_effect = lambda path: self.mtimes[path]
+
+        self.repo = FileSystemBasedRunfolderRepository(base_path="/foo",
+                                                       file_system_service=self.file_system_service,
+                                                       index_max_staleness=0)
+
+    def test_get_runfolders(self):
+        actual_runfolders = list(self.repo.get_runfolders())
+        self.assertListEqual(FAKE_RUNFOLDERS, actual_runfolders)
+        self.assertListEqual(FAKE_RUNFOLDERS[0].projects, actual_runfolders[0].projects)
+
+    def test_get_runfolders_after(self):
+        actual_runfolders = list(self.repo.get_runfolders(after=FAKE_RUNFOLDERS[0].name))
+        self.assertListEqual(FAKE_RUNFOLDERS[1:], actual_runfolders)
+
+    def test_does_not_relist_unchanged_directories(self):
+        list(self.repo.get_runfolders())
+        list(self.repo.get_runfolders())
+
+        self.assertEqual(self.file_system_service.find_runfolder_directories.call_count, 1)
+        self.assertEqual(self.file_system_service.find_project_directories.call_count, 2)
+
+    def test_relists_only_changed_directories(self):
+        list(self.repo.get_runfolders())
+
+        self.mtimes["/foo/160930_ST-E00216_0112_BH37CWALXX/Projects"] = 2
+        self.file_system_service.find_project_directories.return_value = ["ABC_123"]
+        actual_runfolders = list(self.repo.get_runfolders())
+
+        self.assertEqual(self.file_system_service.find_runfolder_directories.call_count, 1)
+        self.file_system_service.find_project_directories.assert_called_with(
+            "/foo/160930_ST-E00216_0112_BH37CWALXX/Projects")
+        self.assertEqual(len(actual_runfolders[0].projects), 2)
+        self.assertEqual(len(actual_runfolders[1].projects), 1)
+
+    def test_picks_up_new_runfolders(self):
+        list(self.repo.get_runfolders())
+
+        new_runfolder = "161011_ST-E00216_0113_BH37CWALXX"
+        self.mtimes["/foo"] = 2
+        self.mtimes["/foo/{}/Projects".format(new_runfolder)] = 1
+        self.file_system_service.find_runfolder_directories.return_value = fake_directories + [new_runfolder]
+        actual_runfolders = list(self.repo.get_runfolders())
+
+        self.assertEqual([r.name for r in actual_runfolders], fake_directories + [new_runfolder])
+        self.assertEqual(self.file_system_service.find_project_directories.call_count, 3)
+
+    def test_serves_index_within_staleness_window(self):
+        repo = FileSystemBasedRunfolderRepository(base_path="/foo",
+                                                  file_system_service=self.file_system_service,
+                                                  index_max_staleness=60)
+        list(repo.get_runfolders())
+        mtime_lookups = self.file_system_service.getmtime.call_count
+        self.mtimes["/foo"] = 2
+        list(repo.get_runfolders())
+
+        self.assertEqual(self.file_system_service.getmtime.call_count, mtime_lookups)
+        self.assertEqual(self.file_system_service.find_runfolder_directories.call_count, 1)
+
+
+class TestRunfolderRepositoryAsync(AsyncTestCase):
+
+    def setUp(self):
+        file_system_service = mock_file_system_service(fake_directories,
+                                                       fake_projects)
+        self.repo = FileSystemBasedRunfolderRepository(base_path="/foo",
+                                                       file_system_service=file_system_service)
+        super(TestRunfolderRepositoryAsync, self).setUp()
+
+    @gen_test
+    def test_get_runfolders_async(self):
+        actual_runfolders = yield self.repo.get_runfolders_async()
+        self.assertListEqual(FAKE_RUNFOLDERS, actual_runfolders)
+
+    @gen_test
+    def test_get_runfolder_batches_async(self):
+        next_batch = self.repo.get_runfolder_batches_async(batch_size=1)
+
+        batches = []
+        batch = yield next_batch()
+        while batch:
+            batches.append(batch)
+            batch = yield next_batch()
+
+        self.assertListEqual(batches, [[runfolder] for runfolder in FAKE_RUNFOLDERS])
+
+    @gen_test
+    def test_get_runfolder_async(self):
+        actual_runfolder = yield self.repo.get_runfolder_async("160930_ST-E00216_0111_BH37CWALXX")
+        self.assertEqual(actual_runfolder, FAKE_RUNFOLDERS[0])
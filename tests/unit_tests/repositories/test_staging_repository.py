@@ -1,12 +1,12 @@
 
 
 import unittest
-from mock import create_autospec
+from mock import create_autospec, patch
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-from delivery.models.db_models import SQLAlchemyBase, StagingOrder, StagingStatus
+from delivery.models.db_models import SQLAlchemyBase, StagingOrder, StagingStatus, DeliveryOrder, DeliveryStatus
 from delivery.repositories.staging_repository import DatabaseBasedStagingRepository
 from delivery.services.file_system_service import FileSystemService
 
@@ -70,3 +70,165 @@ class TestStagingRepository(unittest.TestCase):
         order_from_session = self.session.query(
             StagingOrder).filter(StagingOrder.id == order.id).one()
         self.assertEqual(order_from_session.id, order.id)
+
+    # - get the queue of pending staging orders, and the position of an order in it
+    def test_get_pending_staging_orders(self):
+        order_in_progress = StagingOrder(source='bar', status=StagingStatus.staging_in_progress)
+        second_pending_order = StagingOrder(source='baz', status=StagingStatus.pending)
+        self.session.add_all([order_in_progress, second_pending_order])
+        self.session.commit()
+
+        actual = self.staging_repo.get_pending_staging_orders()
+        self.assertListEqual([order.id for order in actual], [self.staging_order_1.id, second_pending_order.id])
+
+        self.assertEqual(self.staging_repo.get_number_of_pending_staging_orders_before(self.staging_order_1), 0)
+        self.assertEqual(self.staging_repo.get_number_of_pending_staging_orders_before(second_pending_order), 1)
+
+    # - put pending staging orders of a higher priority first in the queue
+    def test_get_pending_staging_orders_by_priority(self):
+        urgent_order = StagingOrder(source='bar', status=StagingStatus.pending, priority=10)
+        low_priority_order = StagingOrder(source='baz', status=StagingStatus.pending, priority=-1)
+        self.session.add_all([urgent_order, low_priority_order])
+        self.session.commit()
+
+        actual = self.staging_repo.get_pending_staging_orders()
+        self.assertListEqual([order.id for order in actual],
+                             [urgent_order.id, self.staging_order_1.id, low_priority_order.id])
+        self.assertEqual(self.staging_repo.get_number_of_pending_staging_orders_before(urgent_order), 0)
+        self.assertEqual(self.staging_repo.get_number_of_pending_staging_orders_before(low_priority_order), 2)
+
+    # - raise the priority of a pending staging order when it is requested again with a higher priority
+    def test_get_or_create_staging_orders_with_priority(self):
+        actual = self.staging_repo.get_or_create_staging_orders(sources=['foo', '/bar'],
+                                                                staging_target_dir='/foo/target',
+                                                                priority=5)
+        (foo_order, _), (bar_order, _) = actual
+        self.assertEqual(foo_order.priority, 5)
+        self.assertEqual(bar_order.priority, 5)
+        self.assertIsNotNone(bar_order.queued_at)
+
+        foo_order, created = self.staging_repo.get_or_create_staging_order(source='foo',
+                                                                           staging_target_dir='/foo/target',
+                                                                           priority=1)
+        self.assertFalse(created)
+        self.assertEqual(foo_order.priority, 5)
+
+    # - get, and lock, the staging orders in progress
+    def test_get_staging_orders_in_progress(self):
+        order_in_progress = StagingOrder(source='bar', status=StagingStatus.staging_in_progress)
+        order_being_verified = StagingOrder(source='baz', status=StagingStatus.staging_verifying)
+        self.session.add_all([order_in_progress, order_being_verified])
+        self.session.commit()
+
+        actual = self.staging_repo.get_staging_orders_in_progress(lock=True)
+        self.assertListEqual([order.id for order in actual], [order_in_progress.id, order_being_verified.id])
+        self.assertListEqual([order.status for order in actual],
+                             [StagingStatus.staging_in_progress, StagingStatus.staging_verifying])
+        self.staging_repo.session.commit()
+
+    # - get the staging orders whose staged files can be evicted, least recently used first
+    def test_get_evictable_staging_orders(self):
+        orders = [StagingOrder(source='a', status=StagingStatus.staging_successful, staging_target='t', last_used_at=2),
+                  StagingOrder(source='b', status=StagingStatus.staging_failed, staging_target='t', last_used_at=1),
+                  StagingOrder(source='c', status=StagingStatus.staging_successful, staging_target='t'),
+                  StagingOrder(source='d', status=StagingStatus.staging_successful, staging_target='t', last_used_at=0),
+                  StagingOrder(source='e', status=StagingStatus.staging_successful, staging_target='t', last_used_at=0),
+                  StagingOrder(source='f', status=StagingStatus.evicted, staging_target='t', last_used_at=0)]
+        self.session.add_all(orders)
+        self.session.commit()
+        self.session.add_all([DeliveryOrder(delivery_source='d', delivery_project='x', staging_order_id=orders[3].id,
+                                            delivery_status=DeliveryStatus.delivery_in_progress),
+                              DeliveryOrder(delivery_source='e', delivery_project='x', staging_order_id=orders[4].id,
+                                            delivery_status=DeliveryStatus.delivery_successful)])
+        self.session.commit()
+
+        actual = self.staging_repo.get_evictable_staging_orders()
+        self.assertListEqual([order.source for order in actual], ['c', 'e', 'b', 'a'])
+
+    # - mark a staging order as evicted, unless it has started being delivered
+    def test_mark_staging_order_evicted(self):
+        orders = [StagingOrder(source='a', status=StagingStatus.staging_successful, staging_target='t'),
+                  StagingOrder(source='b', status=StagingStatus.staging_successful, staging_target='t')]
+        self.session.add_all(orders)
+        self.session.commit()
+        self.session.add(DeliveryOrder(delivery_source='b', delivery_project='x', staging_order_id=orders[1].id,
+                                       delivery_status=DeliveryStatus.pending))
+        self.session.commit()
+
+        evicted = self.staging_repo.mark_staging_order_evicted(orders[0].id)
+        self.assertEqual(evicted.status, StagingStatus.evicted)
+        self.assertIsNotNone(evicted.evicted_at)
+        self.assertIsNone(self.staging_repo.mark_staging_order_evicted(orders[1].id))
+        self.assertIsNone(self.staging_repo.mark_staging_order_evicted(orders[0].id))
+        self.assertEqual(self.staging_repo.get_staging_order_by_id(orders[1].id).status,
+                         StagingStatus.staging_successful)
+
+    # - record and get the files which did not match the source when a staging was verified
+    def test_verification_mismatches(self):
+        self.staging_repo.add_verification_mismatches(self.staging_order_1.id,
+                                                      [('foo/b', 'abc', None), ('foo/a', 'abc', 'def')])
+        self.staging_repo.session.commit()
+
+        actual = self.staging_repo.get_verification_mismatches(self.staging_order_1.id)
+        self.assertListEqual([(m.path, m.source_md5sum, m.staged_md5sum) for m in actual],
+                             [('foo/a', 'abc', 'def'), ('foo/b', 'abc', None)])
+        self.assertListEqual(self.staging_repo.get_verification_mismatches(self.staging_order_1.id + 1), [])
+
+    # - get the latest successful staging order of a source with a given fingerprint
+    def test_get_reusable_staging_order(self):
+        orders = [StagingOrder(source='bar', status=StagingStatus.staging_successful, source_fingerprint='abc'),
+                  StagingOrder(source='bar', status=StagingStatus.staging_successful, source_fingerprint='abc'),
+                  StagingOrder(source='bar', status=StagingStatus.staging_failed, source_fingerprint='abc'),
+                  StagingOrder(source='bar', status=StagingStatus.staging_successful, source_fingerprint='def')]
+        self.session.add_all(orders)
+        self.session.commit()
+
+        actual = self.staging_repo.get_reusable_staging_order('bar', 'abc')
+        self.assertEqual(actual.id, orders[1].id)
+        self.assertIsNone(self.staging_repo.get_reusable_staging_order('foo', 'abc'))
+
+    # - get or create the staging orders of many sources, in a single transaction
+    def test_get_or_create_staging_orders(self):
+        with patch.object(self.staging_repo.session, 'commit', wraps=self.staging_repo.session.commit) as commit:
+            actual = self.staging_repo.get_or_create_staging_orders(sources=['/bar', 'foo', '/baz', '/bar'],
+                                                                    staging_target_dir='/foo/target')
+        commit.assert_called_once_with()
+
+        self.assertListEqual([created for _, created in actual], [True, False, True, True])
+        bar_order, foo_order, baz_order, same_bar_order = [order for order, _ in actual]
+        self.assertEqual(foo_order.id, self.staging_order_1.id)
+        self.assertIs(same_bar_order, bar_order)
+        self.assertNotEqual(bar_order.id, baz_order.id)
+        self.assertEqual(baz_order.staging_target, '/foo/target/{}_foo'.format(baz_order.id))
+        self.assertEqual(len(self.session.query(StagingOrder).all()), 3)
+
+        self.assertListEqual(self.staging_repo.get_or_create_staging_orders(sources=[],
+                                                                            staging_target_dir='/foo/target'), [])
+
+    # - get the pending or in progress staging order of a source, or create a new one if there is none
+    def test_get_or_create_staging_order(self):
+        self.staging_order_1.status = StagingStatus.staging_in_progress
+        self.session.commit()
+
+        order, created = self.staging_repo.get_or_create_staging_order(source='foo', staging_target_dir='/foo/target')
+        self.assertFalse(created)
+        self.assertEqual(order.id, self.staging_order_1.id)
+
+        order, created = self.staging_repo.get_or_create_staging_order(source='/bar', staging_target_dir='/foo/target')
+        self.assertTrue(created)
+        self.assertEqual(order.status, StagingStatus.pending)
+        self.assertEqual(order.staging_target, '/foo/target/{}_foo'.format(order.id))
+
+        same_order, created = self.staging_repo.get_or_create_staging_order(source='/bar',
+                                                                            staging_target_dir='/foo/target')
+        self.assertFalse(created)
+        self.assertEqual(same_order.id, order.id)
+        self.assertEqual(len(self.staging_repo.session.dirty), 0)
+
+        # Once staged, the source is staged again
+        order.status = StagingStatus.staging_successful
+        self.staging_repo.session.commit()
+        new_order, created = self.staging_repo.get_or_create_staging_order(source='/bar',
+                                                                           staging_target_dir='/foo/target')
+        self.assertTrue(created)
+        self.assertNotEqual(new_order.id, order.id)
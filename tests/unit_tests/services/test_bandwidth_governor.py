@@ -0,0 +1,72 @@
+import unittest
+
+import mock
+
+from delivery.services.bandwidth_governor import BandwidthGovernor
+
+
+class TestBandwidthGovernor(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch('delivery.services.bandwidth_governor.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # - Split the limits evenly between the transfers sharing them
+    def test_fair_share(self):
+        governor = BandwidthGovernor(limit=1000, limits_per_target={'/a': 300})
+        governor.transfer_started(1, '/a')
+        governor.transfer_started(2, '/b')
+        governor.transfer_started(3, '/a')
+
+        self.assertEqual(governor.get_number_of_transfers(), 3)
+        self.assertEqual(governor.fair_share(1), 150)
+        self.assertEqual(governor.fair_share(2), 333)
+
+        governor.transfer_finished(3)
+        self.assertEqual(governor.fair_share(1), 300)
+
+        governor.set_limits()
+        self.assertIsNone(governor.fair_share(1))
+
+    # - Make transfers wait for bandwidth once they have used up the burst
+    def test_reserve(self):
+        governor = BandwidthGovernor(limit=1000, limits_per_target={'/a': 500})
+        governor.transfer_started(1, '/a')
+        governor.transfer_started(2, '/b')
+
+        self.assertEqual(governor.reserve(2, 800), 0)
+        # The global bucket has 200 bytes left
+        self.assertAlmostEqual(governor.reserve(2, 400), 0.2)
+        # Transfers into /a take from both buckets, and wait for the one furthest in debt
+        self.assertAlmostEqual(governor.reserve(1, 600), 0.8)
+        self.assertAlmostEqual(governor.reserve(1, 300), 1.1)
+
+        # Both buckets refill as time passes
+        self.now += 1
+        self.assertAlmostEqual(governor.reserve(2, 0), 0.1)
+        self.assertAlmostEqual(governor.reserve(1, 0), 0.1)
+
+    # - Change the limits at runtime, applying them straight away
+    def test_set_limits(self):
+        governor = BandwidthGovernor(limit=1000)
+        governor.transfer_started(1, '/a')
+        self.assertAlmostEqual(governor.reserve(1, 2000), 1)
+
+        governor.set_limits(limit=2000, limits_per_target={'/a': 4000})
+        self.assertTupleEqual(governor.get_limits(), (2000, {'/a': 4000}))
+        self.now += 1
+        # The debt of 1000 bytes is paid off at the new rate
+        self.assertAlmostEqual(governor.reserve(1, 1000), 0)
+
+        governor.set_limits(limits_per_target={'/a': 4000})
+        # The target bucket has 3000 bytes left
+        self.assertAlmostEqual(governor.reserve(1, 10000), 1.75)
+
+        for invalid_limit in [0, -1, 1.5, '1000', True]:
+            with self.assertRaises(ValueError):
+                governor.set_limits(limit=invalid_limit)
+        with self.assertRaises(ValueError):
+            governor.set_limits(limits_per_target={'/a': 0})
+        self.assertTupleEqual(governor.get_limits(), (None, {'/a': 4000}))
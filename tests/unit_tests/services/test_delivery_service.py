@@ -81,6 +81,39 @@ class TestMoverDeliveryService(AsyncTestCase):
         assert_eventually_equals(self, 1, _get_delivery_order, DeliveryStatus.delivery_in_progress)
         self.mock_mover_runner.run.assert_called_once_with(['/foo/bar/to_outbox', '/foo', 'TestProj'])
 
+    @gen_test
+    def test_deliver_by_staging_id_with_md5sum_file_from_staging(self):
+        staging_order = StagingOrder(source='/foo/bar', staging_target='/staging/dir/bar',
+                                     md5sum_file='/staging/dir/bar/bar.md5')
+        staging_order.status = StagingStatus.staging_successful
+        self.mock_staging_service.get_stage_order_by_id.return_value = staging_order
+        self.delivery_order.md5sum_file = '/staging/dir/bar/bar.md5'
+
+        yield self.mover_delivery_service.deliver_by_staging_id(staging_id=1, delivery_project='xyz123')
+
+        self.assertEqual(self.mock_delivery_repo.create_delivery_order.call_args[1]['md5sum_file'],
+                         '/staging/dir/bar/bar.md5')
+        self.mock_mover_runner.run.assert_called_once_with(['/foo/bar/to_outbox', '/foo', 'TestProj',
+                                                            '/staging/dir/bar/bar.md5'])
+
+    @gen_test
+    def test_deliver_by_staging_id_raises_if_evicted_while_creating_delivery_order(self):
+        staging_order = StagingOrder(source='/foo/bar', staging_target='/staging/dir/bar')
+        staging_order.status = StagingStatus.staging_successful
+        self.mock_staging_service.get_stage_order_by_id.return_value = staging_order
+
+        def evict_and_create_delivery_order(**kwargs):
+            staging_order.status = StagingStatus.evicted
+            return self.delivery_order
+
+        self.mock_delivery_repo.create_delivery_order.side_effect = evict_and_create_delivery_order
+
+        with self.assertRaises(InvalidStatusException):
+            yield self.mover_delivery_service.deliver_by_staging_id(staging_id=1, delivery_project='xyz123')
+
+        self.assertEqual(self.delivery_order.delivery_status, DeliveryStatus.delivery_failed)
+        self.mock_mover_runner.run.assert_not_called()
+
     @gen_test
     def test_update_delivery_status(self):
         delivery_order = DeliveryOrder(mover_delivery_id="TestCase_31-ngi2016001-1484739218 ",
@@ -0,0 +1,32 @@
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from delivery.services.external_program_service import ExternalProgramService
+
+
+class TestExternalProgramService(AsyncTestCase):
+
+    @gen_test
+    def test_run_and_wait(self):
+        execution_result = yield ExternalProgramService.run_and_wait(['sh', '-c', 'echo foo; echo bar >&2; exit 3'])
+        self.assertEqual(execution_result.stdout, 'foo\n')
+        self.assertEqual(execution_result.stderr, 'bar\n')
+        self.assertEqual(execution_result.status_code, 3)
+
+    @gen_test
+    def test_wait_for_execution_following_output(self):
+        followed_lines = []
+
+        def output_callback(line):
+            followed_lines.append(line)
+            return line.startswith('progress')
+
+        execution = ExternalProgramService.run(['sh', '-c', 'printf "progress 1\\rprogress 2\\rdone\\nstats"; '
+                                                            'echo error >&2'],
+                                               follow_output=True)
+        execution_result = yield ExternalProgramService.wait_for_execution(execution, output_callback=output_callback)
+
+        self.assertListEqual(followed_lines, ['progress 1', 'progress 2', 'done', 'stats'])
+        self.assertEqual(execution_result.stdout, 'done\nstats')
+        self.assertEqual(execution_result.stderr, 'error\n')
+        self.assertEqual(execution_result.status_code, 0)
@@ -0,0 +1,163 @@
+import errno
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import mock
+from tornado.testing import AsyncTestCase, gen_test
+
+from delivery.exceptions import FileSystemTimeoutException
+from delivery.services.file_system_service import FileSystemService, FileSystemExecutor
+
+
+class TestFileSystemService(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        for directory in ["a", "b", "c"]:
+            os.mkdir(os.path.join(self.base_path, directory))
+        open(os.path.join(self.base_path, "file"), "w").close()
+        os.symlink(os.path.join(self.base_path, "a"), os.path.join(self.base_path, "link_to_a"))
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def test_list_directories(self):
+        actual = sorted(FileSystemService.list_directories(self.base_path))
+        expected = [os.path.join(self.base_path, d) for d in ["a", "b", "c", "link_to_a"]]
+        self.assertListEqual(actual, expected)
+
+    def test_list_directories_returns_absolute_paths(self):
+        current_dir = os.getcwd()
+        try:
+            os.chdir(self.base_path)
+            actual = sorted(FileSystemService.list_directories("."))
+        finally:
+            os.chdir(current_dir)
+        self.assertTrue(all(os.path.isabs(path) for path in actual))
+
+    def test_scan_directories(self):
+        entries = list(FileSystemService.scan_directories(self.base_path))
+        self.assertListEqual(sorted(entry.name for entry in entries), ["a", "b", "c", "link_to_a"])
+        for entry in entries:
+            self.assertEqual(entry.stat().st_mtime, os.stat(entry.path).st_mtime)
+
+    def test_scan_directories_in_batches(self):
+        batches = list(FileSystemService.scan_directories(self.base_path, batch_size=3))
+        self.assertListEqual([len(batch) for batch in batches], [3, 1])
+
+    def test_size_and_file_count(self):
+        with open(os.path.join(self.base_path, "a", "file_in_a"), "w") as f:
+            f.write("12345")
+        with open(os.path.join(self.base_path, "b", "file_in_b"), "w") as f:
+            f.write("123")
+
+        # The linked directory should only be counted once
+        os.symlink(os.path.join(self.base_path, "a"), os.path.join(self.base_path, "b", "another_link_to_a"))
+
+        self.assertEqual(FileSystemService.size_and_file_count(self.base_path), (13, 4))
+        self.assertEqual(FileSystemService.size_and_file_count(os.path.join(self.base_path, "b", "file_in_b")),
+                         (3, 1))
+
+    def test_device_of(self):
+        self.assertEqual(FileSystemService.device_of(os.path.join(self.base_path, "a")),
+                         os.stat(self.base_path).st_dev)
+
+    def test_link_tree(self):
+        with open(os.path.join(self.base_path, "a", "file_in_a"), "w") as f:
+            f.write("12345")
+        os.symlink(os.path.join(self.base_path, "a"), os.path.join(self.base_path, "b", "another_link_to_a"))
+        target = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, target)
+        target = os.path.join(target, "linked")
+
+        size = FileSystemService.link_tree(self.base_path, target, FileSystemService.hardlink)
+
+        # The symlinks to a should be followed, but only the first one found is recreated
+        self.assertEqual(size, 10)
+        self.assertListEqual(sorted(os.listdir(target)), ["a", "b", "c", "file", "link_to_a"])
+        self.assertListEqual(os.listdir(os.path.join(target, "b")), [])
+        self.assertEqual(os.stat(os.path.join(target, "link_to_a", "file_in_a")).st_ino,
+                         os.stat(os.path.join(self.base_path, "a", "file_in_a")).st_ino)
+
+    def test_link_tree_cleans_up_on_failure(self):
+        def fail_to_link(source, target):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+        target = os.path.join(tempfile.mkdtemp(), "linked")
+        self.addCleanup(shutil.rmtree, os.path.dirname(target))
+        with self.assertRaises(OSError):
+            FileSystemService.link_tree(self.base_path, target, fail_to_link)
+        self.assertFalse(os.path.exists(target))
+
+    def test_link_tree_of_file_falls_back_to_hardlink(self):
+        source = os.path.join(self.base_path, "a", "file_in_a")
+        with open(source, "w") as f:
+            f.write("12345")
+        target = os.path.join(tempfile.mkdtemp(), "linked")
+        self.addCleanup(shutil.rmtree, os.path.dirname(target))
+
+        with mock.patch("delivery.services.file_system_service.fcntl.ioctl",
+                        side_effect=OSError(errno.EOPNOTSUPP, "Operation not supported")):
+            with self.assertRaises(OSError):
+                FileSystemService.link_tree(source, target, FileSystemService.reflink)
+        self.assertFalse(os.path.exists(target))
+
+        self.assertEqual(FileSystemService.link_tree(source, target, FileSystemService.hardlink), 5)
+        self.assertEqual(os.stat(target).st_ino, os.stat(source).st_ino)
+
+    def test_fingerprint(self):
+        file_in_a = os.path.join(self.base_path, "a", "file_in_a")
+        with open(file_in_a, "w") as f:
+            f.write("12345")
+
+        fingerprint = FileSystemService.fingerprint(self.base_path)
+        self.assertEqual(FileSystemService.fingerprint(self.base_path), fingerprint)
+
+        # Modifying, adding or removing anything changes the fingerprint
+        fingerprints = {fingerprint}
+        with open(file_in_a, "a") as f:
+            f.write("6")
+        fingerprints.add(FileSystemService.fingerprint(self.base_path))
+        os.utime(file_in_a, (0, 0))
+        fingerprints.add(FileSystemService.fingerprint(self.base_path))
+        os.mkdir(os.path.join(self.base_path, "d"))
+        fingerprints.add(FileSystemService.fingerprint(self.base_path))
+        os.remove(os.path.join(self.base_path, "file"))
+        fingerprints.add(FileSystemService.fingerprint(self.base_path))
+        self.assertEqual(len(fingerprints), 5)
+
+        self.assertNotEqual(FileSystemService.fingerprint(file_in_a), FileSystemService.fingerprint(self.base_path))
+
+    def test_md5sum(self):
+        file_in_a = os.path.join(self.base_path, "a", "file_in_a")
+        with open(file_in_a, "w") as f:
+            f.write("12345")
+
+        self.assertEqual(FileSystemService.md5sum(file_in_a), "827ccb0eea8a706c4c34a16891f84e7b")
+        self.assertEqual(FileSystemService.md5sum(file_in_a, buffer_size=2), "827ccb0eea8a706c4c34a16891f84e7b")
+
+    def test_list_directories_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            list(FileSystemService.list_directories(os.path.join(self.base_path, "does_not_exist")))
+
+
+class TestFileSystemExecutor(AsyncTestCase):
+
+    @gen_test
+    def test_run(self):
+        executor = FileSystemExecutor(max_workers=2)
+        result = yield executor.run(os.path.join, "/foo", "bar")
+        self.assertEqual(result, "/foo/bar")
+
+    @gen_test
+    def test_run_times_out(self):
+        executor = FileSystemExecutor(max_workers=1, timeout=0.1)
+        release = threading.Event()
+        try:
+            with self.assertRaises(FileSystemTimeoutException):
+                yield executor.run(release.wait)
+        finally:
+            release.set()
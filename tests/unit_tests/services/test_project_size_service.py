@@ -0,0 +1,105 @@
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock
+
+from delivery.models.db_models import DirectorySize
+from delivery.models.project import GeneralProject, RunfolderProject
+from delivery.models.runfolder import Runfolder
+from delivery.services.project_size_service import ProjectSizeService
+
+
+class TestProjectSizeService(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+
+        runfolder_path = os.path.join(self.base_path, "160930_ST-E00216_0111_BH37CWALXX")
+        self.runfolder_project_path = os.path.join(runfolder_path, "Projects", "ABC_123")
+        os.makedirs(os.path.join(self.runfolder_project_path, "Sample_1"))
+        with open(os.path.join(self.runfolder_project_path, "Sample_1", "file.fastq.gz"), "w") as f:
+            f.write("1234567890")
+
+        self.general_project_path = os.path.join(self.base_path, "general", "XYZ_789")
+        os.makedirs(self.general_project_path)
+        with open(os.path.join(self.general_project_path, "file"), "w") as f:
+            f.write("12345")
+
+        runfolder = Runfolder(name="160930_ST-E00216_0111_BH37CWALXX",
+                              path=runfolder_path,
+                              projects=[RunfolderProject(name="ABC_123",
+                                                         path=self.runfolder_project_path,
+                                                         runfolder_path=runfolder_path)])
+        self.runfolder_repo = MagicMock()
+        self.runfolder_repo.get_runfolders.side_effect = lambda: iter([runfolder])
+
+        self.general_project_repo = MagicMock()
+        self.general_project_repo.get_projects.side_effect = lambda: iter(
+            [GeneralProject(name="XYZ_789", path=self.general_project_path)])
+
+        self.stored_sizes = {}
+
+        def store_directory_sizes(directory_sizes):
+            for path, size, file_count, mtime in directory_sizes:
+                self.stored_sizes[path] = DirectorySize(path=path, size=size, file_count=file_count, mtime=mtime)
+
+        self.directory_size_repo = MagicMock()
+        self.directory_size_repo.get_directory_sizes.side_effect = lambda paths=None: {
+            path: directory_size for path, directory_size in self.stored_sizes.items()
+            if paths is None or path in paths}
+        self.directory_size_repo.get_directory_size.side_effect = lambda path: self.stored_sizes.get(path)
+        self.directory_size_repo.store_directory_sizes.side_effect = store_directory_sizes
+
+        self.project_size_service = ProjectSizeService(runfolder_repo=self.runfolder_repo,
+                                                       general_project_repo=self.general_project_repo,
+                                                       directory_size_repo=self.directory_size_repo,
+                                                       scan_workers=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def test_scan(self):
+        self.assertEqual(self.project_size_service.scan(), 2)
+        self.assertEqual(self.project_size_service.get_size(self.runfolder_project_path), (10, 1))
+        self.assertEqual(self.project_size_service.get_size(self.general_project_path), (5, 1))
+
+    def test_scan_only_scans_modified_projects(self):
+        self.project_size_service.scan()
+        self.assertEqual(self.project_size_service.scan(), 0)
+
+        # Adding a file to a sample directory should make the project stale. The mtime is bumped
+        # explicitly, since the file system might not have a fine enough timestamp resolution.
+        sample_dir = os.path.join(self.runfolder_project_path, "Sample_1")
+        with open(os.path.join(sample_dir, "another_file.fastq.gz"), "w") as f:
+            f.write("123")
+        os.utime(sample_dir, (os.stat(sample_dir).st_atime, os.stat(sample_dir).st_mtime + 10))
+
+        self.assertIsNone(self.project_size_service.get_size(self.runfolder_project_path))
+        self.assertEqual(self.project_size_service.scan(), 1)
+        self.assertEqual(self.project_size_service.get_size(self.runfolder_project_path), (13, 2))
+
+    def test_get_size_not_scanned(self):
+        self.assertIsNone(self.project_size_service.get_size(self.general_project_path))
+
+    def test_projects_with_sizes(self):
+        self.project_size_service.scan()
+        with open(os.path.join(self.runfolder_project_path, "another_file.fastq.gz"), "w") as f:
+            f.write("123")
+        os.utime(self.runfolder_project_path, (0, os.stat(self.runfolder_project_path).st_mtime + 10))
+
+        projects = [GeneralProject(name="XYZ_789", path=self.general_project_path),
+                    RunfolderProject(name="ABC_123", path=self.runfolder_project_path),
+                    GeneralProject(name="not_scanned", path="/foo/not_scanned")]
+        self.directory_size_repo.get_directory_sizes.reset_mock()
+        projects_with_sizes = self.project_size_service.projects_with_sizes(projects)
+
+        self.assertListEqual([(project.size, project.file_count) for project in projects_with_sizes],
+                             [(5, 1), (None, None), (None, None)])
+        # The projects are copied, rather than changed
+        self.assertIsNone(projects[0].size)
+        self.assertListEqual(projects_with_sizes, projects)
+        # Only the sizes of the projects are looked up
+        self.directory_size_repo.get_directory_sizes.assert_called_once_with([project.path for project in projects])
@@ -0,0 +1,51 @@
+
+import unittest
+
+from mock import MagicMock
+
+from delivery.services.runfolder_catalog_sync_service import RunfolderCatalogSyncService
+
+from tests.test_utils import FAKE_RUNFOLDERS
+
+
+class TestRunfolderCatalogSyncService(unittest.TestCase):
+
+    def setUp(self):
+        self.runfolders = {runfolder.name: runfolder for runfolder in FAKE_RUNFOLDERS}
+        self.projects_mtimes = {runfolder.name: 1.0 for runfolder in FAKE_RUNFOLDERS}
+
+        self.runfolder_repo = MagicMock()
+        self.runfolder_repo.get_runfolder_names.side_effect = lambda: sorted(self.runfolders)
+        self.runfolder_repo.get_projects_modification_time.side_effect = lambda name: self.projects_mtimes[name]
+        self.runfolder_repo.get_runfolder.side_effect = lambda name: self.runfolders.get(name)
+
+        self.catalog_repo = MagicMock()
+
+        self.sync_service = RunfolderCatalogSyncService(runfolder_repo=self.runfolder_repo,
+                                                        catalog_repo=self.catalog_repo)
+
+    def test_sync_empty_catalog(self):
+        self.catalog_repo.get_projects_modification_times.return_value = {}
+
+        self.assertEqual(self.sync_service.sync(), (2, 0))
+        self.catalog_repo.update_catalog.assert_called_once_with([(FAKE_RUNFOLDERS[0], 1.0),
+                                                                  (FAKE_RUNFOLDERS[1], 1.0)],
+                                                                 set())
+
+    def test_sync_unchanged(self):
+        self.catalog_repo.get_projects_modification_times.return_value = dict(self.projects_mtimes)
+
+        self.assertEqual(self.sync_service.sync(), (0, 0))
+        self.runfolder_repo.get_runfolder.assert_not_called()
+        self.catalog_repo.update_catalog.assert_not_called()
+
+    def test_sync_only_applies_changes(self):
+        catalogued = dict(self.projects_mtimes)
+        catalogued["160101_ST-E00216_0001_AH37CWALXX"] = 1.0
+        self.catalog_repo.get_projects_modification_times.return_value = catalogued
+        self.projects_mtimes["160930_ST-E00216_0112_BH37CWALXX"] = 2.0
+
+        self.assertEqual(self.sync_service.sync(), (1, 1))
+        self.runfolder_repo.get_runfolder.assert_called_once_with("160930_ST-E00216_0112_BH37CWALXX")
+        self.catalog_repo.update_catalog.assert_called_once_with([(FAKE_RUNFOLDERS[1], 2.0)],
+                                                                 {"160101_ST-E00216_0001_AH37CWALXX"})
@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from delivery.models.db_models import SQLAlchemyBase, StagingOrder, StagingStatus, StagingMode, DeliveryOrder, \
+    DeliveryStatus
+from delivery.repositories.staging_repository import DatabaseBasedStagingRepository
+from delivery.services.file_system_service import FileSystemService
+from delivery.services.staging_eviction_service import StagingEvictionService
+
+
+class TestStagingEvictionService(unittest.TestCase):
+
+    def setUp(self):
+        self.staging_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.staging_dir)
+
+        engine = create_engine('sqlite:///:memory:', echo=False)
+        SQLAlchemyBase.metadata.create_all(engine)
+        session_factory = sessionmaker()
+        session_factory.configure(bind=engine)
+        self.session = session_factory()
+
+        self.staging_repo = DatabaseBasedStagingRepository(lambda: self.session)
+
+        # The staging directory has room for 100 bytes, and each staged file takes up its size
+        self.file_system_service = FileSystemService()
+        self.file_system_service.free_space = lambda path: 100 - sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(self.staging_dir) for name in names)
+
+        self.eviction_service = StagingEvictionService(staging_repo=self.staging_repo,
+                                                       session_factory=lambda: self.session,
+                                                       staging_dir=self.staging_dir,
+                                                       file_system_service=self.file_system_service)
+
+    def _staged_order(self, size, last_used_at, status=StagingStatus.staging_successful,
+                      staging_mode=StagingMode.copy):
+        order = StagingOrder(source='/foo/ABC_123', status=status, staging_mode=staging_mode, size=size,
+                             last_used_at=last_used_at)
+        self.session.add(order)
+        self.session.flush()
+        order.staging_target = os.path.join(self.staging_dir, '{}_ABC_123'.format(order.id))
+        os.makedirs(order.get_staging_path())
+        with open(os.path.join(order.get_staging_path(), 'file'), 'w') as f:
+            f.write('a' * size)
+        self.session.commit()
+        return order
+
+    # - Evict the least recently used stagings until the target free space is reached
+    def test_evict_when_short_of_space(self):
+        newest = self._staged_order(size=30, last_used_at=3)
+        oldest = self._staged_order(size=20, last_used_at=1)
+        older = self._staged_order(size=20, last_used_at=2)
+        self.eviction_service.free_space_watermark = 40
+        self.eviction_service.free_space_target = 60
+
+        evicted = self.eviction_service.evict()
+
+        self.assertListEqual([order.id for order in evicted], [oldest.id, older.id])
+        self.assertEqual(oldest.status, StagingStatus.evicted)
+        self.assertIsNotNone(oldest.evicted_at)
+        self.assertFalse(os.path.exists(oldest.staging_target))
+        self.assertFalse(os.path.exists(older.staging_target))
+        self.assertEqual(newest.status, StagingStatus.staging_successful)
+        self.assertTrue(os.path.exists(newest.staging_target))
+
+    # - Not evict anything while there is enough free space
+    def test_no_eviction_above_watermark(self):
+        order = self._staged_order(size=30, last_used_at=1)
+        self.eviction_service.free_space_watermark = 50
+
+        self.assertListEqual(self.eviction_service.evict(), [])
+        self.assertEqual(order.status, StagingStatus.staging_successful)
+
+    # - Never evict stagings which are being delivered, or which are linked
+    def test_not_evicting_stagings_being_delivered_or_linked(self):
+        delivered = self._staged_order(size=30, last_used_at=1)
+        linked = self._staged_order(size=30, last_used_at=2, staging_mode=StagingMode.hardlink)
+        self.session.add(DeliveryOrder(delivery_source=delivered.get_staging_path(), delivery_project='x',
+                                       staging_order_id=delivered.id,
+                                       delivery_status=DeliveryStatus.mover_processing_delivery))
+        self.session.commit()
+        self.eviction_service.free_space_watermark = 90
+
+        self.assertListEqual(self.eviction_service.evict(), [])
+        self.assertTrue(os.path.exists(delivered.staging_target))
+        self.assertTrue(os.path.exists(linked.staging_target))
+
+    # - Skip linked stagings when short of space, and evict the more recently used copied ones instead
+    def test_evict_copied_stagings_after_linked_ones_when_short_of_space(self):
+        linked = self._staged_order(size=10, last_used_at=1, staging_mode=StagingMode.hardlink)
+        copied = self._staged_order(size=90, last_used_at=2)
+        self.assertEqual(self.file_system_service.free_space(self.staging_dir), 0)
+        self.eviction_service.free_space_watermark = 10
+        self.eviction_service.free_space_target = 50
+
+        evicted = self.eviction_service.evict()
+
+        self.assertListEqual([order.id for order in evicted], [copied.id])
+        self.assertFalse(os.path.exists(copied.staging_target))
+        self.assertEqual(linked.status, StagingStatus.staging_successful)
+        self.assertTrue(os.path.exists(linked.staging_target))
+
+    # - Evict stagings which have not been used for too long, regardless of the free space
+    def test_evict_old_stagings(self):
+        old = self._staged_order(size=10, last_used_at=time.time() - 100)
+        never_used = self._staged_order(size=10, last_used_at=None)
+        recent = self._staged_order(size=10, last_used_at=time.time())
+        failed = self._staged_order(size=10, last_used_at=time.time() - 200, status=StagingStatus.staging_failed)
+        self.eviction_service.max_age = 50
+
+        evicted = self.eviction_service.evict()
+
+        self.assertListEqual([order.id for order in evicted], [failed.id, old.id])
+        self.assertEqual(never_used.status, StagingStatus.staging_successful)
+        self.assertEqual(recent.status, StagingStatus.staging_successful)
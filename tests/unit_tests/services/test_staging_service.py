@@ -1,18 +1,32 @@
+import errno
+import os
+import shutil
 import mock
 import signal
 import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 
+from tornado.concurrent import Future
 from tornado.testing import AsyncTestCase
+from tornado import gen
 from tornado.gen import coroutine
 import tornado.testing
 
 from delivery.exceptions import InvalidStatusException, RunfolderNotFoundException, ProjectNotFoundException
-from delivery.services.staging_service import StagingService
+from delivery.services.staging_service import StagingService, _is_staging_process_alive
 from delivery.services.external_program_service import ExternalProgramService
-from delivery.models.db_models import StagingOrder, StagingStatus
+from delivery.services.file_system_service import FileSystemService
+from delivery.services.transfer_engines import NativeTransferEngine
+from delivery.models.transfer_result import TransferResult
+from delivery.models.db_models import StagingOrder, StagingStatus, StagingMode
 from delivery.models.execution import Execution, ExecutionResult
+from delivery.models.staging_progress import StagingProgress
 from delivery.models.project import GeneralProject
-from tests.test_utils import FAKE_RUNFOLDERS, assert_eventually_equals, MockIOLoop
+from tests.test_utils import FAKE_RUNFOLDERS, assert_eventually_equals, MockIOLoop, future_with_result
 
 
 class TestStagingService(AsyncTestCase):
@@ -25,16 +39,52 @@ class TestStagingService(AsyncTestCase):
         def get_staging_order_by_id(self, identifier, custom_session=None):
             return list(filter(lambda x: x.id == identifier, self.orders_state))[0]
 
-        def create_staging_order(self, source, status, staging_target_dir):
+        def get_pending_staging_orders(self):
+            return sorted(filter(lambda x: x.status == StagingStatus.pending, self.orders_state),
+                          key=lambda x: (-(x.priority or 0), x.id))
+
+        def get_staging_orders_in_progress(self, lock=False, custom_session=None):
+            return list(filter(lambda x: x.status in (StagingStatus.staging_in_progress,
+                                                      StagingStatus.staging_verifying), self.orders_state))
+
+        def get_reusable_staging_order(self, source, source_fingerprint, custom_session=None):
+            matching = list(filter(lambda x: x.source == source and
+                                   x.source_fingerprint == source_fingerprint and
+                                   x.status == StagingStatus.staging_successful, self.orders_state))
+            return matching[-1] if matching else None
+
+        def add_verification_mismatches(self, staging_order_id, mismatches, custom_session=None):
+            self.verification_mismatches = mismatches
+
+        def get_number_of_pending_staging_orders_before(self, staging_order):
+            return self.get_pending_staging_orders().index(staging_order)
+
+        def get_or_create_staging_order(self, source, staging_target_dir, priority=0):
+            active_orders = list(filter(lambda x: x.source == source and
+                                        x.status in (StagingStatus.pending, StagingStatus.staging_in_progress),
+                                        self.orders_state))
+            if active_orders:
+                return active_orders[0], False
+            return self.create_staging_order(source, StagingStatus.pending, staging_target_dir, priority), True
+
+        def get_or_create_staging_orders(self, sources, staging_target_dir, priority=0):
+            self.nbr_of_bulk_creations = getattr(self, 'nbr_of_bulk_creations', 0) + 1
+            return [self.get_or_create_staging_order(source, staging_target_dir, priority) for source in sources]
+
+        def create_staging_order(self, source, status, staging_target_dir, priority=0):
 
             order = StagingOrder(id=len(self.orders_state) + 1,
                                  source=source,
                                  status=status,
-                                 staging_target=staging_target_dir)
+                                 staging_target=staging_target_dir,
+                                 priority=priority,
+                                 queued_at=time.time())
             self.orders_state.append(order)
             return order
 
     def setUp(self):
+        self.unfinished_executions = []
+
         self.staging_order1 = StagingOrder(id=1,
                                            source='/test/this',
                                            staging_target='/foo',
@@ -68,13 +118,15 @@ class TestStagingService(AsyncTestCase):
         self.mock_external_runner_service.run.return_value = mock_execution
 
         @coroutine
-        def wait_as_coroutine(x):
+        def wait_as_coroutine(x, output_callback=None):
             return ExecutionResult(stdout=stdout_mimicing_rsync, stderr="", status_code=0)
 
         self.mock_external_runner_service.wait_for_execution = wait_as_coroutine
         mock_staging_repo = mock.MagicMock()
         mock_staging_repo.get_staging_order_by_id.return_value = self.staging_order1
         mock_staging_repo.create_staging_order.return_value = self.staging_order1
+        mock_staging_repo.get_pending_staging_orders.side_effect = \
+            lambda: [self.staging_order1] if self.staging_order1.status == StagingStatus.pending else []
 
         self.mock_runfolder_repo = mock.MagicMock()
 
@@ -89,6 +141,25 @@ class TestStagingService(AsyncTestCase):
         self.staging_service.io_loop_factory = MockIOLoop
         super(TestStagingService, self).setUp()
 
+    def tearDown(self):
+        # Let any stagings which are still in progress finish, rather than have them be interrupted at exit
+        @coroutine
+        def finish_unfinished_executions():
+            while self.staging_service._stagings_in_progress:
+                for execution_future in self.unfinished_executions:
+                    if not execution_future.done():
+                        execution_future.set_result(ExecutionResult(stdout="", stderr="", status_code=1))
+                yield gen.sleep(0.01)
+
+        if self.unfinished_executions:
+            self.io_loop.run_sync(finish_unfinished_executions, timeout=5)
+        super(TestStagingService, self).tearDown()
+
+    def _wait_until_test_is_done(self, execution, output_callback=None):
+        execution_future = Future()
+        self.unfinished_executions.append(execution_future)
+        return execution_future
+
     # A StagingService should be able to:
     # - Stage a staging order
     @tornado.testing.gen_test
@@ -108,7 +179,7 @@ class TestStagingService(AsyncTestCase):
     @tornado.testing.gen_test
     def test_unsuccessful_staging_order(self):
         @coroutine
-        def wait_as_coroutine(x):
+        def wait_as_coroutine(x, output_callback=None):
             return ExecutionResult(stdout="", stderr="", status_code=1)
 
         self.mock_external_runner_service.wait_for_execution = wait_as_coroutine
@@ -123,7 +194,7 @@ class TestStagingService(AsyncTestCase):
     # - Set status to failed if there is an exception is not successful
     def test_exception_in_staging_order(self):
 
-        def raise_exception(x):
+        def raise_exception(x, output_callback=None):
             raise Exception
         self.mock_external_runner_service.wait_for_execution = raise_exception
         self.staging_service.stage_order(stage_order=self.staging_order1)
@@ -144,15 +215,16 @@ class TestStagingService(AsyncTestCase):
             res = yield self.staging_service.stage_order(stage_order=staging_order_in_progress)
 
     # - Be able to stage a existing runfolder
+    @tornado.testing.gen_test
     def test_stage_runfolder(self):
         runfolder1 = FAKE_RUNFOLDERS[0]
 
-        self.mock_runfolder_repo.get_runfolder.return_value = runfolder1
+        self.mock_runfolder_repo.get_runfolder_async.return_value = future_with_result(runfolder1)
         mock_staging_repo = self.MockStagingRepo()
 
         self.staging_service.staging_repo = mock_staging_repo
 
-        result = self.staging_service.stage_runfolder(
+        result = yield self.staging_service.stage_runfolder(
             runfolder_id=runfolder1.name, projects_to_stage=[])
 
         expected = {'DEF_456': 2, 'ABC_123': 1}
@@ -160,14 +232,767 @@ class TestStagingService(AsyncTestCase):
 
         # - Reject stating a runfolder if the given projects is not available
         with self.assertRaises(ProjectNotFoundException):
-            self.staging_service.stage_runfolder(runfolder_id='foo_runfolder', projects_to_stage=['foo'])
+            yield self.staging_service.stage_runfolder(runfolder_id='foo_runfolder', projects_to_stage=['foo'])
+
+    # - Stage projects from many runfolders, and general projects, at once
+    @tornado.testing.gen_test
+    def test_stage_in_bulk(self):
+        runfolders = {runfolder.name: runfolder for runfolder in FAKE_RUNFOLDERS}
+        self.mock_runfolder_repo.get_runfolder_async.side_effect = lambda name: future_with_result(runfolders[name])
+        self.mock_general_project_repo.get_project.return_value = GeneralProject(name='foo', path='/bar/foo')
+        mock_staging_repo = self.MockStagingRepo()
+        self.staging_service.staging_repo = mock_staging_repo
+
+        runfolder_ids, project_ids = yield self.staging_service.stage_in_bulk(
+            runfolders_and_projects={FAKE_RUNFOLDERS[0].name: ['DEF_456'], FAKE_RUNFOLDERS[1].name: []},
+            general_projects=['foo'])
+
+        self.assertEqual(mock_staging_repo.nbr_of_bulk_creations, 1)
+        self.assertEqual(len(mock_staging_repo.orders_state), 4)
+        self.assertListEqual(sorted(runfolder_ids), sorted(runfolders))
+        self.assertListEqual(list(runfolder_ids[FAKE_RUNFOLDERS[0].name]), ['DEF_456'])
+        self.assertEqual(len(runfolder_ids[FAKE_RUNFOLDERS[1].name]), 2)
+        self.assertDictEqual(project_ids, {'foo': 4})
+        staged_sources = sorted(order.source for order in mock_staging_repo.orders_state)
+        self.assertEqual(len(set(staged_sources)), 4)
+
+    # - Stage nothing if any of the runfolders or projects can not be found
+    @tornado.testing.gen_test
+    def test_stage_in_bulk_with_missing_runfolder(self):
+        self.mock_runfolder_repo.get_runfolder_async.side_effect = \
+            lambda name: future_with_result(FAKE_RUNFOLDERS[0] if name == FAKE_RUNFOLDERS[0].name else None)
+        mock_staging_repo = self.MockStagingRepo()
+        self.staging_service.staging_repo = mock_staging_repo
+
+        with self.assertRaises(RunfolderNotFoundException):
+            yield self.staging_service.stage_in_bulk(runfolders_and_projects={FAKE_RUNFOLDERS[0].name: [],
+                                                                              'missing_runfolder': []})
+
+        self.assertListEqual(mock_staging_repo.orders_state, [])
 
     # - Reject staging a runfolder which does not exist runfolder
+    @tornado.testing.gen_test
     def test_stage_runfolder_does_not_exist(self):
         with self.assertRaises(RunfolderNotFoundException):
 
-            self.mock_runfolder_repo.get_runfolder.return_value = None
-            self.staging_service.stage_runfolder(runfolder_id='foo_runfolder', projects_to_stage=[])
+            self.mock_runfolder_repo.get_runfolder_async.return_value = future_with_result(None)
+            yield self.staging_service.stage_runfolder(runfolder_id='foo_runfolder', projects_to_stage=[])
+
+    # - Follow the progress of a staging, and store it in the database
+    def test_stage_order_progress(self):
+        def wait_for_execution(execution, output_callback=None):
+            output_callback('    1,238,099,968  45%  118.07MB/s    0:00:10 (xfr#5, to-chk=3/10)')
+            output_callback('    2,000,000,000  73%  120.00MB/s    0:00:06')
+            return self._wait_until_test_is_done(execution)
+
+        self.mock_external_runner_service.wait_for_execution = wait_for_execution
+        self.staging_service.progress_update_interval = 0
+
+        self.staging_service.stage_order(stage_order=self.staging_order1)
+
+        progress = self.staging_service.get_progress_of_stage_order(self.staging_order1)
+        self.assertDictEqual(progress.__dict__, {'bytes_transferred': 2000000000,
+                                                 'files_transferred': 5,
+                                                 'bytes_per_second': 120 * 1024 ** 2,
+                                                 'eta_seconds': 6,
+                                                 'percent_done': 73.0})
+        self.assertEqual(self.staging_order1.bytes_transferred, 2000000000)
+        self.assertEqual(self.staging_order1.files_transferred, 5)
+
+    # - Not run more stagings at the same time than allowed, and start queued ones as others finish
+    def test_stage_orders_with_concurrency_limit(self):
+        executions = {}
+
+        def run(cmd, follow_output=False):
+            execution = Execution(pid=len(executions) + 1, process_obj=mock.MagicMock())
+            executions[execution.pid] = self._wait_until_test_is_done(execution)
+            return execution
+
+        self.mock_external_runner_service.run.side_effect = run
+        self.mock_external_runner_service.wait_for_execution = \
+            lambda execution, output_callback=None: executions[execution.pid]
+
+        mock_staging_repo = self.MockStagingRepo()
+        for source in ['/foo/a', '/foo/b', '/foo/c']:
+            mock_staging_repo.create_staging_order(source=source,
+                                                   status=StagingStatus.pending,
+                                                   staging_target_dir='/staging/{}'.format(source))
+        self.staging_service.staging_repo = mock_staging_repo
+        self.staging_service.max_concurrent_stagings = 2
+
+        self.staging_service.dispatch_pending_staging_orders()
+
+        orders = mock_staging_repo.orders_state
+        self.assertListEqual([order.status for order in orders],
+                             [StagingStatus.staging_in_progress,
+                              StagingStatus.staging_in_progress,
+                              StagingStatus.pending])
+        self.assertEqual(self.staging_service.get_queue_position(orders[2]), 1)
+        self.assertIsNone(self.staging_service.get_queue_position(orders[0]))
+
+        executions[1].set_result(ExecutionResult(stdout="", stderr="", status_code=1))
+
+        @coroutine
+        def wait_until_first_order_is_done():
+            while orders[0].status == StagingStatus.staging_in_progress:
+                yield gen.sleep(0.01)
+
+        self.io_loop.run_sync(wait_until_first_order_is_done)
+
+        self.assertListEqual([order.status for order in orders],
+                             [StagingStatus.staging_failed,
+                              StagingStatus.staging_in_progress,
+                              StagingStatus.staging_in_progress])
+
+    # - Start orders of a higher priority first, and raise the priority of orders which have waited for long
+    def test_stage_orders_by_priority_with_aging(self):
+        self.mock_external_runner_service.wait_for_execution = self._wait_until_test_is_done
+
+        mock_staging_repo = self.MockStagingRepo()
+        for source, priority in [('/foo/a', 0), ('/foo/b', 0), ('/foo/c', 2)]:
+            mock_staging_repo.create_staging_order(source=source,
+                                                   status=StagingStatus.pending,
+                                                   staging_target_dir='/staging/{}'.format(source),
+                                                   priority=priority)
+        self.staging_service.staging_repo = mock_staging_repo
+        self.staging_service.max_concurrent_stagings = 1
+
+        self.staging_service.dispatch_pending_staging_orders()
+
+        a, b, c = mock_staging_repo.orders_state
+        self.assertListEqual([order.status for order in mock_staging_repo.orders_state],
+                             [StagingStatus.pending, StagingStatus.pending, StagingStatus.staging_in_progress])
+        self.assertEqual(self.staging_service.get_queue_position(a), 1)
+        self.assertEqual(self.staging_service.get_queue_position(b), 2)
+
+        # b has waited for three aging intervals, which puts it ahead of an order of priority 2
+        self.staging_service.priority_aging_interval = 60
+        b.queued_at = time.time() - 200
+        mock_staging_repo.create_staging_order(source='/foo/d', status=StagingStatus.pending,
+                                               staging_target_dir='/staging/foo/d', priority=2)
+        d = mock_staging_repo.orders_state[-1]
+        self.assertListEqual([self.staging_service.get_queue_position(order) for order in [a, b, d]], [3, 1, 2])
+
+    # - Pause a copy of a lower priority to make room for an order of a higher priority, and requeue it
+    def test_preempt_lower_priority_staging(self):
+        executions = {}
+
+        def run(cmd, follow_output=False):
+            execution = Execution(pid=len(executions) + 1, process_obj=mock.MagicMock())
+            executions[execution.pid] = self._wait_until_test_is_done(execution)
+            return execution
+
+        def cancel(staging_order):
+            executions[staging_order.pid].set_result(ExecutionResult(stdout="", stderr="", status_code=20))
+
+        self.mock_external_runner_service.run.side_effect = run
+        self.mock_external_runner_service.wait_for_execution = \
+            lambda execution, output_callback=None: executions[execution.pid]
+        self.staging_service.transfer_engine.cancel = cancel
+
+        mock_staging_repo = self.MockStagingRepo()
+        low_priority_order = mock_staging_repo.create_staging_order(source='/foo/a', status=StagingStatus.pending,
+                                                                    staging_target_dir='/staging/foo/a')
+        self.staging_service.staging_repo = mock_staging_repo
+        self.staging_service.max_concurrent_stagings = 1
+        self.staging_service.preempt_lower_priority_stagings = True
+
+        self.staging_service.dispatch_pending_staging_orders()
+        self.assertEqual(low_priority_order.status, StagingStatus.staging_in_progress)
+
+        # An order of the same priority waits for its turn
+        same_priority_order = mock_staging_repo.create_staging_order(source='/foo/b', status=StagingStatus.pending,
+                                                                     staging_target_dir='/staging/foo/b')
+        self.staging_service.dispatch_pending_staging_orders()
+        self.assertFalse(executions[1].done())
+
+        high_priority_order = mock_staging_repo.create_staging_order(source='/foo/c', status=StagingStatus.pending,
+                                                                     staging_target_dir='/staging/foo/c',
+                                                                     priority=5)
+        self.staging_service.dispatch_pending_staging_orders()
+
+        @coroutine
+        def wait_until_high_priority_order_is_started():
+            while high_priority_order.status != StagingStatus.staging_in_progress:
+                yield gen.sleep(0.01)
+
+        self.io_loop.run_sync(wait_until_high_priority_order_is_started)
+
+        self.assertEqual(low_priority_order.status, StagingStatus.pending)
+        self.assertIsNone(low_priority_order.pid)
+        self.assertEqual(same_priority_order.status, StagingStatus.pending)
+        self.assertEqual(self.staging_service.get_queue_position(low_priority_order), 1)
+
+    # - Pause a copy of a lower priority even if the transfer engine does not report the pids of its processes
+    def test_preempt_lower_priority_staging_without_pids(self):
+        transfers = {}
+
+        def transfer(staging_order, progress_callback=None, started_callback=None):
+            transfers[staging_order.id] = Future()
+            started_callback([])
+            return transfers[staging_order.id]
+
+        def cancel(staging_order):
+            transfers[staging_order.id].set_result(TransferResult(successful=False, message='Cancelled'))
+
+        self.staging_service.transfer_engine = mock.MagicMock()
+        self.staging_service.transfer_engine.transfer.side_effect = transfer
+        self.staging_service.transfer_engine.cancel.side_effect = cancel
+
+        mock_staging_repo = self.MockStagingRepo()
+        low_priority_order = mock_staging_repo.create_staging_order(source='/foo/a', status=StagingStatus.pending,
+                                                                    staging_target_dir='/staging/foo/a')
+        self.staging_service.staging_repo = mock_staging_repo
+        self.staging_service.max_concurrent_stagings = 1
+        self.staging_service.preempt_lower_priority_stagings = True
+
+        self.staging_service.dispatch_pending_staging_orders()
+        self.assertEqual(low_priority_order.status, StagingStatus.staging_in_progress)
+        self.assertIsNone(low_priority_order.pid)
+
+        high_priority_order = mock_staging_repo.create_staging_order(source='/foo/c', status=StagingStatus.pending,
+                                                                     staging_target_dir='/staging/foo/c',
+                                                                     priority=5)
+        self.staging_service.dispatch_pending_staging_orders()
+
+        @coroutine
+        def wait_until_high_priority_order_is_started():
+            while high_priority_order.status != StagingStatus.staging_in_progress:
+                yield gen.sleep(0.01)
+
+        self.io_loop.run_sync(wait_until_high_priority_order_is_started)
+
+        self.staging_service.transfer_engine.cancel.assert_called_once_with(low_priority_order)
+        self.assertEqual(low_priority_order.status, StagingStatus.pending)
+
+    def test_stage_orders_with_concurrency_limit_per_target(self):
+        self.mock_external_runner_service.wait_for_execution = self._wait_until_test_is_done
+
+        mock_staging_repo = self.MockStagingRepo()
+        for staging_target in ['/staging/a/1_foo', '/staging/a/2_foo', '/staging/b/3_foo']:
+            order = mock_staging_repo.create_staging_order(source='/foo',
+                                                           status=StagingStatus.pending,
+                                                           staging_target_dir=None)
+            order.staging_target = staging_target
+        self.staging_service.staging_repo = mock_staging_repo
+        self.staging_service.max_concurrent_stagings_per_target = 1
+
+        self.staging_service.dispatch_pending_staging_orders()
+
+        self.assertListEqual([order.status for order in mock_staging_repo.orders_state],
+                             [StagingStatus.staging_in_progress,
+                              StagingStatus.pending,
+                              StagingStatus.staging_in_progress])
+
+    def _queue_orders_on_devices(self, sources_and_targets):
+        self.mock_external_runner_service.wait_for_execution = self._wait_until_test_is_done
+
+        # The device of a path is its top directory
+        mock_file_system_service = mock.MagicMock()
+        mock_file_system_service.device_of.side_effect = lambda path: path.split('/')[1]
+        self.staging_service.file_system_service = mock_file_system_service
+
+        mock_staging_repo = self.MockStagingRepo()
+        for source, staging_target in sources_and_targets:
+            order = mock_staging_repo.create_staging_order(source=source,
+                                                           status=StagingStatus.pending,
+                                                           staging_target_dir=None)
+            order.staging_target = staging_target
+        self.staging_service.staging_repo = mock_staging_repo
+        return mock_staging_repo.orders_state
+
+    # - Not run more stagings at the same time than allowed on the same device
+    def test_stage_orders_with_concurrency_limit_per_device(self):
+        orders = self._queue_orders_on_devices([('/a/1', '/x/1_1'), ('/a/2', '/y/2_2'), ('/b/3', '/z/3_3')])
+        self.staging_service.max_concurrent_stagings_per_device = 1
+
+        self.staging_service.dispatch_pending_staging_orders()
+
+        self.assertListEqual([order.status for order in orders],
+                             [StagingStatus.staging_in_progress,
+                              StagingStatus.pending,
+                              StagingStatus.staging_in_progress])
+
+    # - Start orders in turns from different devices
+    def test_stage_orders_interleaved_by_device(self):
+        orders = self._queue_orders_on_devices([('/a/1', '/x/1_1'), ('/a/2', '/x/2_2'), ('/b/3', '/x/3_3')])
+        self.staging_service.max_concurrent_stagings = 2
+        self.staging_service.max_concurrent_stagings_per_device = 10
+
+        self.staging_service.dispatch_pending_staging_orders()
+
+        self.assertListEqual([order.status for order in orders],
+                             [StagingStatus.staging_in_progress,
+                              StagingStatus.pending,
+                              StagingStatus.staging_in_progress])
+
+    def _queue_orders_of_sizes(self, sources_and_sizes, free_space):
+        orders = self._queue_orders_on_devices([(source, '/x/{}_{}'.format(i, source.split('/')[-1]))
+                                                for i, (source, _) in enumerate(sources_and_sizes)])
+        sizes = dict(sources_and_sizes)
+        self.staging_service.file_system_service.size_and_file_count.side_effect = lambda path: (sizes[path], 1)
+        self.staging_service.file_system_service.free_space.return_value = free_space
+        return orders
+
+    def _dispatch_until_sized(self, orders):
+        self.staging_service.dispatch_pending_staging_orders()
+
+        @coroutine
+        def wait_until_sized():
+            while self.staging_service._sizing_pending_orders:
+                yield gen.sleep(0.01)
+
+        self.io_loop.run_sync(wait_until_sized)
+
+    # - Only start orders which fit in the free space of the staging directory
+    def test_stage_orders_with_free_space_limit(self):
+        orders = self._queue_orders_of_sizes([('/a/1', 50), ('/a/2', 60), ('/a/3', 30)], free_space=100)
+        self.staging_service.min_free_space = 10
+
+        self.staging_service.dispatch_pending_staging_orders()
+        # Nothing is started until the sizes of the sources are known
+        self.assertListEqual([order.status for order in orders], [StagingStatus.pending] * 3)
+
+        self._dispatch_until_sized(orders)
+
+        self.assertListEqual([order.status for order in orders],
+                             [StagingStatus.staging_in_progress,
+                              StagingStatus.pending,
+                              StagingStatus.staging_in_progress])
+
+        # Space which has already been copied to is no longer reserved
+        self.staging_service.file_system_service.free_space.return_value = 60
+        self.staging_service._progress_of_stagings[orders[0].id] = StagingProgress(bytes_transferred=20)
+        self.staging_service._progress_of_stagings[orders[2].id] = StagingProgress(bytes_transferred=20)
+        self.staging_service.dispatch_pending_staging_orders()
+        self.assertEqual(orders[1].status, StagingStatus.pending)
+
+        self.staging_service.file_system_service.free_space.return_value = 110
+        self.staging_service.dispatch_pending_staging_orders()
+        self.assertEqual(orders[1].status, StagingStatus.staging_in_progress)
+
+    def _stage_with_zero_copy_modes(self, zero_copy_staging_modes, sidecar_checksum=None):
+        source_dir = tempfile.mkdtemp()
+        staging_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source_dir)
+        self.addCleanup(shutil.rmtree, staging_dir)
+
+        project_dir = os.path.join(source_dir, 'ABC_123')
+        os.makedirs(os.path.join(project_dir, 'Sample_1'))
+        with open(os.path.join(project_dir, 'Sample_1', 'file.fastq.gz'), 'w') as f:
+            f.write('12345')
+        if sidecar_checksum:
+            with open(os.path.join(project_dir, 'Sample_1', 'file.fastq.gz.md5'), 'w') as f:
+                f.write('{}  file.fastq.gz\n'.format(sidecar_checksum))
+
+        mock_staging_repo = self.MockStagingRepo()
+        stage_order = mock_staging_repo.create_staging_order(source=project_dir,
+                                                             status=StagingStatus.pending,
+                                                             staging_target_dir=None)
+        stage_order.staging_target = os.path.join(staging_dir, '1_ABC_123')
+        self.staging_service.staging_repo = mock_staging_repo
+        self.staging_service.zero_copy_staging_modes = zero_copy_staging_modes
+
+        self.staging_service.dispatch_pending_staging_orders()
+        return stage_order
+
+    # - Stage by hardlinking files when possible
+    @tornado.testing.gen_test
+    def test_stage_order_with_hardlinks(self):
+        stage_order = self._stage_with_zero_copy_modes([StagingMode.hardlink])
+
+        while stage_order.status == StagingStatus.staging_in_progress:
+            yield gen.sleep(0.01)
+
+        self.assertEqual(stage_order.status, StagingStatus.staging_successful)
+        self.assertEqual(stage_order.staging_mode, StagingMode.hardlink)
+        self.assertEqual(stage_order.size, 5)
+        staged_file = os.path.join(stage_order.get_staging_path(), 'Sample_1', 'file.fastq.gz')
+        self.assertEqual(os.stat(staged_file).st_ino,
+                         os.stat(os.path.join(stage_order.source, 'Sample_1', 'file.fastq.gz')).st_ino)
+        self.mock_external_runner_service.run.assert_not_called()
+
+    def _stage_again(self, modify_source=False):
+        source_dir = tempfile.mkdtemp()
+        staging_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source_dir)
+        self.addCleanup(shutil.rmtree, staging_dir)
+
+        project_dir = os.path.join(source_dir, 'ABC_123')
+        os.makedirs(os.path.join(project_dir, 'Sample_1'))
+        with open(os.path.join(project_dir, 'Sample_1', 'file.fastq.gz'), 'w') as f:
+            f.write('12345')
+
+        mock_staging_repo = self.MockStagingRepo()
+        prior_order = mock_staging_repo.create_staging_order(source=project_dir,
+                                                             status=StagingStatus.staging_successful,
+                                                             staging_target_dir=os.path.join(staging_dir, '1_ABC_123'))
+        prior_order.size = 5
+        prior_order.source_fingerprint = FileSystemService.fingerprint(project_dir)
+        shutil.copytree(project_dir, prior_order.get_staging_path())
+
+        if modify_source:
+            with open(os.path.join(project_dir, 'Sample_1', 'file.fastq.gz'), 'a') as f:
+                f.write('6')
+
+        stage_order = mock_staging_repo.create_staging_order(source=project_dir,
+                                                             status=StagingStatus.pending,
+                                                             staging_target_dir=os.path.join(staging_dir, '2_ABC_123'))
+        self.staging_service.staging_repo = mock_staging_repo
+        self.staging_service.reuse_prior_stagings = True
+
+        self.staging_service.dispatch_pending_staging_orders()
+        return prior_order, stage_order
+
+    # - Link the files of an earlier staging of the same source, if the source has not changed since
+    @tornado.testing.gen_test
+    def test_stage_order_reusing_prior_staging(self):
+        prior_order, stage_order = self._stage_again()
+
+        # The fingerprint of the source is stored once the staging is successful
+        while stage_order.id in self.staging_service._stagings_in_progress:
+            yield gen.sleep(0.01)
+
+        self.assertEqual(stage_order.status, StagingStatus.staging_successful)
+        self.assertEqual(stage_order.staging_mode, StagingMode.hardlink)
+        self.assertEqual(stage_order.reused_staging_order_id, prior_order.id)
+        self.assertEqual(stage_order.size, 5)
+        self.assertIsNotNone(stage_order.last_used_at)
+        self.assertIsNotNone(prior_order.last_used_at)
+        self.assertEqual(stage_order.source_fingerprint, prior_order.source_fingerprint)
+        self.assertEqual(os.stat(os.path.join(stage_order.get_staging_path(), 'Sample_1', 'file.fastq.gz')).st_ino,
+                         os.stat(os.path.join(prior_order.get_staging_path(), 'Sample_1', 'file.fastq.gz')).st_ino)
+        self.mock_external_runner_service.run.assert_not_called()
+
+    # - Stage the source again if it has changed
+    @tornado.testing.gen_test
+    def test_stage_order_not_reusing_prior_staging_of_changed_source(self):
+        prior_order, stage_order = self._stage_again(modify_source=True)
+
+        # The fingerprint of the source is stored once the staging is successful
+        while stage_order.id in self.staging_service._stagings_in_progress:
+            yield gen.sleep(0.01)
+
+        self.assertEqual(stage_order.status, StagingStatus.staging_successful)
+        self.assertEqual(stage_order.staging_mode, StagingMode.copy)
+        self.assertIsNone(stage_order.reused_staging_order_id)
+        self.assertEqual(stage_order.source_fingerprint, FileSystemService.fingerprint(stage_order.source))
+        self.assertNotEqual(stage_order.source_fingerprint, prior_order.source_fingerprint)
+        self.mock_external_runner_service.run.assert_called_once_with(mock.ANY, follow_output=True)
+
+    # - Copy the files if they can not be linked
+    @tornado.testing.gen_test
+    def test_stage_order_falls_back_to_copying(self):
+        mock_file_system_service = mock.create_autospec(FileSystemService)
+        mock_file_system_service.device_of.return_value = 1
+        mock_file_system_service.link_tree.side_effect = OSError(errno.EOPNOTSUPP, 'Operation not supported')
+        mock_file_system_service.isdir.return_value = False
+        mock_file_system_service.isfile.return_value = False
+        self.staging_service.file_system_service = mock_file_system_service
+
+        stage_order = self._stage_with_zero_copy_modes([StagingMode.reflink, StagingMode.hardlink])
+
+        while stage_order.status == StagingStatus.staging_in_progress:
+            yield gen.sleep(0.01)
+
+        self.assertEqual(mock_file_system_service.link_tree.call_count, 2)
+        self.assertEqual(stage_order.status, StagingStatus.staging_successful)
+        self.assertEqual(stage_order.staging_mode, StagingMode.copy)
+        self.mock_external_runner_service.run.assert_called_once_with(
+            ['rsync', '--stats', '--info=progress2', '-r', '--copy-links', '--times', '--partial-dir=.rsync-partial',
+             stage_order.source, stage_order.staging_target],
+            follow_output=True)
+
+    def _write_md5sum_files(self):
+        self.staging_service.md5sum_files = True
+        self.staging_service._checksum_executor = ProcessPoolExecutor(max_workers=2)
+        self.addCleanup(self.staging_service._checksum_executor.shutdown)
+
+    # - Write an md5sum manifest of linked files, by hashing the staged files
+    @tornado.testing.gen_test
+    def test_stage_order_with_md5sum_file(self):
+        self._write_md5sum_files()
+        stage_order = self._stage_with_zero_copy_modes([StagingMode.hardlink])
+
+        while stage_order.status == StagingStatus.staging_in_progress:
+            yield gen.sleep(0.01)
+
+        self.assertEqual(stage_order.status, StagingStatus.staging_successful)
+        self.assertEqual(stage_order.md5sum_file, stage_order.get_staging_path() + '.md5')
+        with open(stage_order.md5sum_file) as f:
+            self.assertEqual(f.read(), '827ccb0eea8a706c4c34a16891f84e7b  Sample_1/file.fastq.gz\n')
+
+    # - Use the checksums computed by the transfer engine while copying
+    @tornado.testing.gen_test
+    def test_stage_order_with_md5sum_file_from_transfer_engine(self):
+        self._write_md5sum_files()
+        self.staging_service.transfer_engine = NativeTransferEngine(workers=1, compute_checksums=True)
+        with mock.patch.object(FileSystemService, 'md5sum') as mock_md5sum:
+            stage_order = self._stage_with_zero_copy_modes([])
+
+            while stage_order.status == StagingStatus.staging_in_progress:
+                yield gen.sleep(0.01)
+
+            mock_md5sum.assert_not_called()
+
+        self.assertEqual(stage_order.status, StagingStatus.staging_successful)
+        self.assertEqual(stage_order.staging_mode, StagingMode.copy)
+        with open(stage_order.md5sum_file) as f:
+            self.assertEqual(f.read(), '827ccb0eea8a706c4c34a16891f84e7b  Sample_1/file.fastq.gz\n')
+
+    # - Copy the manifest of a reused staging
+    @tornado.testing.gen_test
+    def test_stage_order_reusing_md5sum_file_of_prior_staging(self):
+        self._write_md5sum_files()
+        prior_order, stage_order = self._stage_again()
+        prior_order.md5sum_file = prior_order.get_staging_path() + '.md5'
+        with open(prior_order.md5sum_file, 'w') as f:
+            f.write('prior manifest\n')
+
+        while stage_order.status == StagingStatus.staging_in_progress:
+            yield gen.sleep(0.01)
+
+        self.assertEqual(stage_order.reused_staging_order_id, prior_order.id)
+        with open(stage_order.md5sum_file) as f:
+            self.assertEqual(f.read(), 'prior manifest\n')
+
+    def _stage_and_verify(self, corrupt=None, sidecar_checksum=None):
+        self.staging_service.verify_stagings = True
+        self.staging_service._checksum_executor = ProcessPoolExecutor(max_workers=2)
+        self.addCleanup(self.staging_service._checksum_executor.shutdown)
+
+        native_engine = NativeTransferEngine(workers=1)
+        original_transfer = native_engine.transfer
+
+        @coroutine
+        def transfer(staging_order, progress_callback=None, started_callback=None):
+            result = yield original_transfer(staging_order, progress_callback, started_callback)
+            if corrupt:
+                with open(os.path.join(staging_order.get_staging_path(), corrupt), 'w') as f:
+                    f.write('54321')
+            return result
+
+        native_engine.transfer = transfer
+        self.staging_service.transfer_engine = native_engine
+
+        stage_order = self._stage_with_zero_copy_modes([], sidecar_checksum=sidecar_checksum)
+        return stage_order
+
+    @coroutine
+    def _wait_until_verified(self, stage_order):
+        statuses = []
+        while stage_order.status in (StagingStatus.staging_in_progress, StagingStatus.staging_verifying):
+            statuses.append(stage_order.status)
+            yield gen.sleep(0.001)
+        return statuses
+
+    # - Check the staged files against the source before the staging is successful
+    @tornado.testing.gen_test
+    def test_stage_order_with_verification(self):
+        stage_order = self._stage_and_verify()
+
+        statuses = yield self._wait_until_verified(stage_order)
+
+        self.assertIn(StagingStatus.staging_verifying, statuses)
+        self.assertEqual(stage_order.status, StagingStatus.staging_successful)
+
+    # - Fail the staging and record the files which do not match
+    @tornado.testing.gen_test
+    def test_stage_order_with_failed_verification(self):
+        stage_order = self._stage_and_verify(corrupt=os.path.join('Sample_1', 'file.fastq.gz'))
+
+        yield self._wait_until_verified(stage_order)
+
+        self.assertEqual(stage_order.status, StagingStatus.staging_failed)
+        self.assertListEqual(self.staging_service.staging_repo.verification_mismatches,
+                             [(os.path.join('ABC_123', 'Sample_1', 'file.fastq.gz'),
+                               '827ccb0eea8a706c4c34a16891f84e7b',
+                               '01cfcd4f6b8770febfb40cb906715822')])
+
+    # - Use the checksum of an md5 sidecar rather than reading the source file again
+    @tornado.testing.gen_test
+    def test_stage_order_with_verification_using_sidecar(self):
+        stage_order = self._stage_and_verify(sidecar_checksum='01cfcd4f6b8770febfb40cb906715822')
+
+        yield self._wait_until_verified(stage_order)
+
+        # The sidecar does not match the source file, which shows that the source file was not read
+        self.assertEqual(stage_order.status, StagingStatus.staging_failed)
+        self.assertListEqual([mismatch[0] for mismatch in self.staging_service.staging_repo.verification_mismatches],
+                             [os.path.join('ABC_123', 'Sample_1', 'file.fastq.gz')])
+
+    def _stage_in_shards(self, wait_for_execution):
+        source_dir = tempfile.mkdtemp()
+        staging_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source_dir)
+        self.addCleanup(shutil.rmtree, staging_dir)
+
+        project_dir = os.path.join(source_dir, 'ABC_123')
+        os.makedirs(os.path.join(project_dir, 'Sample_1'))
+        os.makedirs(os.path.join(project_dir, 'Empty'))
+        for file_name, size in [('big.fastq.gz', 30), ('medium.fastq.gz', 20), ('small.fastq.gz', 10)]:
+            with open(os.path.join(project_dir, 'Sample_1', file_name), 'w') as f:
+                f.write('a' * size)
+
+        file_lists = []
+
+        def run(cmd, follow_output=False):
+            files_from = [arg for arg in cmd if arg.startswith('--files-from=')][0].split('=', 1)[1]
+            with open(files_from) as f:
+                file_lists.append(sorted(f.read().split('\0')))
+            return Execution(pid=100000 + len(file_lists), process_obj=mock.MagicMock())
+
+        self.mock_external_runner_service.run.side_effect = run
+        self.mock_external_runner_service.wait_for_execution = wait_for_execution
+
+        mock_staging_repo = self.MockStagingRepo()
+        stage_order = mock_staging_repo.create_staging_order(source=project_dir,
+                                                             status=StagingStatus.pending,
+                                                             staging_target_dir=None)
+        stage_order.staging_target = os.path.join(staging_dir, '1_ABC_123')
+        os.mkdir(stage_order.staging_target)
+        self.staging_service.staging_repo = mock_staging_repo
+        self.staging_service.transfer_engine.workers = 2
+
+        self.staging_service.dispatch_pending_staging_orders()
+        return stage_order, file_lists
+
+    # - Copy a directory with several rsync processes
+    @tornado.testing.gen_test
+    def test_stage_order_in_shards(self):
+        @coroutine
+        def wait_for_execution(execution, output_callback=None):
+            return ExecutionResult(stdout='Total file size: 30 bytes', stderr='', status_code=0)
+
+        stage_order, file_lists = self._stage_in_shards(wait_for_execution)
+
+        while stage_order.status == StagingStatus.staging_in_progress:
+            yield gen.sleep(0.01)
+
+        self.assertEqual(stage_order.status, StagingStatus.staging_successful)
+        self.assertEqual(stage_order.size, 60)
+        self.assertListEqual(file_lists,
+                             [['ABC_123', 'ABC_123/Empty', 'ABC_123/Sample_1', 'ABC_123/Sample_1/big.fastq.gz'],
+                              ['ABC_123/Sample_1/medium.fastq.gz', 'ABC_123/Sample_1/small.fastq.gz']])
+        self.mock_external_runner_service.run.assert_called_with(
+            ['rsync', '--stats', '--info=progress2', '--copy-links', '--from0', mock.ANY,
+             '--times', '--partial-dir=.rsync-partial',
+             os.path.dirname(stage_order.source), stage_order.staging_target],
+            follow_output=True)
+
+    # - Fail, stop the other processes and clean up, if one of the processes fails
+    @tornado.testing.gen_test
+    def test_stage_order_in_shards_fails(self):
+        second_shard = Future()
+
+        def wait_for_execution(execution, output_callback=None):
+            if execution.pid == 100001:
+                return future_with_result(ExecutionResult(stdout='', stderr='', status_code=1))
+            return second_shard
+
+        with mock.patch('delivery.services.transfer_engines.os.kill') as mock_kill:
+            stage_order, _ = self._stage_in_shards(wait_for_execution)
+
+            while not mock_kill.called:
+                yield gen.sleep(0.01)
+            mock_kill.assert_called_once_with(100002, signal.SIGTERM)
+
+        second_shard.set_result(ExecutionResult(stdout='', stderr='', status_code=-signal.SIGTERM))
+        while stage_order.status == StagingStatus.staging_in_progress or os.path.exists(stage_order.staging_target):
+            yield gen.sleep(0.01)
+
+        self.assertEqual(stage_order.status, StagingStatus.staging_failed)
+
+    # - Requeue the stagings which were interrupted when the service was stopped, and resume copying them
+    @tornado.testing.gen_test
+    def test_recover_interrupted_staging_orders(self):
+        source_dir = tempfile.mkdtemp()
+        staging_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source_dir)
+        self.addCleanup(shutil.rmtree, staging_dir)
+
+        mock_staging_repo = self.MockStagingRepo()
+        # The second order is copied in shards, the first of which has already finished
+        for source, staging_mode, pids in [('copied', StagingMode.copy, [1001]),
+                                           ('still_copying', StagingMode.copy, [1003, 1002]),
+                                           ('linked', None, None)]:
+            os.mkdir(os.path.join(source_dir, source))
+            stage_order = mock_staging_repo.create_staging_order(source=os.path.join(source_dir, source),
+                                                                 status=StagingStatus.staging_in_progress,
+                                                                 staging_target_dir=staging_dir)
+            stage_order.staging_mode = staging_mode
+            stage_order.set_pids(pids)
+            os.makedirs(stage_order.get_staging_path())
+        copied_order, still_copying_order, linked_order = mock_staging_repo.orders_state
+        self.staging_service.staging_repo = mock_staging_repo
+        self.staging_service.file_system_service = FileSystemService()
+
+        with mock.patch('delivery.services.staging_service._is_staging_process_alive',
+                        side_effect=lambda pid: pid == 1002):
+            requeued_orders = self.staging_service.recover_interrupted_staging_orders()
+
+        self.assertListEqual(requeued_orders, [copied_order, linked_order])
+        self.assertEqual(still_copying_order.status, StagingStatus.staging_in_progress)
+        self.assertEqual(copied_order.status, StagingStatus.pending)
+        self.assertIsNone(copied_order.pid)
+        self.assertListEqual(still_copying_order.get_pids(), [1003, 1002])
+        self.assertTrue(os.path.exists(copied_order.get_staging_path()))
+        self.assertFalse(os.path.exists(linked_order.get_staging_path()))
+
+        self.staging_service.dispatch_pending_staging_orders()
+        while copied_order.status == StagingStatus.staging_in_progress or \
+                linked_order.status == StagingStatus.staging_in_progress:
+            yield gen.sleep(0.01)
+
+        self.assertEqual(copied_order.status, StagingStatus.staging_successful)
+        self.mock_external_runner_service.run.assert_any_call(
+            ['rsync', '--stats', '--info=progress2', '-r', '--copy-links', '--times', '--partial-dir=.rsync-partial',
+             '--no-whole-file', copied_order.source, staging_dir],
+            follow_output=True)
+        self.mock_external_runner_service.run.assert_any_call(
+            ['rsync', '--stats', '--info=progress2', '-r', '--copy-links', '--times', '--partial-dir=.rsync-partial',
+             linked_order.source, staging_dir],
+            follow_output=True)
+
+    def test_is_staging_process_alive(self):
+        self.assertFalse(_is_staging_process_alive(None))
+
+        finished_process = subprocess.Popen(['true'])
+        finished_process.wait()
+        self.assertFalse(_is_staging_process_alive(finished_process.pid))
+
+        other_process = subprocess.Popen(['sleep', '10'])
+        try:
+            cmdline_path = '/proc/{}/cmdline'.format(other_process.pid)
+            deadline = time.monotonic() + 5
+            while b'sleep' not in open(cmdline_path, 'rb').read() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            # The pid has been given to a process which does not stage anything
+            self.assertFalse(_is_staging_process_alive(other_process.pid))
+        finally:
+            other_process.kill()
+            other_process.wait()
+
+        running_process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(10)', 'rsync'])
+        try:
+            # A process which has not been given its cmdline yet can not be ruled out
+            with mock.patch('builtins.open', mock.mock_open(read_data=b'')):
+                self.assertTrue(_is_staging_process_alive(running_process.pid))
+
+            cmdline_path = '/proc/{}/cmdline'.format(running_process.pid)
+            deadline = time.monotonic() + 5
+            while b'rsync' not in open(cmdline_path, 'rb').read() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(_is_staging_process_alive(running_process.pid))
+        finally:
+            running_process.kill()
+            running_process.wait()
+
+        # This process is another instance of the service, as far as a process with another pid is concerned
+        this_pid = os.getpid()
+        with mock.patch('delivery.services.staging_service.os.getpid', return_value=-1):
+            self.assertTrue(_is_staging_process_alive(this_pid))
+        self.assertFalse(_is_staging_process_alive(os.getpid()))
 
     # - Stage a 'general' directory if it exists
     def test_stage_directory(self):
@@ -175,17 +1000,30 @@ class TestStagingService(AsyncTestCase):
 
         self.staging_service.staging_repo = mock_staging_repo
 
-        self.mock_general_project_repo.get_projects.return_value = [GeneralProject(name='foo', path='/bar/foo'),
-                                                                    GeneralProject(name='bar', path='/bar/foo')]
+        self.mock_general_project_repo.get_project.return_value = GeneralProject(name='foo', path='/bar/foo')
 
         expected = {'foo': 1}
         result = self.staging_service.stage_directory('foo')
         self.assertDictEqual(expected, result)
 
+    # - Use the existing staging order, rather than staging a directory again, if it is already being staged
+    def test_stage_directory_already_being_staged(self):
+        mock_staging_repo = self.MockStagingRepo()
+        self.staging_service.staging_repo = mock_staging_repo
+        self.mock_general_project_repo.get_project.return_value = GeneralProject(name='foo', path='/bar/foo')
+        self.mock_external_runner_service.wait_for_execution = self._wait_until_test_is_done
+
+        first_result = self.staging_service.stage_directory('foo')
+        second_result = self.staging_service.stage_directory('foo')
+
+        self.assertDictEqual(first_result, {'foo': 1})
+        self.assertDictEqual(second_result, {'foo': 1})
+        self.assertEqual(len(mock_staging_repo.orders_state), 1)
+
     # - Reject staging a directory that does not exist...
     def test_stage_directory_does_not_exist(self):
         with self.assertRaises(ProjectNotFoundException):
-            self.mock_general_project_repo.get_projects.return_value = []
+            self.mock_general_project_repo.get_project.return_value = None
             self.staging_service.stage_directory('foo')
 
     # - Be able to get the status of a stage order
@@ -202,7 +1040,7 @@ class TestStagingService(AsyncTestCase):
         self.assertIsNone(actual_not_there)
 
     # - Be able to kill a ongoing staging process
-    @mock.patch('delivery.services.staging_service.os')
+    @mock.patch('delivery.services.transfer_engines.os')
     def test_kill_stage_order(self, mock_os):
 
         # If the status is in progress it should be possible to kill it.
@@ -220,10 +1058,24 @@ class TestStagingService(AsyncTestCase):
         mock_os.kill.assert_called_with(self.staging_order1.pid, signal.SIGTERM)
         self.assertFalse(actual)
 
-    @mock.patch('delivery.services.staging_service.os')
+    @mock.patch('delivery.services.transfer_engines.os')
     def test_kill_stage_order_not_valid_state(self, mock_os):
         # If the status is not in progress it should not be possible to kill it.
         self.staging_order1.status = StagingStatus.staging_successful
         actual = self.staging_service.kill_process_of_staging_order(self.staging_order1.id)
         mock_os.kill.assert_not_called()
         self.assertFalse(actual)
+
+    def test_combine_progress(self):
+        progresses = [StagingProgress(bytes_transferred=10, files_transferred=1, bytes_per_second=5, eta_seconds=3),
+                      StagingProgress(bytes_transferred=30, files_transferred=2, bytes_per_second=None,
+                                      eta_seconds=8)]
+
+        combined = StagingProgress.combine(progresses, total_bytes=80)
+        self.assertDictEqual(combined.__dict__, {'bytes_transferred': 40,
+                                                 'files_transferred': 3,
+                                                 'bytes_per_second': 5,
+                                                 'eta_seconds': 8,
+                                                 'percent_done': 50.0})
+
+        self.assertIsNone(StagingProgress.combine(progresses).percent_done)
@@ -0,0 +1,244 @@
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from delivery.models.db_models import StagingOrder, StagingStatus
+from delivery.models.staging_progress import StagingProgress
+from delivery.services import transfer_engines
+from delivery.services.bandwidth_governor import BandwidthGovernor
+from delivery.services.transfer_engines import NativeTransferEngine, RsyncTransferEngine, _size_balanced_shards, \
+    _parse_rsync_progress
+
+
+class TestRsyncTransferEngine(unittest.TestCase):
+
+    def test_size_balanced_shards(self):
+        shards = _size_balanced_shards([('a', 1), ('b', 5), ('c', 3), ('d', 3)], 2)
+        self.assertListEqual(shards, [['b', 'a'], ['c', 'd']])
+
+        self.assertListEqual(_size_balanced_shards([('a', 1)], 3), [['a']])
+
+    def test_parse_rsync_progress(self):
+        previous_progress = StagingProgress(files_transferred=4, eta_seconds=20)
+
+        progress = _parse_rsync_progress('  1,238,099,968  45%  118.07MB/s    1:02:10', previous_progress)
+        self.assertDictEqual(progress.__dict__, {'bytes_transferred': 1238099968,
+                                                 'files_transferred': 4,
+                                                 'bytes_per_second': int(118.07 * 1024 ** 2),
+                                                 'eta_seconds': 3730,
+                                                 'percent_done': 45.0})
+
+        # When a file is finished the time is the time elapsed, so the estimate is kept from before
+        progress = _parse_rsync_progress('  1,238,099,968  45%  1.00kB/s    0:00:10 (xfr#5, to-chk=3/10)',
+                                         previous_progress)
+        self.assertEqual((progress.files_transferred, progress.eta_seconds, progress.bytes_per_second), (5, 20, 1024))
+
+        self.assertIsNone(_parse_rsync_progress('Total file size: 207,707,566 bytes', previous_progress))
+
+    def test_bwlimit_options(self):
+        staging_order = StagingOrder(id=1, source='/foo/ABC_123', staging_target='/staging/1_ABC_123')
+        self.assertListEqual(RsyncTransferEngine(mock.MagicMock())._bwlimit_options(staging_order), [])
+
+        governor = BandwidthGovernor(limit=20 * 1024 ** 2)
+        engine = RsyncTransferEngine(mock.MagicMock(), bandwidth_governor=governor)
+        governor.transfer_started(1, '/staging')
+        governor.transfer_started(2, '/staging')
+
+        # Each transfer gets half of the limit, split between its processes
+        self.assertListEqual(engine._bwlimit_options(staging_order), ['--bwlimit=10240'])
+        self.assertListEqual(engine._bwlimit_options(staging_order, nbr_of_processes=4), ['--bwlimit=2560'])
+
+class TestNativeTransferEngine(AsyncTestCase):
+
+    def setUp(self):
+        super(TestNativeTransferEngine, self).setUp()
+        self.source_dir = tempfile.mkdtemp()
+        self.staging_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source_dir)
+        self.addCleanup(shutil.rmtree, self.staging_dir)
+
+        self.project_dir = os.path.join(self.source_dir, 'ABC_123')
+        os.makedirs(os.path.join(self.project_dir, 'Sample_1'))
+        os.makedirs(os.path.join(self.project_dir, 'Empty'))
+        self.file_contents = {'Sample_1/big.fastq.gz': os.urandom(3 * 1024 * 1024 + 17),
+                              'Sample_1/small.fastq.gz': b'12345',
+                              'empty.txt': b''}
+        for file_name, contents in self.file_contents.items():
+            with open(os.path.join(self.project_dir, file_name), 'wb') as f:
+                f.write(contents)
+        os.chmod(os.path.join(self.project_dir, 'Sample_1', 'small.fastq.gz'), 0o640)
+        os.symlink(os.path.join(self.project_dir, 'Sample_1'), os.path.join(self.project_dir, 'link_to_sample_1'))
+
+        self.staging_order = StagingOrder(id=1, source=self.project_dir, status=StagingStatus.staging_in_progress,
+                                          staging_target=os.path.join(self.staging_dir, '1_ABC_123'))
+        self.progresses = []
+        self.started_with = []
+
+    def _transfer(self, engine, staging_order=None):
+        return engine.transfer(staging_order or self.staging_order,
+                               progress_callback=self.progresses.append,
+                               started_callback=self.started_with.append)
+
+    def _assert_copied(self, staging_path):
+        for file_name, contents in self.file_contents.items():
+            with open(os.path.join(staging_path, file_name), 'rb') as f:
+                self.assertEqual(f.read(), contents)
+            source_stat = os.stat(os.path.join(self.project_dir, file_name))
+            staged_stat = os.stat(os.path.join(staging_path, file_name))
+            self.assertEqual(staged_stat.st_mtime_ns, source_stat.st_mtime_ns)
+            self.assertEqual(staged_stat.st_mode, source_stat.st_mode)
+        self.assertTrue(os.path.isdir(os.path.join(staging_path, 'Empty')))
+        # Symlinks are followed
+        self.assertFalse(os.path.islink(os.path.join(staging_path, 'link_to_sample_1')))
+        self.assertTrue(os.path.isfile(os.path.join(staging_path, 'link_to_sample_1', 'small.fastq.gz')))
+
+    @gen_test
+    def test_transfer(self):
+        result = yield self._transfer(NativeTransferEngine(workers=2, buffer_size=1024 * 1024))
+
+        self.assertTrue(result.successful)
+        # The files in Sample_1 are copied twice, since they are also linked to
+        total_size = 2 * sum(len(contents) for name, contents in self.file_contents.items()
+                             if name.startswith('Sample_1'))
+        self.assertEqual(result.size, total_size)
+        self.assertIsNone(result.checksums)
+        self._assert_copied(self.staging_order.get_staging_path())
+        self.assertListEqual(self.started_with, [[os.getpid()]])
+        self.assertEqual(self.progresses[-1].bytes_transferred, total_size)
+        self.assertEqual(self.progresses[-1].files_transferred, 5)
+        self.assertEqual(self.progresses[-1].percent_done, 100.0)
+
+    @gen_test
+    def test_transfer_with_checksums(self):
+        result = yield self._transfer(NativeTransferEngine(buffer_size=1024 * 1024, compute_checksums=True))
+
+        self.assertTrue(result.successful)
+        self._assert_copied(self.staging_order.get_staging_path())
+        expected_checksums = {os.path.join('ABC_123', file_name): hashlib.md5(contents).hexdigest()
+                              for file_name, contents in self.file_contents.items()}
+        for file_name in ['big.fastq.gz', 'small.fastq.gz']:
+            expected_checksums[os.path.join('ABC_123', 'link_to_sample_1', file_name)] = \
+                expected_checksums[os.path.join('ABC_123', 'Sample_1', file_name)]
+        self.assertDictEqual(result.checksums, expected_checksums)
+
+    @gen_test
+    def test_transfer_file(self):
+        source = os.path.join(self.project_dir, 'Sample_1', 'small.fastq.gz')
+        staging_order = StagingOrder(id=2, source=source, status=StagingStatus.staging_in_progress,
+                                     staging_target=os.path.join(self.staging_dir, '2_small.fastq.gz'))
+
+        result = yield self._transfer(NativeTransferEngine(compute_checksums=True), staging_order)
+
+        self.assertTrue(result.successful)
+        self.assertEqual(result.size, 5)
+        self.assertDictEqual(result.checksums, {'small.fastq.gz': hashlib.md5(b'12345').hexdigest()})
+        with open(staging_order.get_staging_path(), 'rb') as f:
+            self.assertEqual(f.read(), b'12345')
+
+    @gen_test
+    def test_transfer_falls_back_to_copying_through_user_space(self):
+        def unsupported(*args):
+            raise OSError(transfer_engines.errno.EINVAL, 'Invalid argument')
+
+        with mock.patch('delivery.services.transfer_engines._copy_range', side_effect=unsupported):
+            result = yield self._transfer(NativeTransferEngine(buffer_size=1024 * 1024))
+
+        self.assertTrue(result.successful)
+        self._assert_copied(self.staging_order.get_staging_path())
+
+    @gen_test
+    def test_transfer_resumes_interrupted_transfer(self):
+        staging_path = self.staging_order.get_staging_path()
+        yield self._transfer(NativeTransferEngine())
+
+        # A file which was only partly copied, which should be copied again, and one which was completely copied
+        partly_copied = os.path.join(staging_path, 'Sample_1', 'big.fastq.gz')
+        with open(partly_copied, 'r+b') as f:
+            f.truncate(1024)
+
+        copied_bytes = []
+        original_copy_range = transfer_engines._copy_range
+
+        def copy_range(*args):
+            nbr_of_bytes = original_copy_range(*args)
+            copied_bytes.append(nbr_of_bytes)
+            return nbr_of_bytes
+
+        with mock.patch('delivery.services.transfer_engines._copy_range', side_effect=copy_range):
+            result = yield self._transfer(NativeTransferEngine())
+
+        self.assertTrue(result.successful)
+        self._assert_copied(staging_path)
+        # Only the partly copied file is copied again
+        self.assertEqual(sum(copied_bytes), len(self.file_contents['Sample_1/big.fastq.gz']))
+
+    @gen_test
+    def test_transfer_with_bandwidth_limit(self):
+        governor = mock.create_autospec(BandwidthGovernor)
+        governor.reserve.return_value = 0
+        result = yield self._transfer(NativeTransferEngine(buffer_size=1024 * 1024, bandwidth_governor=governor))
+
+        self.assertTrue(result.successful)
+        governor.transfer_started.assert_called_once_with(1, self.staging_dir)
+        governor.transfer_finished.assert_called_once_with(1)
+        self.assertEqual(sum(call[0][1] for call in governor.reserve.call_args_list), result.size)
+
+    @gen_test
+    def test_cancel_while_waiting_for_bandwidth(self):
+        governor = BandwidthGovernor(limit=1024)
+        engine = NativeTransferEngine(buffer_size=1024 * 1024, bandwidth_governor=governor)
+
+        transfer = self._transfer(engine)
+        # The first chunk puts the transfer about an hour in debt
+        yield gen.sleep(0.1)
+        engine.cancel(self.staging_order)
+        result = yield transfer
+
+        self.assertFalse(result.successful)
+        self.assertIn('cancelled', result.message)
+
+    @gen_test
+    def test_transfer_fails(self):
+        engine = NativeTransferEngine()
+        original_copy_range = transfer_engines._copy_range
+
+        def fail_small_files(source_fd, target_fd, offset, count):
+            # The big files are still being copied when a small file fails, and are then cancelled
+            if os.fstat(source_fd).st_size > 1024:
+                while self.staging_order.id not in engine._cancelled_transfers:
+                    time.sleep(0.001)
+                return original_copy_range(source_fd, target_fd, offset, count)
+            raise OSError(transfer_engines.errno.EIO, 'Input/output error')
+
+        with mock.patch('delivery.services.transfer_engines._copy_range', side_effect=fail_small_files):
+            result = yield self._transfer(engine)
+
+        self.assertFalse(result.successful)
+        self.assertIn('Input/output error', result.message)
+
+    @gen_test
+    def test_cancel(self):
+        engine = NativeTransferEngine(buffer_size=1024)
+
+        with self.assertRaises(OSError):
+            engine.cancel(self.staging_order)
+
+        original_copy_range = transfer_engines._copy_range
+
+        def cancel_after_first_chunk(*args):
+            engine.cancel(self.staging_order)
+            return original_copy_range(*args)
+
+        with mock.patch('delivery.services.transfer_engines._copy_range', side_effect=cancel_after_first_chunk):
+            result = yield self._transfer(engine)
+
+        self.assertFalse(result.successful)
+        self.assertIn('cancelled', result.message)